@@ -0,0 +1,82 @@
+import threading
+
+
+class AudioRingBuffer:
+    """Fixed-capacity single-producer / single-consumer byte ring backed by a preallocated bytearray.
+
+    The audio callback (producer) copies each frame into the ring without taking a lock:
+    it only advances _write_total and the consumer only advances _read_total. If the
+    consumer falls so far behind that a frame does not fit, the frame is dropped and
+    counted in overruns rather than overwriting unread audio.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._write_total = 0
+        self._read_total = 0
+        self._data_ready = threading.Event()
+        self.overruns = 0
+        self.closed = False
+
+    def __len__(self):
+        return self._write_total - self._read_total
+
+    def write(self, data):
+        n = len(data)
+        if n > self.capacity - (self._write_total - self._read_total):
+            self.overruns += 1
+            return False
+
+        start = self._write_total % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            # Common case: one memcpy into the preallocated storage, no temporary objects
+            self._buf[start:end] = data
+        else:
+            first = self.capacity - start
+            data = memoryview(data)
+            self._buf[start:] = data[:first]
+            self._buf[:n - first] = data[first:]
+        self._write_total += n
+
+        # Event.set takes a lock, so only pay for it when the consumer is waiting
+        if not self._data_ready.is_set():
+            self._data_ready.set()
+        return True
+
+    def views(self):
+        """Zero-copy memoryviews over all unread data (two when it wraps). Call consume() after use."""
+        available = self._write_total - self._read_total
+        start = self._read_total % self.capacity
+        if start + available <= self.capacity:
+            return [self._view[start:start + available]], available
+        return [self._view[start:], self._view[:start + available - self.capacity]], available
+
+    def consume(self, n):
+        self._read_total += n
+
+    def read(self, timeout=None):
+        """Block until data is available and return all of it as one bytes object.
+
+        Returns None once the buffer is closed and drained, or b"" if the timeout expires.
+        """
+        while True:
+            self._data_ready.clear()
+            if self._write_total != self._read_total:
+                break
+            if self.closed:
+                return None
+            if not self._data_ready.wait(timeout):
+                return b""
+
+        views, available = self.views()
+        # One copy out of the ring; the join avoids an intermediate copy when the data wraps
+        data = bytes(views[0]) if len(views) == 1 else b"".join(views)
+        self.consume(available)
+        return data
+
+    def close(self):
+        self.closed = True
+        self._data_ready.set()
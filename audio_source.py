@@ -0,0 +1,121 @@
+import mmap
+import struct
+import time
+from abc import ABC, abstractmethod
+
+from config import AUDIO_FILE, AUDIO_SPEED, RATE, CHUNK
+
+# paInt16 mono
+BYTES_PER_FRAME = 2
+
+
+class AudioSource(ABC):
+    """A context manager that yields paInt16 mono audio chunks from generator()."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    @abstractmethod
+    def generator(self):
+        ...
+
+
+class FileAudioSource(AudioSource):
+    """Audio from a WAV or raw 16-bit PCM file, memory-mapped and yielded in chunk-sized slices.
+
+    Only the slice being yielded is copied out of the map, so hours of recording do not
+    have to fit in memory. speed paces the output: 1.0 is real time, 4.0 is four times
+    faster, and 0 yields chunks as fast as the consumer takes them.
+    """
+
+    def __init__(self, path, rate, chunk, speed=1.0):
+        self.path = path
+        self._rate = rate
+        self._chunk = chunk
+        self.speed = speed
+        self._file = None
+        self._map = None
+        self._data_start = 0
+        self._data_end = 0
+        self.closed = True
+
+    def __enter__(self):
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._map[:4] == b"RIFF":
+                self._data_start, self._data_end = self._wav_data_range()
+            else:
+                self._data_start, self._data_end = 0, len(self._map)
+        except ValueError:
+            self._map.close()
+            self._file.close()
+            raise
+        self.closed = False
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.closed = True
+        self._map.close()
+        self._file.close()
+
+    @property
+    def duration_seconds(self):
+        return (self._data_end - self._data_start) / (self._rate * BYTES_PER_FRAME)
+
+    def _wav_data_range(self):
+        if self._map[8:12] != b"WAVE":
+            raise ValueError(f"{self.path}: not a WAV file")
+
+        pos = 12
+        fmt = None
+        while pos + 8 <= len(self._map):
+            chunk_id = self._map[pos:pos + 4]
+            (size,) = struct.unpack("<I", self._map[pos + 4:pos + 8])
+            body = pos + 8
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", self._map[body:body + 16])
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"{self.path}: data chunk before fmt chunk")
+                audio_format, channels, rate, _, _, bits = fmt
+                if audio_format != 1 or channels != 1 or bits != 16:
+                    raise ValueError(f"{self.path}: expected 16-bit mono PCM, got format {audio_format}, {channels} channels, {bits} bits")
+                if rate != self._rate:
+                    raise ValueError(f"{self.path}: sample rate {rate} Hz does not match {self._rate} Hz")
+                # Some writers leave the data size at 0 or 0xFFFFFFFF when streaming
+                end = len(self._map) if size in (0, 0xFFFFFFFF) else min(body + size, len(self._map))
+                return body, end
+            # Chunks are word-aligned
+            pos = body + size + (size & 1)
+
+        raise ValueError(f"{self.path}: no data chunk")
+
+    def generator(self):
+        chunk_bytes = self._chunk * BYTES_PER_FRAME
+        chunk_seconds = self._chunk / self._rate
+        start = time.monotonic()
+        sent = 0
+
+        for offset in range(self._data_start, self._data_end, chunk_bytes):
+            if self.closed:
+                return
+            if self.speed > 0:
+                # Pace against the start time so sleep overshoot does not accumulate
+                delay = start + sent * chunk_seconds / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield self._map[offset:min(offset + chunk_bytes, self._data_end)]
+            sent += 1
+
+
+def open_audio_source(path=AUDIO_FILE, speed=AUDIO_SPEED, rate=RATE, chunk=CHUNK):
+    """The configured audio source: a file when path is set, otherwise the microphone."""
+    if path:
+        return FileAudioSource(path, rate, chunk, speed=speed)
+
+    from microphone_stream import MicrophoneStream
+    return MicrophoneStream(rate, chunk)
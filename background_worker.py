@@ -0,0 +1,94 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+
+class BackgroundWorker:
+    """Runs a function on a background thread, fed by a queue.
+
+    Every submit() returns a Future resolved with the function's result, and the
+    optional on_result callback is invoked from the worker thread as well.
+
+    With coalesce=True at most one job waits behind the running one: a submit() while a
+    job is still queued replaces that job's arguments with its own and returns the same
+    Future, so superseded work is dropped before it runs and bursts collapse into one job.
+    """
+
+    def __init__(self, fn, on_result=None, name="background-worker", coalesce=False):
+        self._fn = fn
+        self._on_result = on_result
+        self._queue = queue.Queue()
+        self.closed = False
+        self.name = name
+        self.coalesce = coalesce
+        self.superseded = 0
+        # [future, args] of the job waiting in the queue, while coalescing
+        self._queued = None
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, *args):
+        if self.closed:
+            raise RuntimeError("BackgroundWorker is closed")
+
+        with self._lock:
+            if self.coalesce and self._queued is not None and not self._queued[0].cancelled():
+                self._queued[1] = args
+                self.superseded += 1
+                metrics.inc("worker_jobs_superseded", worker=self.name)
+                return self._queued[0]
+
+            future = Future()
+            job = [future, args]
+            if self.coalesce:
+                self._queued = job
+            self._queue.put(job)
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every job submitted so far has been processed."""
+        self._queue.join()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+
+            with self._lock:
+                if self._queued is job:
+                    self._queued = None
+                future, args = job
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = self._fn(*args)
+                except Exception as e:
+                    print(f"Error in background worker: {e}")
+                    future.set_exception(e)
+                    continue
+
+                future.set_result(result)
+                if self._on_result:
+                    try:
+                        self._on_result(result)
+                    except Exception as e:
+                        print(f"Error in background worker callback: {e}")
+            finally:
+                self._queue.task_done()
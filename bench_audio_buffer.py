@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the MicrophoneStream buffer: the previous queue.Queue + b"".join design
+versus AudioRingBuffer, at 16 kHz and 48 kHz with 100 ms paInt16 mono frames.
+
+For each design it reports the audio-callback cost per frame, the generator-side drain cost
+per yield, and the heap bytes allocated per second of real-time audio (tracemalloc).
+
+    python bench_audio_buffer.py --frames 20000
+"""
+
+import argparse
+import queue
+import statistics
+import time
+import tracemalloc
+
+from audio_ring_buffer import AudioRingBuffer
+from microphone_stream import BYTES_PER_FRAME
+
+
+class QueueBuffer:
+    """The original MicrophoneStream buffering, kept here as the baseline."""
+
+    def __init__(self):
+        self._buff = queue.Queue()
+
+    def write(self, in_data):
+        self._buff.put(in_data)
+
+    def read(self):
+        chunk = self._buff.get()
+        data = [chunk]
+        while True:
+            try:
+                data.append(self._buff.get(block=False))
+            except queue.Empty:
+                break
+        return b"".join(data)
+
+
+def bench(make_buffer, frame, frames, frames_per_yield):
+    buffer = make_buffer()
+    callback_ns = []
+    drain_ns = []
+
+    for i in range(frames):
+        start = time.perf_counter_ns()
+        buffer.write(frame)
+        callback_ns.append(time.perf_counter_ns() - start)
+
+        if (i + 1) % frames_per_yield == 0:
+            start = time.perf_counter_ns()
+            buffer.read()
+            drain_ns.append(time.perf_counter_ns() - start)
+
+    # Heap churn: bytes allocated (transiently) per write+drain cycle
+    tracemalloc.start()
+    cycles = min(frames // frames_per_yield, 2000)
+    allocated = 0
+    for _ in range(cycles):
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        for _ in range(frames_per_yield):
+            buffer.write(frame)
+        buffer.read()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - base
+    tracemalloc.stop()
+
+    callback_ns.sort()
+    return {
+        "callback_mean_ns": statistics.fmean(callback_ns),
+        "callback_p99_ns": callback_ns[int(len(callback_ns) * 0.99)],
+        "drain_mean_us": statistics.fmean(drain_ns) / 1000,
+        "allocated_per_cycle": allocated / cycles,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=20000, help="Callback invocations per run")
+    parser.add_argument("--frames-per-yield", type=int, default=1, help="Frames buffered between generator yields")
+    args = parser.parse_args()
+
+    print(f"{'rate':>6} {'buffer':<8} {'callback mean':>14} {'callback p99':>13} {'drain/yield':>12} {'alloc/s audio':>14}")
+    for rate in (16000, 48000):
+        chunk = rate // 10
+        frame = bytes(chunk * BYTES_PER_FRAME)
+        yields_per_second = (rate / chunk) / args.frames_per_yield
+
+        candidates = {
+            "queue": QueueBuffer,
+            "ring": lambda: AudioRingBuffer(rate * 30 * BYTES_PER_FRAME),
+        }
+        for name, make_buffer in candidates.items():
+            result = bench(make_buffer, frame, args.frames, args.frames_per_yield)
+            print(
+                f"{rate:>6} {name:<8} "
+                f"{result['callback_mean_ns']:>11.0f} ns "
+                f"{result['callback_p99_ns']:>10.0f} ns "
+                f"{result['drain_mean_us']:>9.2f} us "
+                f"{result['allocated_per_cycle'] * yields_per_second / 1024:>10.1f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
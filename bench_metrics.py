@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Overhead benchmark for metrics.py instrumentation.
+
+Times an empty with-block, then the same block wrapped in metrics.span() with metrics disabled
+and enabled, plus observe() and inc(), and checks histogram quantiles against exact ones.
+
+    python bench_metrics.py --iterations 1000000
+"""
+
+import argparse
+import random
+import time
+
+from metrics import Histogram, MetricsRegistry
+
+
+def per_call_ns(fn, iterations):
+    start = time.perf_counter()
+    fn(iterations)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def baseline(n):
+        for _ in range(n):
+            pass
+
+    def spans(registry):
+        def run(n):
+            span = registry.span
+            for _ in range(n):
+                with span("bench"):
+                    pass
+        return run
+
+    def observes(registry):
+        def run(n):
+            observe = registry.observe
+            for _ in range(n):
+                observe("bench", 0.001)
+        return run
+
+    def incs(registry):
+        def run(n):
+            inc = registry.inc
+            for _ in range(n):
+                inc("bench")
+        return run
+
+    base = per_call_ns(baseline, args.iterations)
+    print(f"{'call':<10} {'disabled':>10} {'enabled':>10}")
+    for name, make in (("span", spans), ("observe", observes), ("inc", incs)):
+        cost = [per_call_ns(make(MetricsRegistry(enabled=enabled)), args.iterations) - base for enabled in (False, True)]
+        print(f"{name:<10} {cost[0]:>7.0f} ns {cost[1]:>7.0f} ns")
+
+    rng = random.Random(args.seed)
+    values = sorted(rng.lognormvariate(-3, 1) for _ in range(100000))
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    print("quantile      exact   histogram")
+    for q, estimate in zip((0.5, 0.9, 0.99, 0.999), histogram.quantiles()):
+        exact = values[min(len(values) - 1, int(q * len(values)))]
+        print(f"p{q * 100:<8g} {exact * 1000:>7.2f} ms {estimate * 1000:>7.2f} ms ({(estimate - exact) / exact:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for TranscriptionEngine at 1, 10 and 50 concurrent sessions.
+
+Every session plays synthetic audio into a fake async Speech client, which emits the
+replay harness script as finals as the audio arrives, and Gemini is replaced by the
+harness's fake model with the given latency. For each session count it reports wall time,
+finals processed per second and final -> topic latency percentiles, plus how many LLM
+requests the shared client retried and hedged.
+
+    python bench_sessions.py --sessions 1 10 50 --llm-latency 0.8 --speed 10
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import time
+
+from audio_source import AudioSource, BYTES_PER_FRAME
+from config import RATE, CHUNK
+from llm_client import client as llm_client
+from llm_usage import ledger
+from replay_harness import DEFAULT_SCRIPT, FakeGenerativeModel, LatencyModel, _response, percentile
+from transcription_engine import TranscriptionEngine
+
+
+class SyntheticAudioSource(AudioSource):
+    """Silence paced at `speed` times real time."""
+
+    def __init__(self, seconds, speed):
+        self.chunks = int(seconds * RATE / CHUNK) + 1
+        self.speed = speed
+
+    def generator(self):
+        chunk = bytes(CHUNK * BYTES_PER_FRAME)
+        start = time.monotonic()
+        for i in range(self.chunks):
+            delay = start + i * CHUNK / RATE / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+
+class FakeSpeechAsyncClient:
+    """Emits each scripted utterance as a final once the audio covering it has been sent."""
+
+    def __init__(self, script, word_seconds, asr_latency):
+        self.script = script
+        self.word_seconds = word_seconds
+        self.asr_latency = asr_latency
+
+    async def streaming_recognize(self, requests=None):
+        return self._responses(requests)
+
+    async def _responses(self, requests):
+        ends = []
+        total = 0.0
+        for entry in self.script:
+            total += len(entry["text"].split()) * self.word_seconds
+            ends.append(total)
+
+        audio_seconds = 0.0
+        i = 0
+        async for request in requests:
+            audio_seconds += len(request.audio_content) / (RATE * BYTES_PER_FRAME)
+            while i < len(ends) and audio_seconds >= ends[i]:
+                await asyncio.sleep(self.asr_latency.sample())
+                entry = self.script[i]
+                yield _response(entry["text"], True, int(entry.get("speaker", 1)))
+                i += 1
+
+
+def script_seconds(script, word_seconds):
+    return sum(len(entry["text"].split()) for entry in script) * word_seconds
+
+
+async def run_sessions(count, args, rng):
+    llm_latency = LatencyModel(args.llm_latency, args.llm_jitter, "lognormal", rng, args.llm_error_rate)
+    asr_latency = LatencyModel(args.asr_latency, args.asr_jitter, "lognormal", rng)
+    script = DEFAULT_SCRIPT * args.repeat
+    model = FakeGenerativeModel(llm_latency)
+    ledger.reset()
+    llm_client.reset()
+
+    engine = TranscriptionEngine(
+        max_sessions=max(count, 1),
+        max_llm_jobs=args.max_llm_jobs,
+        speech_client=FakeSpeechAsyncClient(script, args.word_seconds, asr_latency),
+        model=model,
+        vad=False,
+        # Chunk intervals are in wall-clock seconds, so scale them with the playback speed
+        chunk_interval=args.chunk_interval / args.speed,
+        use_cache=args.cache,
+    )
+    seconds = script_seconds(script, args.word_seconds)
+    sources = {f"session-{i}": SyntheticAudioSource(seconds + 1, args.speed) for i in range(count)}
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        start = time.perf_counter()
+        sessions = await engine.run(sources)
+        elapsed = time.perf_counter() - start
+        engine.close()
+
+    latencies = [latency for session in sessions for latency in session.topic_latencies]
+    finals = sum(session.finals for session in sessions)
+    outcomes = llm_client.stats().values()
+    return {
+        "sessions": count,
+        "elapsed": elapsed,
+        "finals": finals,
+        "finals_per_second": finals / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "llm_calls": model.calls,
+        "tokens_per_session": sum(ledger.session_stats(session_id)["input_tokens"] for session_id in sources) / max(count, 1),
+        "unassigned": sum(session.unassigned_finals for session in sessions),
+        "failed": sum(1 for session in sessions if session.error),
+        "retried": sum(stats.get("retried", 0) for stats in outcomes),
+        "hedged": sum(stats.get("hedged", 0) for stats in outcomes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the script this many times per session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Mean fake LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of fake LLM calls that fail with a retryable error")
+    parser.add_argument("--asr-latency", type=float, default=0.2)
+    parser.add_argument("--asr-jitter", type=float, default=0.1)
+    parser.add_argument("--word-seconds", type=float, default=0.3, help="Audio seconds per scripted word")
+    parser.add_argument("--speed", type=float, default=10.0, help="Audio playback speed-up")
+    parser.add_argument("--chunk-interval", type=float, default=20.0, help="Chunker interval in audio seconds")
+    parser.add_argument("--max-llm-jobs", type=int, default=16)
+    parser.add_argument("--cache", action="store_true", help="Keep the shared LLM response cache enabled")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    print(f"{'sessions':>8} {'wall':>8} {'finals':>7} {'finals/s':>9} {'p50 topic':>10} {'p95 topic':>10} {'llm calls':>10} {'in tok/sess':>12} {'unassigned':>11} {'failed':>7} {'retried':>8} {'hedged':>7}")
+    for count in args.sessions:
+        result = asyncio.run(run_sessions(count, args, rng))
+        print(
+            f"{result['sessions']:>8} {result['elapsed']:>7.1f}s {result['finals']:>7} "
+            f"{result['finals_per_second']:>9.1f} {result['p50'] * 1000:>7.0f} ms {result['p95'] * 1000:>7.0f} ms "
+            f"{result['llm_calls']:>10} {result['tokens_per_session']:>12.0f} {result['unassigned']:>11} {result['failed']:>7} "
+            f"{result['retried']:>8} {result['hedged']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
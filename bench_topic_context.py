@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Prompt-size benchmark for topic context as a conversation accumulates topics.
+
+For each topic count it compares the previous context (every topic's "key: summary" line) with
+the token-budgeted context from TopicManager.topic_context, reporting estimated prompt tokens and
+the time to build the context for one chunk.
+
+    python bench_topic_context.py --topics 10 100 1000 5000 --budget 600
+"""
+
+import argparse
+import random
+import time
+
+from llm_usage import estimate_tokens
+from topic_manager import TopicManager
+
+WORDS = (
+    "budget review hiring roadmap launch pricing customer churn onboarding migration "
+    "database latency outage incident vendor contract security audit design sprint "
+    "forecast quarter headcount partner renewal backlog release testing staging rollout"
+).split()
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def full_context(manager):
+    return "\n".join(f"{key}: {topic['summary']}" for key, topic in manager.topics.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--budget", type=int, default=600, help="Topic context token budget")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'topics':>7} {'full':>10} {'budgeted':>10} {'hot/cold':>11} {'build':>10}")
+    for n in args.topics:
+        rng = random.Random(args.seed)
+        manager = TopicManager(model=object(), store_dir="", compact_after=0)
+        for _ in range(n):
+            key = manager.add_new_topic(sentence(rng, 12))
+            manager.extend_topic(key, sentence(rng, 40))
+        chunk = sentence(rng, 60)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            context = manager.topic_context(chunk, budget=args.budget)
+        build_us = (time.perf_counter() - start) / args.repeat * 1e6
+
+        print(
+            f"{n:>7} {estimate_tokens(full_context(manager)):>10} {estimate_tokens(context):>10} "
+            f"{len(manager.index):>5}/{len(manager.cold_index):<5} {build_us:>7.0f} us"
+        )
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Warm-restart benchmark for durable TopicManager state.
+
+Builds a store with --topics topics of --stack content entries each (through the normal
+mutation path, so snapshots roll as they would in production), appends a log tail after the
+last snapshot, then times how long a fresh TopicManager takes to restore it.
+
+    python bench_topic_restart.py --topics 2000 --stack 50 --tail 800
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from topic_manager import TopicManager
+
+WORDS = (
+    "budget review hiring roadmap launch pricing customer churn onboarding migration "
+    "database latency outage incident vendor contract security audit design sprint"
+).split()
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--stack", type=int, default=50, help="Content entries per topic")
+    parser.add_argument("--tail", type=int, default=800, help="Mutations logged after the last snapshot")
+    parser.add_argument("--snapshot-every", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="topic-store-")
+
+    start = time.perf_counter()
+    # Compaction would need a model; this measures restoring the raw content stacks
+    manager = TopicManager(model=object(), store_dir=directory, compact_after=0)
+    manager.store.snapshot_every = args.snapshot_every
+    keys = []
+    for _ in range(args.topics):
+        keys.append(manager.add_new_topic(sentence(rng, 8)))
+    for _ in range(args.stack):
+        for key in keys:
+            manager.extend_topic(key, sentence(rng, 40))
+    # Force a snapshot, then leave an uncompacted tail like a crash would
+    manager.store.snapshot()
+    for _ in range(args.tail):
+        key = rng.choice(keys)
+        if rng.random() < 0.5:
+            manager.update_topic(key, sentence(rng, 8))
+        else:
+            manager.extend_topic(key, sentence(rng, 40))
+    manager.close()
+    build = time.perf_counter() - start
+
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+    start = time.perf_counter()
+    restored = TopicManager(model=object(), store_dir=directory, compact_after=0)
+    restore = time.perf_counter() - start
+
+    entries = sum(len(topic["content_stack"]) for topic in restored.topics.values())
+    print(f"store:    {directory} ({size / 1024 / 1024:.1f} MiB, built in {build:.1f} s)")
+    print(
+        f"restored: {len(restored.topics)} topics, {entries} content entries, "
+        f"{len(restored.index)} hot / {len(restored.cold_index)} cold indexed"
+    )
+    print(f"restart:  {restore * 1000:.0f} ms")
+    assert restored.topics == manager.topics, "restored state differs from the original"
+    restored.close()
+
+
+if __name__ == "__main__":
+    main()
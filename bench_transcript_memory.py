@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for transcript line storage at 10k and 100k lines: the previous
+list-of-dicts buffer versus LineStore with its bounded in-memory window and disk spill.
+
+Reports resident heap (tracemalloc) after appending, bytes spilled to disk, append cost
+per line, and the cost of the rolling tail the LLM stages read.
+
+    python bench_transcript_memory.py --lines 10000 100000 --window 2000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from line_store import LineStore
+
+WORDS = (
+    "we should probably look at the budget again before the review next week and "
+    "make sure the numbers for the new project line up with what finance expects"
+).split()
+
+
+def _own(text):
+    # A fresh string per line, as transcript text arriving from Speech would be
+    return text.encode().decode()
+
+
+def make_lines(n, rng):
+    return [
+        (f"[Speaker {rng.randint(1, 4)}] ", " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 24))))
+        for _ in range(n)
+    ]
+
+
+def measure(name, build, lines):
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    store = build(lines)
+    append_ns = (time.perf_counter() - start) / len(lines) * 1e9
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(100):
+        tail = store[-20:] if isinstance(store, list) else store.tail(20)
+    tail_us = (time.perf_counter() - start) / 100 * 1e6
+
+    spilled = 0
+    if isinstance(store, LineStore):
+        spilled = store.spill_bytes
+        store.close()
+    return name, current - base, spilled, append_ns, tail_us, len(tail)
+
+
+def build_dicts(lines):
+    buffer = []
+    for speaker, text in lines:
+        buffer.append({"speaker": speaker, "text": _own(text), "timestamp": time.time()})
+    return buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--window", type=int, default=2000, help="LineStore in-memory window")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def build_store(lines):
+        store = LineStore(window=args.window, spill_dir="")
+        for speaker, text in lines:
+            store.append(speaker, _own(text), time.time())
+        return store
+
+    rng = random.Random(args.seed)
+    print(f"{'lines':>7} {'storage':<12} {'heap':>10} {'spilled':>10} {'append/line':>12} {'tail(20)':>10}")
+    for n in args.lines:
+        lines = make_lines(n, rng)
+        for name, build in (("list[dict]", build_dicts), ("LineStore", build_store)):
+            name, heap, spilled, append_ns, tail_us, _ = measure(name, build, lines)
+            print(
+                f"{n:>7} {name:<12} {heap / 1024:>7.0f} KiB {spilled / 1024:>6.0f} KiB "
+                f"{append_ns:>9.0f} ns {tail_us:>7.1f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,17 +7,161 @@ load_dotenv()
 RATE = 16000
 CHUNK = int(RATE / 10)
 
+# Seconds of audio the microphone ring buffer can hold before frames are dropped
+AUDIO_RING_SECONDS = float(os.environ.get("AUDIO_RING_SECONDS", "30"))
+
+# Transcribe a WAV or raw 16-bit PCM file instead of the microphone. AUDIO_SPEED paces it:
+# 1 is real time, N is N times faster, 0 is unthrottled
+AUDIO_FILE = os.environ.get("AUDIO_FILE", "")
+AUDIO_SPEED = float(os.environ.get("AUDIO_SPEED", "1"))
+
+# Voice activity gate: silent audio is not sent to Speech-to-Text, apart from a keepalive
+VAD_ENABLED = os.environ.get("VAD_ENABLED", "1") == "1"
+VAD_FRAME_MS = int(os.environ.get("VAD_FRAME_MS", "20"))
+VAD_RMS_THRESHOLD = float(os.environ.get("VAD_RMS_THRESHOLD", "300"))
+VAD_ZCR_MAX = float(os.environ.get("VAD_ZCR_MAX", "0.5"))
+VAD_HANGOVER_MS = int(os.environ.get("VAD_HANGOVER_MS", "400"))
+VAD_PREROLL_MS = int(os.environ.get("VAD_PREROLL_MS", "300"))
+VAD_KEEPALIVE_SECONDS = float(os.environ.get("VAD_KEEPALIVE_SECONDS", "5"))
+
+# Streaming sessions are capped by Google (~5 minutes); rotate to a fresh stream before the cap,
+# replaying the last STREAM_OVERLAP_SECONDS of audio into it
+STREAM_ROTATE_SECONDS = float(os.environ.get("STREAM_ROTATE_SECONDS", "270"))
+STREAM_MAX_SECONDS = float(os.environ.get("STREAM_MAX_SECONDS", "290"))
+STREAM_OVERLAP_SECONDS = float(os.environ.get("STREAM_OVERLAP_SECONDS", "3"))
+# A newest stream that dies before its first response is reopened after a backoff that doubles from
+# STREAM_RESTART_BACKOFF_SECONDS up to STREAM_RESTART_MAX_BACKOFF_SECONDS, so a failing service is not hit per audio chunk
+STREAM_RESTART_BACKOFF_SECONDS = float(os.environ.get("STREAM_RESTART_BACKOFF_SECONDS", "0.5"))
+STREAM_RESTART_MAX_BACKOFF_SECONDS = float(os.environ.get("STREAM_RESTART_MAX_BACKOFF_SECONDS", "30"))
+
+# Per-subscriber event queue bound; interim results beyond it drop the oldest queued interim
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", "256"))
+
+# Multi-session engine: sessions running at once, pipeline jobs running at once across all
+# sessions, and finals a session may queue before its audio reading is held back
+ENGINE_MAX_SESSIONS = int(os.environ.get("ENGINE_MAX_SESSIONS", "50"))
+ENGINE_MAX_LLM_JOBS = int(os.environ.get("ENGINE_MAX_LLM_JOBS", "16"))
+ENGINE_SESSION_MAX_PENDING = int(os.environ.get("ENGINE_SESSION_MAX_PENDING", "32"))
+
+# Stage latency histograms, counters and gauges (metrics.py). METRICS_PORT serves Prometheus text at
+# /metrics and METRICS_JSON_PATH gets a JSON dump every METRICS_JSON_INTERVAL_SECONDS (both off when unset)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_JSON_PATH = os.environ.get("METRICS_JSON_PATH", "")
+METRICS_JSON_INTERVAL_SECONDS = float(os.environ.get("METRICS_JSON_INTERVAL_SECONDS", "10"))
+
 LANGUAGE_CODE = "en-US"
 
 MIN_SPEAKER_COUNT = 2
 MAX_SPEAKER_COUNT = 6
 
 CLEAN_INTERVAL_SECONDS = int(os.environ.get("CLEAN_INTERVAL_SECONDS", "5"))
+# Base interval between TranscriptBufferChunker runs
+CHUNK_INTERVAL_SECONDS = float(os.environ.get("CHUNK_INTERVAL_SECONDS", "10"))
+
+# Cleaning and chunking runs fire on a timer: after the interval, after SCHEDULER_IDLE_SECONDS without a
+# new line, once SCHEDULER_MAX_PENDING_LINES lines are waiting, or on topic_finished. The interval
+# stretches to SCHEDULER_LATENCY_FACTOR times the smoothed run latency, and further with the lines that
+# piled up during a run, within [SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL]
+SCHEDULER_IDLE_SECONDS = float(os.environ.get("SCHEDULER_IDLE_SECONDS", "3"))
+SCHEDULER_MAX_PENDING_LINES = int(os.environ.get("SCHEDULER_MAX_PENDING_LINES", "40"))
+SCHEDULER_LATENCY_FACTOR = float(os.environ.get("SCHEDULER_LATENCY_FACTOR", "2"))
+SCHEDULER_MIN_INTERVAL = float(os.environ.get("SCHEDULER_MIN_INTERVAL", "1"))
+SCHEDULER_MAX_INTERVAL = float(os.environ.get("SCHEDULER_MAX_INTERVAL", "60"))
+
+# Only send lines added since the last clean, plus this many already-cleaned lines as context
+CLEAN_INCREMENTAL = os.environ.get("CLEAN_INCREMENTAL", "1") == "1"
+CLEAN_CONTEXT_LINES = int(os.environ.get("CLEAN_CONTEXT_LINES", "20"))
+
+# Transcript lines kept in memory; older lines spill to an append-only log (TRANSCRIPT_SPILL_DIR,
+# or an anonymous temporary file when unset)
+TRANSCRIPT_WINDOW_LINES = int(os.environ.get("TRANSCRIPT_WINDOW_LINES", "2000"))
+TRANSCRIPT_SPILL_DIR = os.environ.get("TRANSCRIPT_SPILL_DIR", "")
+
+# TranscriptBufferChunker: clean, chunk and classify in one structured Gemini call
+CHUNKER_FUSED = os.environ.get("CHUNKER_FUSED", "1") == "1"
+# Upper bound on concurrent per-chunk classify_chunk calls in the multi-call path
+CLASSIFY_MAX_WORKERS = int(os.environ.get("CLASSIFY_MAX_WORKERS", "4"))
 
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
 LOCATION = os.environ.get("GOOGLE_CLOUD_LOCATION", "us-central1")
 
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+
+# Local topic index: matches scoring above the threshold (and clear of the runner-up by
+# the margin) skip the LLM; otherwise only the top TOPIC_SHORTLIST_SIZE topics are sent
+TOPIC_INDEX_DIM = int(os.environ.get("TOPIC_INDEX_DIM", "1024"))
+TOPIC_SHORTLIST_SIZE = int(os.environ.get("TOPIC_SHORTLIST_SIZE", "5"))
+TOPIC_MATCH_THRESHOLD = float(os.environ.get("TOPIC_MATCH_THRESHOLD", "0.6"))
+TOPIC_MATCH_MARGIN = float(os.environ.get("TOPIC_MATCH_MARGIN", "0.15"))
+
+# Topic prompt context: candidates ranked by index relevance plus TOPIC_RECENCY_WEIGHT times a recency
+# score (halving every TOPIC_RECENCY_HALF_LIFE topic updates), cut to TOPIC_CONTEXT_TOKENS (estimated)
+TOPIC_CONTEXT_TOKENS = int(os.environ.get("TOPIC_CONTEXT_TOKENS", "600"))
+TOPIC_CONTEXT_CANDIDATES = int(os.environ.get("TOPIC_CONTEXT_CANDIDATES", "20"))
+TOPIC_RECENCY_WEIGHT = float(os.environ.get("TOPIC_RECENCY_WEIGHT", "0.3"))
+TOPIC_RECENCY_HALF_LIFE = float(os.environ.get("TOPIC_RECENCY_HALF_LIFE", "50"))
+
+# Topics not updated for TOPIC_COLD_AFTER topic updates (0 keeps every topic hot) move to a cold index,
+# searched only when no hot topic scores TOPIC_HOT_MIN_SCORE
+TOPIC_COLD_AFTER = int(os.environ.get("TOPIC_COLD_AFTER", "500"))
+TOPIC_HOT_MIN_SCORE = float(os.environ.get("TOPIC_HOT_MIN_SCORE", "0.6"))
+
+# Once a content_stack passes TOPIC_STACK_MAX_ENTRIES, all but the newest TOPIC_STACK_KEEP entries are
+# folded into the topic's rolling digest in the background (0 disables)
+TOPIC_STACK_MAX_ENTRIES = int(os.environ.get("TOPIC_STACK_MAX_ENTRIES", "24"))
+TOPIC_STACK_KEEP = int(os.environ.get("TOPIC_STACK_KEEP", "8"))
+
+# Topic keys are generated locally; set to 1 to also fetch a friendlier LLM label in the background
+TOPIC_LLM_RELABEL = os.environ.get("TOPIC_LLM_RELABEL", "0") == "1"
+
+# Durable topic state: mutations go to an append-only log in TOPIC_STORE_DIR (disabled when unset),
+# compacted into a snapshot every TOPIC_SNAPSHOT_EVERY records
+TOPIC_STORE_DIR = os.environ.get("TOPIC_STORE_DIR", "")
+TOPIC_SNAPSHOT_EVERY = int(os.environ.get("TOPIC_SNAPSHOT_EVERY", "1000"))
+TOPIC_STORE_FSYNC = os.environ.get("TOPIC_STORE_FSYNC", "0") == "1"
+
+# Shared LLM response cache; set LLM_CACHE_PATH to a SQLite file to add a disk tier
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "")
+
+# LLM token accounting and prompt budgets. LLM_PROMPT_BUDGETS is "call_site=tokens,..." with
+# LLM_PROMPT_MAX_TOKENS for every other call site (0 = unlimited); an over-budget prompt has its topic or
+# context section cut in the middle, or is rejected, per LLM_BUDGET_ACTION ("truncate" or "reject"). A prompt
+# that is still over budget without that section, or has none, is always rejected. A session whose input
+# tokens reach LLM_SESSION_TOKEN_BUDGET has further calls rejected (0 = unlimited)
+LLM_PROMPT_BUDGETS = os.environ.get("LLM_PROMPT_BUDGETS", "")
+LLM_PROMPT_MAX_TOKENS = int(os.environ.get("LLM_PROMPT_MAX_TOKENS", "0"))
+LLM_BUDGET_ACTION = os.environ.get("LLM_BUDGET_ACTION", "truncate")
+LLM_SESSION_TOKEN_BUDGET = int(os.environ.get("LLM_SESSION_TOKEN_BUDGET", "0"))
+
+# Shared wrapper around every Vertex call (llm_client.py). Requests pass a token bucket of
+# LLM_RATE_LIMIT_PER_SECOND with LLM_RATE_LIMIT_BURST (0 = unlimited); retryable errors (quota,
+# unavailable, timeouts) are retried up to LLM_MAX_ATTEMPTS attempts with full-jitter exponential backoff;
+# LLM_CALL_DEADLINE_SECONDS bounds a call including its retries (0 = none). With LLM_HEDGE_ENABLED an
+# attempt still running past its call site's LLM_HEDGE_QUANTILE latency (once LLM_HEDGE_MIN_SAMPLES calls
+# have been seen) gets a second, hedged request and the first response wins. Off by default: a losing
+# hedge cannot be cancelled, so every hedge is a second paid request
+LLM_RATE_LIMIT_PER_SECOND = float(os.environ.get("LLM_RATE_LIMIT_PER_SECOND", "20"))
+LLM_RATE_LIMIT_BURST = int(os.environ.get("LLM_RATE_LIMIT_BURST", "40"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", "8"))
+LLM_CALL_DEADLINE_SECONDS = float(os.environ.get("LLM_CALL_DEADLINE_SECONDS", "60"))
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_QUANTILE = float(os.environ.get("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Threads running attempts, so deadlines and hedges do not block the calling thread's pool
+LLM_CLIENT_MAX_WORKERS = int(os.environ.get("LLM_CLIENT_MAX_WORKERS", "64"))
+
+# Structured-output calls: total attempts (first try plus repair retries) before falling back
+STRUCTURED_MAX_ATTEMPTS = int(os.environ.get("STRUCTURED_MAX_ATTEMPTS", "2"))
+
+# Stream _clean_buffer / chunk_buffer responses and emit lines and chunks as they complete
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "1") == "1"
+
 GEMINI_SYSTEM_PROMPT = """You are a transcript cleaning and topic analysis assistant. 
 Your task is to:
 1. Clean and format the provided transcript by:
@@ -37,3 +181,18 @@ A topic should be considered "finished" when:
 - The main point or question has been fully addressed
 
 Provide the cleaned transcript in the cleaned_transcript field and set topic_finished to true if the topic has concluded, false otherwise."""
+
+GEMINI_INCREMENTAL_PROMPT = """You are a transcript cleaning and topic analysis assistant.
+You will be given some already-cleaned context lines followed by new raw transcript lines.
+
+1. Clean ONLY the new lines by:
+   - Removing filler words (um, uh, like, you know, etc.)
+   - Fixing grammar and punctuation
+   - Maintaining speaker labels
+   - Keeping the original meaning intact
+   - Making it more readable while staying faithful to the content
+   Return exactly one cleaned line per new line, in the same order, in the cleaned_lines field.
+   Do not repeat or modify the context lines.
+
+2. Using the context and the new lines together, set topic_finished to true if the current topic
+or conversation thread has reached a natural conclusion, false otherwise."""
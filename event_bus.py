@@ -0,0 +1,270 @@
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from config import EVENT_QUEUE_SIZE
+import metrics
+from word_timeline import WordTimeline
+
+
+@dataclass
+class Event:
+    # perf_counter() at publish time, used for subscriber lag
+    published_at: float = field(default=0.0, init=False)
+
+
+@dataclass
+class InterimEvent(Event):
+    text: str = ""
+
+
+@dataclass
+class FinalEvent(Event):
+    text: str = ""
+    speaker_tag: str = ""
+    # Session audio offsets in seconds, when word time offsets are available
+    start: Optional[float] = None
+    end: Optional[float] = None
+
+
+@dataclass
+class CleanedEvent(Event):
+    lines: List[str] = field(default_factory=list)
+    topic_finished: bool = False
+
+
+@dataclass
+class TopicAssignedEvent(Event):
+    topic_key: Optional[str] = None
+    lines: List[str] = field(default_factory=list)
+
+
+# Safe to lose under load: a newer interim supersedes an older one
+DROPPABLE_EVENTS = (InterimEvent,)
+
+
+class Subscription:
+    """One subscriber's bounded queue and delivery thread.
+
+    When the queue is full, an incoming droppable event replaces the oldest queued droppable
+    event (or is dropped if none is queued); any other event blocks the publisher until the
+    subscriber catches up, so finals are never lost.
+    """
+
+    def __init__(self, name, handler, event_types, maxsize):
+        self.name = name
+        self.handler = handler
+        self.event_types = event_types
+        self.maxsize = maxsize
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=f"subscriber-{name}", daemon=True)
+        self._thread.start()
+
+    def wants(self, event):
+        return self.event_types is None or isinstance(event, self.event_types)
+
+    def put(self, event):
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) >= self.maxsize:
+                if isinstance(event, DROPPABLE_EVENTS):
+                    oldest = next((queued for queued in self._queue if isinstance(queued, DROPPABLE_EVENTS)), None)
+                    self.dropped += 1
+                    metrics.inc("events_dropped", subscriber=self.name)
+                    if oldest is None:
+                        return
+                    self._queue.remove(oldest)
+                else:
+                    while len(self._queue) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+            self._queue.append(event)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            metrics.set_gauge("event_queue_depth", len(self._queue), subscriber=self.name)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                event = self._queue.popleft()
+                self._cond.notify_all()
+
+            lag = time.perf_counter() - event.published_at
+            self.last_lag = lag
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("event_delivery_lag", lag, subscriber=self.name)
+            try:
+                self.handler(event)
+            except Exception as e:
+                self.errors += 1
+                metrics.inc("event_handler_errors", subscriber=self.name)
+                print(f"Subscriber {self.name} failed on {type(event).__name__}: {e}")
+            self.delivered += 1
+
+    def stats(self):
+        return {
+            "depth": len(self._queue),
+            "max_depth": self.max_depth,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "mean_lag_ms": self.total_lag / self.delivered * 1000 if self.delivered else 0.0,
+            "max_lag_ms": self.max_lag * 1000,
+            "last_lag_ms": self.last_lag * 1000,
+        }
+
+
+class EventBus:
+    """Typed pub/sub for transcription events.
+
+    Each subscriber gets its own bounded queue and thread, so a slow sink (terminal I/O,
+    Gemini calls) only delays itself and never the Speech response loop that publishes.
+    """
+
+    def __init__(self, maxsize=EVENT_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.subscriptions = []
+
+    def subscribe(self, name, handler, event_types=None, maxsize=None):
+        """Deliver events that are instances of event_types (a type or tuple; None for all) to handler."""
+        subscription = Subscription(name, handler, event_types, maxsize or self.maxsize)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, name):
+        """Deliver what is already queued for subscriber `name`, then stop and remove it."""
+        for subscription in [s for s in self.subscriptions if s.name == name]:
+            subscription.close()
+            self.subscriptions.remove(subscription)
+
+    def publish(self, event):
+        event.published_at = time.perf_counter()
+        for subscription in self.subscriptions:
+            if subscription.wants(event):
+                subscription.put(event)
+
+    def stats(self):
+        return {subscription.name: subscription.stats() for subscription in self.subscriptions}
+
+    def print_stats(self):
+        for name, stats in self.stats().items():
+            print(
+                f"[{name}] delivered={stats['delivered']} dropped={stats['dropped']} "
+                f"max_depth={stats['max_depth']} lag mean={stats['mean_lag_ms']:.1f} ms max={stats['max_lag_ms']:.1f} ms"
+            )
+
+    def close(self):
+        """Deliver everything already queued, then stop the subscriber threads."""
+        for subscription in self.subscriptions:
+            subscription.close()
+
+
+def publish_responses(responses, bus, timeline=None):
+    """Turn Speech streaming responses into InterimEvent and FinalEvent.
+
+    Final results are split into speaker turns using their per-word speaker tags (one
+    FinalEvent per turn), and the words are recorded in timeline when one is given.
+    """
+    timeline = timeline if timeline is not None else WordTimeline()
+    # When the current utterance's first interim arrived, for first-interim-to-final latency
+    utterance_start = None
+    for response in responses:
+        with metrics.span("speech_response"):
+            interim = []
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                alternative = result.alternatives[0]
+                if result.is_final:
+                    metrics.inc("speech_results", kind="final")
+                    if utterance_start is not None:
+                        metrics.observe("speech_final", time.perf_counter() - utterance_start)
+                        utterance_start = None
+                    _publish_final(alternative, bus, timeline)
+                else:
+                    metrics.inc("speech_results", kind="interim")
+                    interim.append(alternative.transcript)
+
+            # Later results are the less stable tail of the same utterance
+            if interim:
+                if utterance_start is None:
+                    utterance_start = time.perf_counter()
+                bus.publish(InterimEvent(text="".join(interim)))
+
+
+def _publish_final(alternative, bus, timeline):
+    words = getattr(alternative, "words", None)
+    if not words:
+        bus.publish(FinalEvent(text=alternative.transcript))
+        return
+
+    turns = timeline.add_words(words)
+    if len(turns) == 1:
+        # Keep Speech's own formatting of the transcript when nobody else spoke
+        turn = turns[0]
+        bus.publish(FinalEvent(text=alternative.transcript, speaker_tag=_speaker_label(turn.speaker_tag), start=turn.start, end=turn.end))
+        return
+    for turn in turns:
+        bus.publish(FinalEvent(text=turn.text, speaker_tag=_speaker_label(turn.speaker_tag), start=turn.start, end=turn.end))
+
+
+def _speaker_label(speaker_tag):
+    return f"[Speaker {speaker_tag}] "
+
+
+class ConsoleRenderer:
+    """Renders interim results in place on one line and prints finals, cleaned lines and topic assignments."""
+
+    def __init__(self, out=None):
+        self.out = out
+        self._chars_printed = 0
+
+    def handle(self, event):
+        out = self.out or sys.stdout
+        if isinstance(event, InterimEvent):
+            overwrite_chars = " " * (self._chars_printed - len(event.text))
+            out.write(event.text + overwrite_chars + "\r")
+            out.flush()
+            self._chars_printed = len(event.text)
+        elif isinstance(event, FinalEvent):
+            self._print_line(out, event.speaker_tag + event.text)
+        elif isinstance(event, CleanedEvent):
+            for line in event.lines:
+                self._print_line(out, "  cleaned: " + line)
+            if event.topic_finished:
+                self._print_line(out, "  -- topic finished --")
+        elif isinstance(event, TopicAssignedEvent):
+            self._print_line(out, f"  [topic {event.topic_key}] {len(event.lines)} line(s)")
+
+    def _print_line(self, out, text):
+        # Overwrites whatever interim is still on the current line
+        overwrite_chars = " " * (self._chars_printed - len(text))
+        out.write(text + overwrite_chars + "\n")
+        out.flush()
+        self._chars_printed = 0
@@ -43,6 +43,9 @@ def example_usage():
         buffer.add_transcript(text, speaker)
         time.sleep(0.5)  # Small delay to simulate real conversation
     
+    # Cleaning runs in the background; wait for it before reading results
+    buffer.flush()
+    
     print("\n" + "=" * 60)
     print("📊 Results:")
     print("=" * 60)
@@ -58,13 +61,16 @@ def example_usage():
     if buffer.last_cleaning_result:
         result = buffer.last_cleaning_result
         print("Cleaned transcript:")
-        print(result.cleaned_transcript)
+        print(buffer.get_cleaned_transcript() or result.cleaned_transcript)
         print(f"\nTopic finished: {result.topic_finished}")
         
         # Use convenience methods
         print(f"\nIs topic finished: {buffer.is_topic_finished()}")
     else:
         print("No cleaning result yet (waiting for interval)")
+
+    # Spilled lines cannot be read once the buffer is closed
+    buffer.close()
     
     print("\n" + "=" * 60)
     print("✅ Example completed!")
@@ -0,0 +1,180 @@
+import threading
+import time
+
+from config import (
+    SCHEDULER_IDLE_SECONDS,
+    SCHEDULER_MAX_PENDING_LINES,
+    SCHEDULER_LATENCY_FACTOR,
+    SCHEDULER_MIN_INTERVAL,
+    SCHEDULER_MAX_INTERVAL,
+)
+import metrics
+
+# Weight of the newest run in the smoothed run latency
+LATENCY_SMOOTHING = 0.3
+
+
+class IntervalScheduler:
+    """Decides when buffered transcript lines are processed, independently of new lines arriving.
+
+    A run is due, once at least one line is pending, when any of these holds:
+    - "signal": signal() was called, e.g. on topic_finished
+    - "volume": max_pending lines are waiting
+    - "interval": the current interval has passed since the last run
+    - "idle": no line has arrived for idle_seconds, so the tail of a conversation is not
+      left waiting for someone to speak again
+
+    After each run the interval adapts: it is at least latency_factor times the smoothed run
+    latency, stretched further by the lines that piled up while the run was in flight, and
+    otherwise settles back to base_interval, always within [min_interval, max_interval]. Busy
+    periods therefore batch more lines per LLM call and quiet ones are still processed.
+
+    With start(fire), a timer thread calls fire() whenever a run is due and once more on
+    close() for anything still pending. Without it the owner polls due_reason() and
+    wait_time() itself and brackets each run with run_started() and run_finished().
+    """
+
+    def __init__(
+        self,
+        base_interval,
+        name="scheduler",
+        idle_seconds=SCHEDULER_IDLE_SECONDS,
+        max_pending=SCHEDULER_MAX_PENDING_LINES,
+        latency_factor=SCHEDULER_LATENCY_FACTOR,
+        min_interval=SCHEDULER_MIN_INTERVAL,
+        max_interval=SCHEDULER_MAX_INTERVAL,
+    ):
+        self.name = name
+        self.base_interval = base_interval
+        self.idle_seconds = idle_seconds
+        self.max_pending = max_pending
+        self.latency_factor = latency_factor
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.interval = self._clamp(base_interval)
+        self.latency = None
+        self.pending = 0
+        self.runs = 0
+        self.last_run = time.monotonic()
+        self.last_line = None
+        self.running = False
+        self._signalled = False
+        self._run_start = 0.0
+
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._fire = None
+
+    def note(self, lines=1):
+        """Record newly buffered lines."""
+        with self._cond:
+            self.pending += lines
+            self.last_line = time.monotonic()
+            self._cond.notify_all()
+
+    def signal(self):
+        """Make the pending lines due at once; ignored when nothing is pending."""
+        with self._cond:
+            if self.pending:
+                self._signalled = True
+                self._cond.notify_all()
+
+    def due_reason(self, now=None):
+        """Why a run is due now, or None."""
+        if self.pending == 0 or self.running:
+            return None
+        now = time.monotonic() if now is None else now
+        if self._signalled:
+            return "signal"
+        if self.pending >= self.max_pending:
+            return "volume"
+        if now - self.last_run >= self.interval:
+            return "interval"
+        if now - self.last_line >= self.idle_seconds:
+            return "idle"
+        return None
+
+    def wait_time(self, now=None):
+        """Seconds until a run becomes due, 0 if it is due now, None while nothing is pending."""
+        if self.pending == 0:
+            return None
+        now = time.monotonic() if now is None else now
+        if self.due_reason(now):
+            return 0.0
+        deadline = min(self.last_run + self.interval, self.last_line + self.idle_seconds)
+        return max(deadline - now, 0.0)
+
+    def run_started(self, reason):
+        with self._cond:
+            self.running = True
+            self.pending = 0
+            self._signalled = False
+            self._run_start = time.monotonic()
+        metrics.inc("scheduler_runs", scheduler=self.name, reason=reason)
+
+    def run_finished(self):
+        with self._cond:
+            now = time.monotonic()
+            latency = now - self._run_start
+            self.latency = latency if self.latency is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+            )
+            # Lines that arrived during the run; each one past zero stretches the next interval
+            backlog = self.pending
+            target = max(self.base_interval, self.latency_factor * self.latency)
+            self.interval = self._clamp(target * (1 + backlog / self.max_pending))
+
+            self.runs += 1
+            self.last_run = now
+            self.running = False
+            self._cond.notify_all()
+        metrics.observe("scheduler_run", latency, scheduler=self.name)
+        metrics.set_gauge("scheduler_interval_seconds", self.interval, scheduler=self.name)
+
+    def _clamp(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def start(self, fire):
+        """Call fire() on a timer thread whenever a run is due."""
+        self._fire = fire
+        self._thread = threading.Thread(target=self._loop, name=f"{self.name}-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                reason = None
+                while not self._closed:
+                    reason = self.due_reason()
+                    if reason:
+                        break
+                    self._cond.wait(self.wait_time())
+                if self._closed:
+                    break
+            self._run(reason)
+
+        # Flush on shutdown so nothing buffered is silently dropped
+        if self.pending:
+            self._run("shutdown")
+
+    def _run(self, reason):
+        self.run_started(reason)
+        try:
+            self._fire()
+        except Exception as e:
+            print(f"Error in {self.name} scheduler run: {e}")
+        finally:
+            self.run_finished()
+
+    def close(self):
+        """Stop the timer thread after a final run for any pending lines."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,174 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+
+from config import TRANSCRIPT_WINDOW_LINES, TRANSCRIPT_SPILL_DIR
+
+# timestamp, speaker id, UTF-8 text length; the text bytes follow
+_RECORD = struct.Struct("<dHI")
+
+
+class TranscriptLine:
+    __slots__ = ("speaker", "text", "timestamp")
+
+    def __init__(self, speaker, text, timestamp):
+        self.speaker = speaker
+        self.text = text
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"TranscriptLine({self.speaker!r}, {self.text!r}, {self.timestamp!r})"
+
+
+class LineStore:
+    """Append-only transcript lines with a bounded in-memory window.
+
+    The newest `window` lines live in memory as columns (text list, interned speaker ids,
+    timestamps). Older lines are spilled in batches to an append-only log file and read back
+    through mmap on the rare occasions they are needed, so memory stays flat however long the
+    session runs. Lines are addressed by their absolute index, as with a list, and reads are
+    safe against a concurrent append spilling the lines being read.
+    """
+
+    def __init__(self, window=TRANSCRIPT_WINDOW_LINES, spill_dir=TRANSCRIPT_SPILL_DIR, name="transcript"):
+        self.window = window
+        # Spill a quarter window at a time so the in-memory columns are not shifted per line
+        self.spill_batch = max(1, window // 4)
+
+        self._speakers = []
+        self._speaker_ids = {}
+
+        self._texts = []
+        self._speaker_col = array("H")
+        self._timestamps = array("d")
+
+        # File offset of each spilled line
+        self._offsets = array("Q")
+        self._spill_dir = spill_dir
+        self._name = name
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._offsets) + len(self._texts)
+
+    @property
+    def spilled(self):
+        return len(self._offsets)
+
+    @property
+    def spill_bytes(self):
+        if self._file is None:
+            return 0
+        with self._lock:
+            return self._file.seek(0, os.SEEK_END)
+
+    def append(self, speaker, text, timestamp):
+        with self._lock:
+            speaker_id = self._speaker_ids.get(speaker)
+            if speaker_id is None:
+                speaker_id = len(self._speakers)
+                self._speaker_ids[speaker] = speaker_id
+                self._speakers.append(speaker)
+
+            self._texts.append(text)
+            self._speaker_col.append(speaker_id)
+            self._timestamps.append(timestamp)
+
+            if len(self._texts) > self.window + self.spill_batch:
+                self._spill(len(self._texts) - self.window)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("LineStore slices do not support a step")
+            return self.lines(start, stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("line index out of range")
+        return self.lines(index, index + 1)[0]
+
+    def __iter__(self):
+        # Materialize a window at a time so a full pass never holds the whole transcript
+        start = 0
+        while start < len(self):
+            batch = self.lines(start, start + max(self.window, 1))
+            yield from batch
+            start += len(batch)
+
+    def tail(self, n):
+        """The last n lines; served from memory when n fits in the window."""
+        return self.lines(max(0, len(self) - n), len(self))
+
+    def lines(self, start, stop):
+        with self._lock:
+            stop = min(stop, len(self))
+            return list(self._range(start, stop))
+
+    def _range(self, start, stop):
+        spilled = len(self._offsets)
+        if start < spilled:
+            yield from self._read_spilled(start, min(stop, spilled))
+        for i in range(max(start, spilled) - spilled, stop - spilled):
+            yield TranscriptLine(self._speakers[self._speaker_col[i]], self._texts[i], self._timestamps[i])
+
+    def _spill(self, n):
+        if self._file is None:
+            if self._spill_dir:
+                # Kept after exit so a long session's transcript survives in the spill directory
+                self._file = tempfile.NamedTemporaryFile(dir=self._spill_dir, prefix=f"{self._name}-", suffix=".log", delete=False)
+            else:
+                self._file = tempfile.TemporaryFile(prefix=f"{self._name}-")
+
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        parts = []
+        offsets = array("Q")
+        for i in range(n):
+            data = self._texts[i].encode()
+            parts.append(_RECORD.pack(self._timestamps[i], self._speaker_col[i], len(data)))
+            parts.append(data)
+            offsets.append(offset)
+            offset += _RECORD.size + len(data)
+        self._file.write(b"".join(parts))
+        self._file.flush()
+
+        # Trim the columns before publishing the offsets, so an unlocked len() never counts the
+        # moved lines twice
+        del self._texts[:n]
+        del self._speaker_col[:n]
+        del self._timestamps[:n]
+        self._offsets.extend(offsets)
+
+    def _read_spilled(self, start, stop):
+        if self._file is None:
+            raise ValueError(f"{self._name} store is closed; its spilled lines can no longer be read")
+        end = self._offsets[stop] if stop < len(self._offsets) else None
+        if self._map is None or (end or self._file.tell()) > len(self._map):
+            # The log only grows, so a map is reused until a read goes past its end
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        for i in range(start, stop):
+            offset = self._offsets[i]
+            timestamp, speaker_id, length = _RECORD.unpack_from(self._map, offset)
+            body = offset + _RECORD.size
+            text = self._map[body:body + length].decode()
+            yield TranscriptLine(self._speakers[speaker_id], text, timestamp)
+
+    def close(self):
+        """Release the spill file; lines still in the in-memory window stay readable."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
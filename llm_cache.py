@@ -0,0 +1,286 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import perf_counter
+
+from config import (
+    GEMINI_MODEL,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_PATH,
+)
+from llm_client import client as llm_client
+from llm_usage import ledger
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def model_name_of(model):
+    """Name of the model a GenerativeModel (or an Instructor client wrapping one) calls, else GEMINI_MODEL."""
+    for candidate in (model, getattr(model, "client", None)):
+        name = getattr(candidate, "_model_name", None)
+        if isinstance(name, str) and name:
+            return name
+    return GEMINI_MODEL
+
+
+def cache_key(model_name, prompt, schema=None):
+    """Stable hash of model, prompt and response schema.
+
+    Prompts may be strings or chat message lists; runs of whitespace are collapsed so
+    re-indented prompt templates still hit the same entry.
+    """
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, sort_keys=True, default=str)
+    prompt = _WHITESPACE.sub(" ", prompt).strip()
+
+    if schema is None:
+        schema_text = ""
+    elif hasattr(schema, "model_json_schema"):
+        schema_text = json.dumps(schema.model_json_schema(), sort_keys=True)
+    else:
+        schema_text = json.dumps(schema, sort_keys=True, default=str)
+
+    payload = "\x1f".join((model_name, schema_text, prompt))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    """In-memory LRU with TTL for LLM response text, with an optional SQLite second tier.
+
+    get_or_compute() is single-flight: concurrent callers asking for the same key while
+    it is being computed wait for that one call instead of issuing their own. SQLite I/O
+    runs under its own lock, never the memory lock, so memory hits and single-flight checks
+    do not wait behind another thread's disk commit.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "coalesced": 0,
+        }
+
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            value = self._get_memory(key)
+        if value is None:
+            value = self._get_disk(key)
+        return value
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+        with self._db_lock:
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                self._db.commit()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                return value
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                owner = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            # The disk lookup is part of the single flight, so waiters share it too
+            value = self._get_disk(key)
+            if value is None:
+                with self._lock:
+                    self.stats["misses"] += 1
+                value = compute()
+                self.put(key, value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _get_memory(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self._entries[key]
+            self.stats["expirations"] += 1
+        return None
+
+    def _get_disk(self, key):
+        """Look key up in SQLite, promoting a live row to memory; called without self._lock."""
+        now = time.time()
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            expired = row is not None and row[1] <= now
+            if expired:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._db.commit()
+
+        with self._lock:
+            if row is None:
+                return None
+            if expired:
+                self.stats["expirations"] += 1
+                return None
+            value, expires_at = row
+            self._put_memory(key, value, expires_at)
+            self.stats["disk_hits"] += 1
+            return value
+
+    def _put_memory(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Process-wide cache shared by every LLM call site, or None when caching is disabled."""
+    global _shared_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMCache(disk_path=LLM_CACHE_PATH or None)
+        return _shared_cache
+
+
+def cached_generate_text(
+    model, prompt, generation_config=None, schema=None, validate=None, model_name=None,
+    call_site="generate_text", session=None, use_cache=True, elidable=None,
+):
+    """model.generate_content(...) returning the response text, served from the shared cache.
+
+    Pass the response schema used in generation_config as `schema` so it is part of the key,
+    along with model_name (by default the name `model` was built with).
+    If `validate` is given it is called on fresh responses and anything it raises propagates,
+    so responses that fail validation are never cached. The prompt is checked against its
+    token budget first, and every call (cache hits included) is recorded in the usage ledger
+    under call_site and session. Requests go through the shared llm_client for rate limiting,
+    retries, the call deadline and hedging. use_cache=False skips the cache for this call.
+    elidable is the context section ledger.check may shorten to fit the prompt budget.
+    """
+    prompt = ledger.check(call_site, prompt, session, elidable)
+    sent = []
+
+    def compute():
+        start = perf_counter()
+        if generation_config is None:
+            response = llm_client.call(call_site, lambda: model.generate_content(prompt))
+        else:
+            response = llm_client.call(
+                call_site, lambda: model.generate_content(prompt, generation_config=generation_config)
+            )
+        sent.append(True)
+        ledger.record(call_site, prompt, response.text, response, perf_counter() - start, session)
+        if validate is not None:
+            validate(response.text)
+        return response.text
+
+    cache = get_llm_cache() if use_cache else None
+    if cache is None:
+        return compute()
+
+    key = cache_key(model_name or model_name_of(model), prompt, schema)
+    text = cache.get_or_compute(key, compute)
+    if not sent:
+        ledger.record(call_site, prompt, session=session, cached=True)
+    return text
+
+
+def cached_instructor_create(client, response_model, messages, model_name=None, call_site="instructor_create", session=None, use_cache=True, elidable=None):
+    """Instructor client.create(...) with the validated result cached as JSON, budgeted and recorded like cached_generate_text."""
+    messages = ledger.check(call_site, messages, session, elidable)
+    sent = []
+
+    def compute():
+        start = perf_counter()
+        # The raw completion carries the usage metadata the parsed model does not
+        result, completion = llm_client.call(
+            call_site, lambda: client.create_with_completion(response_model=response_model, messages=messages)
+        )
+        text = result.model_dump_json()
+        sent.append(True)
+        ledger.record(call_site, messages, text, completion, perf_counter() - start, session)
+        return text
+
+    cache = get_llm_cache() if use_cache else None
+    if cache is None:
+        return response_model.model_validate_json(compute())
+
+    key = cache_key(model_name or model_name_of(client), messages, response_model)
+    text = cache.get_or_compute(key, compute)
+    if not sent:
+        ledger.record(call_site, messages, session=session, cached=True)
+    return response_model.model_validate_json(text)
@@ -0,0 +1,239 @@
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from google.api_core import exceptions as google_exceptions
+
+from config import (
+    LLM_RATE_LIMIT_PER_SECOND,
+    LLM_RATE_LIMIT_BURST,
+    LLM_MAX_ATTEMPTS,
+    LLM_BACKOFF_BASE_SECONDS,
+    LLM_BACKOFF_MAX_SECONDS,
+    LLM_CALL_DEADLINE_SECONDS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_QUANTILE,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_CLIENT_MAX_WORKERS,
+)
+from metrics import Histogram
+import metrics
+
+# Quota, overload and transient transport errors; anything else (bad request, permission, a
+# malformed prompt) fails the same way on every attempt and is raised at once
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when an LLM call, retries and rate-limit waits included, runs past its deadline."""
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions a second on average with bursts of up to `burst`; rate <= 0 disables it."""
+
+    def __init__(self, rate=LLM_RATE_LIMIT_PER_SECOND, burst=LLM_RATE_LIMIT_BURST):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, expires=None):
+        """Block until a token is available; returns the seconds waited.
+
+        Raises LLMDeadlineExceeded without waiting if no token frees up before `expires`.
+        """
+        if self.rate <= 0:
+            return 0.0
+        start = None
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return 0.0 if start is None else now - start
+                start = now if start is None else start
+                delay = (1 - self.tokens) / self.rate
+            if expires is not None and now + delay > expires:
+                raise LLMDeadlineExceeded("rate limit wait would pass the call deadline")
+            time.sleep(delay)
+
+
+class LLMClient:
+    """Runs every Vertex request behind a shared rate limit, retries, a deadline and optional hedging.
+
+    call(call_site, fn) invokes fn() (one request) and returns its result. Each attempt first
+    takes a token from the bucket. A retryable error is retried after a full-jitter exponential
+    backoff until max_attempts or the deadline runs out. When hedging is on and a call site
+    has enough history, an attempt still running past that call site's hedge_quantile latency
+    gets a second identical request if the bucket has a token to spare, and whichever returns
+    first wins. A losing request cannot be cancelled once sent; it finishes in the background
+    and its result is dropped.
+
+    Outcomes are counted per call site in `outcomes` and as llm_requests_total{outcome=...}.
+    """
+
+    def __init__(
+        self,
+        bucket=None,
+        max_attempts=LLM_MAX_ATTEMPTS,
+        backoff_base=LLM_BACKOFF_BASE_SECONDS,
+        backoff_max=LLM_BACKOFF_MAX_SECONDS,
+        deadline=LLM_CALL_DEADLINE_SECONDS,
+        hedge=LLM_HEDGE_ENABLED,
+        hedge_quantile=LLM_HEDGE_QUANTILE,
+        hedge_min_samples=LLM_HEDGE_MIN_SAMPLES,
+        max_workers=LLM_CLIENT_MAX_WORKERS,
+    ):
+        self.bucket = bucket or TokenBucket()
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+
+        self.outcomes = Counter()
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-call")
+
+    def call(self, call_site, fn, deadline=None, hedge=None):
+        """Return fn() run under the rate limit, retry, deadline and hedging policy.
+
+        deadline (seconds, 0 for none) and hedge override the client defaults for this call.
+        Raises LLMDeadlineExceeded, or the last error once retries are exhausted.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        hedge = self.hedge if hedge is None else hedge
+        expires = time.monotonic() + deadline if deadline > 0 else None
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                waited = self.bucket.acquire(expires)
+                if waited > 0:
+                    self._count(call_site, "throttled")
+                    metrics.observe("llm_rate_limit_wait", waited, call_site=call_site)
+                result = self._attempt(call_site, fn, expires, hedge)
+            except LLMDeadlineExceeded:
+                self._count(call_site, "deadline")
+                raise
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts:
+                    self._count(call_site, "exhausted")
+                    raise
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                if expires is not None and time.monotonic() + backoff >= expires:
+                    self._count(call_site, "deadline")
+                    raise LLMDeadlineExceeded(f"{call_site}: deadline passed while retrying: {e}") from e
+                self._count(call_site, "retried")
+                print(f"{call_site} attempt {attempt}/{self.max_attempts} failed ({e}), retrying in {backoff:.2f} s")
+                time.sleep(backoff)
+            except Exception:
+                self._count(call_site, "failed")
+                raise
+            else:
+                self._count(call_site, "ok")
+                return result
+
+    def _attempt(self, call_site, fn, expires, hedge):
+        hedge_after = self._hedge_delay(call_site) if hedge else None
+        if expires is None and hedge_after is None:
+            return self._timed(call_site, fn)
+
+        futures = [self._pool.submit(self._timed, call_site, fn)]
+        if hedge_after is not None and (expires is None or time.monotonic() + hedge_after < expires):
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done and self.bucket.try_acquire():
+                self._count(call_site, "hedged")
+                futures.append(self._pool.submit(self._timed, call_site, fn))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            timeout = None if expires is None else max(expires - time.monotonic(), 0)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise LLMDeadlineExceeded(f"{call_site}: no response before the call deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self._count(call_site, "hedge_won")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _timed(self, call_site, fn):
+        start = time.perf_counter()
+        result = fn()
+        self._histogram(call_site).record(time.perf_counter() - start)
+        return result
+
+    def _histogram(self, call_site):
+        with self._lock:
+            histogram = self._latencies.get(call_site)
+            if histogram is None:
+                histogram = self._latencies[call_site] = Histogram()
+            return histogram
+
+    def _hedge_delay(self, call_site):
+        histogram = self._histogram(call_site)
+        if histogram.count < self.hedge_min_samples:
+            return None
+        return histogram.quantiles((self.hedge_quantile,))[0]
+
+    def _count(self, call_site, outcome):
+        with self._lock:
+            self.outcomes[(call_site, outcome)] += 1
+        metrics.inc("llm_requests", call_site=call_site, outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            outcomes = dict(self.outcomes)
+        stats = {}
+        for (call_site, outcome), count in outcomes.items():
+            stats.setdefault(call_site, {})[outcome] = count
+        return stats
+
+    def print_stats(self):
+        for call_site, outcomes in sorted(self.stats().items()):
+            print(f"[llm client {call_site}] " + " ".join(f"{name}={count}" for name, count in sorted(outcomes.items())))
+
+    def reset(self):
+        with self._lock:
+            self.outcomes.clear()
+            self._latencies.clear()
+
+
+# Shared by every call site in the process, so the rate limit covers all sessions together
+client = LLMClient()
@@ -0,0 +1,205 @@
+import threading
+from collections import defaultdict
+
+from config import (
+    LLM_PROMPT_BUDGETS,
+    LLM_PROMPT_MAX_TOKENS,
+    LLM_BUDGET_ACTION,
+    LLM_SESSION_TOKEN_BUDGET,
+)
+
+DEFAULT_SESSION = "default"
+
+_ELISION = "\n[... {} tokens omitted to fit the prompt budget ...]\n"
+
+
+class PromptBudgetExceeded(Exception):
+    """Raised before an LLM call whose prompt or session total is over its token budget."""
+
+
+def estimate_tokens(text):
+    """Rough token count for budgeting prompts without a tokenizer: about four characters a token."""
+    return (len(text) + 3) // 4
+
+
+def prompt_text(prompt):
+    """The text of a prompt string or an Instructor chat message list."""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(str(message.get("content", "")) for message in prompt)
+
+
+def parse_budgets(spec):
+    """Parse "call_site=tokens,call_site=tokens" into a dict."""
+    budgets = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        call_site, _, tokens = item.partition("=")
+        budgets[call_site.strip()] = int(tokens)
+    return budgets
+
+
+def _usage_counts(response):
+    # Vertex responses (and the final chunk of a stream) carry usage_metadata; fakes and
+    # some error paths do not, in which case the caller falls back to the estimator
+    usage = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(usage, "prompt_token_count", None) if usage is not None else None
+    if not input_tokens:
+        return None
+    return input_tokens, getattr(usage, "candidates_token_count", None) or 0
+
+
+def _elide(text, max_tokens):
+    # Keep the head and the tail of the section and drop the middle
+    keep = max(max_tokens, 0) * 4
+    if len(text) <= keep:
+        return text
+    marker = _ELISION.format(estimate_tokens(text) - max_tokens)
+    head = max(keep - len(marker), 0) // 2
+    return text[:head] + marker + text[len(text) - head:]
+
+
+class _Totals:
+    __slots__ = (
+        "calls", "cached", "estimated", "input_tokens", "output_tokens",
+        "prompt_bytes", "latency", "max_latency", "truncated", "rejected",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        stats = {name: getattr(self, name) for name in self.__slots__}
+        sent = self.calls - self.cached
+        stats["mean_latency_ms"] = self.latency / sent * 1000 if sent else 0.0
+        stats["max_latency_ms"] = self.max_latency * 1000
+        del stats["latency"], stats["max_latency"]
+        return stats
+
+
+class UsageLedger:
+    """Token, prompt-size and latency totals for every LLM call, per call site and per session.
+
+    Input and output tokens come from the response's usage_metadata when present and from
+    estimate_tokens otherwise (counted in "estimated"). Cache hits count as calls that sent no
+    tokens. check() enforces prompt budgets before a call is sent: per call site (or the
+    default), an over-budget prompt is truncated or rejected per budget_action, and once a
+    session's input tokens reach session_budget its further calls are rejected. Truncation
+    only ever shortens the section of the prompt the caller marks as elidable (topic or
+    cleaned-line context), never the lines being processed; when that is not enough the call
+    is rejected.
+    """
+
+    def __init__(
+        self,
+        budgets=None,
+        default_budget=LLM_PROMPT_MAX_TOKENS,
+        budget_action=LLM_BUDGET_ACTION,
+        session_budget=LLM_SESSION_TOKEN_BUDGET,
+    ):
+        self.budgets = parse_budgets(LLM_PROMPT_BUDGETS) if budgets is None else dict(budgets)
+        self.default_budget = default_budget
+        self.budget_action = budget_action
+        self.session_budget = session_budget
+        self._call_sites = defaultdict(_Totals)
+        self._sessions = defaultdict(_Totals)
+        self._lock = threading.Lock()
+
+    def check(self, call_site, prompt, session=None, elidable=None):
+        """Return the prompt to send, truncated if over budget, or raise PromptBudgetExceeded.
+
+        elidable is the part of the prompt (of the last message, for chat messages) that may be
+        shortened to fit; without it an over-budget prompt is rejected.
+        """
+        session = session or DEFAULT_SESSION
+        if self.session_budget > 0:
+            with self._lock:
+                spent = self._sessions[session].input_tokens
+            if spent >= self.session_budget:
+                self._count(call_site, session, "rejected")
+                raise PromptBudgetExceeded(
+                    f"{call_site}: session {session} has used {spent} of its {self.session_budget} input tokens"
+                )
+
+        budget = self.budgets.get(call_site, self.default_budget)
+        if budget <= 0:
+            return prompt
+        tokens = estimate_tokens(prompt_text(prompt))
+        if tokens <= budget:
+            return prompt
+
+        text = prompt if isinstance(prompt, str) else str(prompt[-1].get("content", ""))
+        # Everything outside the elidable section has to fit with the elision marker
+        fixed = tokens - estimate_tokens(elidable or "") + estimate_tokens(_ELISION.format(tokens))
+        if self.budget_action != "truncate" or not elidable or elidable not in text or fixed >= budget:
+            self._count(call_site, session, "rejected")
+            raise PromptBudgetExceeded(f"{call_site}: prompt of ~{tokens} tokens is over its budget of {budget}")
+
+        self._count(call_site, session, "truncated")
+        print(f"Truncating {call_site} prompt context from ~{tokens} to {budget} tokens")
+        text = text.replace(elidable, _elide(elidable, budget - fixed), 1)
+        if isinstance(prompt, str):
+            return text
+        # Chat messages: the system prompt stays whole and the last message absorbs the cut
+        return [*prompt[:-1], dict(prompt[-1], content=text)]
+
+    def record(self, call_site, prompt, output_text="", response=None, latency=0.0, session=None, cached=False):
+        text = prompt_text(prompt)
+        counts = None if cached else _usage_counts(response)
+        if cached:
+            input_tokens = output_tokens = 0
+        elif counts:
+            input_tokens, output_tokens = counts
+        else:
+            input_tokens, output_tokens = estimate_tokens(text), estimate_tokens(output_text or "")
+
+        session = session or DEFAULT_SESSION
+        with self._lock:
+            for totals in (self._call_sites[call_site], self._sessions[session]):
+                totals.calls += 1
+                totals.cached += cached
+                totals.estimated += not cached and counts is None
+                totals.input_tokens += input_tokens
+                totals.output_tokens += output_tokens
+                totals.prompt_bytes += 0 if cached else len(text.encode())
+                totals.latency += latency
+                totals.max_latency = max(totals.max_latency, latency)
+
+    def _count(self, call_site, session, field):
+        with self._lock:
+            for totals in (self._call_sites[call_site], self._sessions[session]):
+                setattr(totals, field, getattr(totals, field) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "call_sites": {name: totals.as_dict() for name, totals in self._call_sites.items()},
+                "sessions": {name: totals.as_dict() for name, totals in self._sessions.items()},
+            }
+
+    def session_stats(self, session):
+        with self._lock:
+            return self._sessions[session or DEFAULT_SESSION].as_dict()
+
+    def print_stats(self):
+        stats = self.stats()
+        for group in ("call_sites", "sessions"):
+            for name, totals in sorted(stats[group].items()):
+                print(
+                    f"[llm {group[:-1].replace('_', ' ')} {name}] calls={totals['calls']} cached={totals['cached']} "
+                    f"in={totals['input_tokens']} out={totals['output_tokens']} tokens "
+                    f"({totals['estimated']} estimated) prompt={totals['prompt_bytes'] / 1024:.1f} KiB "
+                    f"latency mean={totals['mean_latency_ms']:.0f} ms max={totals['max_latency_ms']:.0f} ms "
+                    f"truncated={totals['truncated']} rejected={totals['rejected']}"
+                )
+
+    def reset(self):
+        with self._lock:
+            self._call_sites.clear()
+            self._sessions.clear()
+
+
+# Shared by every call site in the process, like the LLM response cache
+ledger = UsageLedger()
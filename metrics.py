@@ -0,0 +1,291 @@
+import json
+import os
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_ENABLED, METRICS_PORT, METRICS_JSON_PATH, METRICS_JSON_INTERVAL_SECONDS
+
+# Histograms record microseconds into log-linear buckets: 2**SUB_BUCKET_BITS linear sub-buckets
+# per power of two, so every recorded value is within about 3% of its bucket's midpoint
+SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_DIRECT = 2 * _SUB_BUCKETS
+_BUCKETS = 40 * _SUB_BUCKETS
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+
+
+def _bucket(value):
+    if value < _DIRECT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_value(index):
+    # Midpoint of the bucket, so quantiles are not biased low
+    if index < _DIRECT:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    return ((index - shift * _SUB_BUCKETS) << shift) + ((1 << shift) - 1) / 2
+
+
+class Histogram:
+    """HDR-style latency histogram over integer microseconds.
+
+    Recording is a bucket increment, so memory and cost stay fixed however many samples
+    arrive; quantiles are read back from bucket bounds.
+    """
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * _BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        index = min(_bucket(max(int(seconds * 1e6), 0)), _BUCKETS - 1)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantiles(self, qs=tuple(q for _, q in QUANTILES)):
+        """Seconds at each quantile in qs (ascending), clamped to the observed min and max."""
+        with self._lock:
+            counts = self.counts.tolist()
+            count, low, high = self.count, self.min, self.max
+        if not count:
+            return [0.0 for _ in qs]
+
+        results = []
+        seen = 0
+        index = 0
+        for q in qs:
+            rank = max(1, int(q * count + 0.5))
+            while seen + counts[index] < rank:
+                seen += counts[index]
+                index += 1
+            results.append(min(max(_bucket_value(index) / 1e6, low), high))
+        return results
+
+    def summary(self):
+        values = self.quantiles()
+        with self._lock:
+            stats = {"count": self.count, "sum": self.total, "min": self.min or 0.0, "max": self.max}
+        stats.update({label: value for (label, _), value in zip(QUANTILES, values)})
+        return stats
+
+
+class _Span:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """Process-wide spans, counters and gauges, exported as Prometheus text or JSON.
+
+    Metrics are keyed by name plus optional labels. When disabled, span() returns a shared
+    no-op context manager and the other calls return at once, so instrumentation can stay on
+    hot paths.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **labels):
+        """Time a with-block into the name_seconds histogram on the monotonic clock."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self._histogram(name, labels))
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self._histogram(name, labels).record(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        if self.enabled:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def _histogram(self, name, labels):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def snapshot(self):
+        """JSON-ready dict of every metric, histograms summarized to quantiles."""
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        return {
+            "timestamp": time.time(),
+            "histograms": {_series(name + "_seconds", labels): h.summary() for (name, labels), h in sorted(histograms.items())},
+            "counters": {_series(name + "_total", labels): value for (name, labels), value in sorted(counters.items())},
+            "gauges": {_series(name, labels): value for (name, labels), value in sorted(gauges.items())},
+        }
+
+    def prometheus_text(self):
+        """Prometheus text exposition format; histograms are exported as summaries."""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        out = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                out.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            metric = name + "_seconds"
+            header(metric, "summary")
+            for (_, q), value in zip(QUANTILES, histogram.quantiles()):
+                out.append(f"{_series(metric, labels + (('quantile', str(q)),))} {value:.6f}")
+            out.append(f"{_series(metric + '_sum', labels)} {histogram.total:.6f}")
+            out.append(f"{_series(metric + '_count', labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            header(name + "_total", "counter")
+            out.append(f"{_series(name + '_total', labels)} {value}")
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            out.append(f"{_series(name, labels)} {value}")
+        return "\n".join(out) + "\n"
+
+    def print_summary(self):
+        for series, stats in self.snapshot()["histograms"].items():
+            print(
+                f"[metrics] {series}: n={stats['count']} p50={stats['p50'] * 1000:.1f} ms "
+                f"p99={stats['p99'] * 1000:.1f} ms max={stats['max'] * 1000:.1f} ms"
+            )
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class MetricsExporter:
+    """Serves registry.prometheus_text() at /metrics and/or dumps snapshot() JSON periodically."""
+
+    def __init__(self, registry, port=METRICS_PORT, json_path=METRICS_JSON_PATH, interval=METRICS_JSON_INTERVAL_SECONDS):
+        self.registry = registry
+        self.port = port
+        self.json_path = json_path
+        self.interval = interval
+        self._server = None
+        self._stop = threading.Event()
+        self._dumper = None
+
+    def start(self):
+        if self.port:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = registry.prometheus_text().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer(("", self.port), Handler)
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"Serving metrics on :{self._server.server_address[1]}/metrics")
+
+        if self.json_path:
+            self._dumper = threading.Thread(target=self._dump_loop, name="metrics-json", daemon=True)
+            self._dumper.start()
+        return self
+
+    def dump(self):
+        tmp = self.json_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.registry.snapshot(), f, indent=1)
+        os.replace(tmp, self.json_path)
+
+    def _dump_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"Error writing metrics to {self.json_path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._dumper:
+            self._dumper.join()
+            # One last dump so the file covers the whole run
+            self.dump()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+registry = MetricsRegistry()
+span = registry.span
+observe = registry.observe
+inc = registry.inc
+set_gauge = registry.set_gauge
@@ -1,12 +1,16 @@
-import queue
 import pyaudio
 
+import metrics
+from audio_ring_buffer import AudioRingBuffer
+from audio_source import AudioSource, BYTES_PER_FRAME
+from config import AUDIO_RING_SECONDS
 
-class MicrophoneStream:
-    def __init__(self, rate, chunk):
+
+class MicrophoneStream(AudioSource):
+    def __init__(self, rate, chunk, ring_seconds=AUDIO_RING_SECONDS):
         self._rate = rate
         self._chunk = chunk
-        self._buff = queue.Queue()
+        self._buff = AudioRingBuffer(int(rate * ring_seconds) * BYTES_PER_FRAME)
         self.closed = True
 
     def __enter__(self):
@@ -26,27 +30,20 @@ class MicrophoneStream:
         self._audio_stream.stop_stream()
         self._audio_stream.close()
         self.closed = True
-        self._buff.put(None)
+        self._buff.close()
         self._audio_interface.terminate()
 
     def _fill_buffer(self, in_data, frame_count, time_info, status_flags):
-        self._buff.put(in_data)
+        self._buff.write(in_data)
         return None, pyaudio.paContinue
 
     def generator(self):
         while not self.closed:
-            chunk = self._buff.get()
-            if chunk is None:
+            # Everything captured since the last yield, copied out of the ring once
+            with metrics.span("audio_read"):
+                data = self._buff.read()
+            metrics.set_gauge("audio_overruns", self._buff.overruns)
+            if data is None:
                 return
-            data = [chunk]
-
-            while True:
-                try:
-                    chunk = self._buff.get(block=False)
-                    if chunk is None:
-                        return
-                    data.append(chunk)
-                except queue.Empty:
-                    break
-
-            yield b"".join(data)
+            if data:
+                yield data
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Offline replay harness: feeds scripted Speech responses through listen_print_loop with
+Gemini replaced by a fake model of configurable latency, and reports p50/p95/p99 latency
+from each final ASR result to its cleaned output and to its topic assignment.
+
+    python replay_harness.py --llm-latency 0.8 --llm-jitter 0.3 --speed 4
+    python replay_harness.py --script meeting.json --seed 7 --verbose
+    python replay_harness.py --llm-error-rate 0.1
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from google.api_core import exceptions as google_exceptions
+
+from llm_client import client as llm_client
+from llm_usage import ledger
+from stream_audio import listen_print_loop
+from topic_manager import TopicManager
+from transcript_buffer import TranscriptBuffer
+from transcript_buffer_chunker import TranscriptBufferChunker
+
+
+DEFAULT_SCRIPT = [
+    {"speaker": "1", "text": "Um, so I think we should, like, you know, maybe consider the budget for this project."},
+    {"speaker": "2", "text": "Yeah, that's a good point. What do you think the budget should be?"},
+    {"speaker": "1", "text": "Well, I was thinking maybe around fifty thousand dollars?"},
+    {"speaker": "2", "text": "That sounds reasonable. Let's go with that then."},
+    {"speaker": "1", "text": "Great! So we're all set on the budget."},
+    {"speaker": "1", "text": "I'm thinking about getting a new pet. Maybe a cat?"},
+    {"speaker": "2", "text": "Cats are great! They're independent and low maintenance."},
+    {"speaker": "1", "text": "What breed would you recommend?"},
+    {"speaker": "2", "text": "I'd suggest a Maine Coon or a British Shorthair. Both are friendly."},
+    {"speaker": "1", "text": "Thanks for the advice! I'll look into those breeds."},
+    {"speaker": "2", "text": "No problem! Let me know if you need help with anything else."},
+]
+
+
+class LatencyModel:
+    """Samples simulated call latencies (seconds) from a named distribution.
+
+    With error_rate, that fraction of calls fails with a retryable ServiceUnavailable after its latency.
+    """
+
+    def __init__(self, mean, jitter=0.0, distribution="lognormal", rng=None, error_rate=0.0):
+        self.mean = mean
+        self.jitter = jitter
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.mean <= 0:
+                return 0.0
+            if self.distribution == "constant" or self.jitter <= 0:
+                return self.mean
+            if self.distribution == "uniform":
+                return max(0.0, self.rng.uniform(self.mean - self.jitter, self.mean + self.jitter))
+            if self.distribution == "normal":
+                return max(0.0, self.rng.gauss(self.mean, self.jitter))
+            # lognormal: jitter is the sigma of the underlying normal, giving a realistic long tail
+            return self.rng.lognormvariate(0.0, self.jitter) * self.mean
+
+    def sleep(self):
+        time.sleep(self.sample())
+        self.maybe_fail()
+
+    def maybe_fail(self):
+        with self._lock:
+            failed = self.error_rate > 0 and self.rng.random() < self.error_rate
+        if failed:
+            raise google_exceptions.ServiceUnavailable("injected fake LLM error")
+
+
+def _lines_after(text, marker, stop=None):
+    """Non-empty lines following `marker`, up to the first line starting with `stop`."""
+    if marker not in text:
+        return []
+    lines = []
+    for line in text.split(marker, 1)[1].splitlines():
+        line = line.strip()
+        if stop and line.startswith(stop):
+            break
+        if line:
+            lines.append(line)
+    return lines
+
+
+def _unnumbered(lines):
+    """Strip the "1: " prefixes the chunker puts on the lines it sends."""
+    return [re.sub(r"^\d+:\s*", "", line) for line in lines]
+
+
+def _fake_clean(line):
+    return re.sub(r"\b(um|uh|like|you know),?\s*", "", line, flags=re.IGNORECASE).strip()
+
+
+class FakeGenerativeModel:
+    """Stands in for vertexai GenerativeModel; answers each pipeline prompt with plausible JSON."""
+
+    def __init__(self, latency, responder=None):
+        self.latency = latency
+        self.responder = responder or self.default_responder
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        if stream:
+            return self._stream(prompt)
+        self.latency.sleep()
+        return SimpleNamespace(text=self.responder(prompt))
+
+    def _stream(self, prompt, piece_chars=16, first_token_share=0.3):
+        # First token after a share of the sampled latency, the rest spread over the remainder
+        total = self.latency.sample()
+        text = self.responder(prompt)
+        pieces = [text[i:i + piece_chars] for i in range(0, len(text), piece_chars)] or [""]
+        time.sleep(total * first_token_share)
+        self.latency.maybe_fail()
+        for piece in pieces:
+            yield SimpleNamespace(text=piece)
+            time.sleep(total * (1 - first_token_share) / len(pieces))
+
+    def default_responder(self, prompt):
+        if "The existing topics are:" in prompt:
+            lines = _unnumbered(_lines_after(prompt, "The lines of text are:"))
+            topics = _lines_after(prompt, "The existing topics are:", stop="The lines of text are:")
+            topic_key = topics[0].split(":", 1)[0] if topics and topics[0] != "No topics available" else None
+            return json.dumps({
+                "cleaned_lines": [_fake_clean(line) for line in lines],
+                "chunks": [{
+                    "line_numbers": list(range(1, len(lines) + 1)),
+                    "topic_key": topic_key,
+                    "updated_description": _fake_clean(lines[0]) if lines else "",
+                }],
+            })
+        if "Here is the transcript to clean:" in prompt:
+            lines = _lines_after(prompt, "Here is the transcript to clean:")
+            return json.dumps({"cleaned_lines": [_fake_clean(line) for line in lines]})
+        if "group the lines" in prompt:
+            lines = _lines_after(prompt, "The lines of text are:", stop="Return the groups")
+            return json.dumps({"chunks": [list(range(1, len(lines) + 1))]})
+        if "determine which topic it belongs to" in prompt:
+            topics = _lines_after(prompt, "Given the following existing topics:", stop="Analyze this chunk")
+            first = topics[0] if topics else "No topics available"
+            topic_key = None if first == "No topics available" else first.split(":", 1)[0]
+            chunk = prompt.split("determine which topic it belongs to:", 1)[1].strip().strip('"')[:80]
+            return json.dumps({"topic_key": topic_key, "updated_description": chunk})
+        if "digest field" in prompt:
+            entries = _lines_after(prompt, "Older conversation content to fold into it:", stop="Write an updated digest")
+            return json.dumps({"digest": " ".join(entry.lstrip("- ") for entry in entries)[:200]})
+        if "label field" in prompt:
+            return json.dumps({"label": "Replayed topic"})
+        return "{}"
+
+
+class FakeInstructorClient:
+    """Stands in for the Instructor client used by TranscriptBuffer."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def create(self, response_model, messages):
+        self.calls += 1
+        self.latency.sleep()
+        content = messages[-1]["content"]
+        if "cleaned_lines" in response_model.model_fields:
+            lines = _lines_after(content, "New lines to clean:")
+            return response_model(cleaned_lines=[_fake_clean(line) for line in lines], topic_finished=False)
+        return response_model(cleaned_transcript=_fake_clean(content), topic_finished=False)
+
+    def create_with_completion(self, response_model, messages):
+        # No raw completion, so token usage falls back to the estimator
+        return self.create(response_model, messages), None
+
+
+def load_script(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def scripted_responses(script, word_seconds, asr_latency):
+    """Yield Speech-like responses: interim results word by word, then a final with speaker tags.
+
+    Entries that already carry "is_final" are treated as recorded responses and replayed as-is.
+    """
+    for entry in script:
+        if "is_final" in entry:
+            time.sleep(entry.get("delay", word_seconds))
+            yield _response(entry["transcript"], entry["is_final"], entry.get("speaker_tag", 0))
+            continue
+
+        words = entry["text"].split()
+        for i in range(1, len(words)):
+            time.sleep(word_seconds)
+            yield _response(" ".join(words[:i]), False, 0)
+        time.sleep(word_seconds + asr_latency.sample())
+        yield _response(entry["text"], True, int(entry.get("speaker", 1)))
+
+
+def _response(transcript, is_final, speaker_tag):
+    words = [SimpleNamespace(word=w, speaker_tag=speaker_tag) for w in transcript.split()] if is_final else []
+    alternative = SimpleNamespace(transcript=transcript, words=words)
+    return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative], is_final=is_final)])
+
+
+class ReplaySink:
+    """Receives finals from listen_print_loop, forwards them to both pipelines and times them.
+
+    With timer=True the chunker's intervals are fired by its IntervalScheduler thread (interval,
+    idle and shutdown runs) through run_interval(); otherwise each final polls the chunker.
+    """
+
+    def __init__(self, timer=False):
+        self.timer = timer
+        self.transcript_buffer = None
+        self.chunker = None
+        self.final_times = []
+        self.cleaned_latencies = []
+        self.topic_latencies = []
+        # Finals whose topics were applied by the flush in close_chunker()
+        self.flushed_latencies = []
+        self._cleaned_upto = 0
+        self._pending_topic = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.timer:
+            self.chunker.scheduler.start(self.run_interval)
+
+    def add_transcript(self, text, speaker_tag=""):
+        now = time.perf_counter()
+        self.transcript_buffer.add_transcript(text, speaker_tag)
+        line = f"{speaker_tag}{text}"
+
+        if self.timer:
+            # A final's time and its line are queued together, so an interval takes both or neither
+            with self._lock:
+                self.final_times.append(now)
+                self._pending_topic.append(now)
+                self.chunker.add_lines([line])
+            return
+
+        with self._lock:
+            self.final_times.append(now)
+        self._pending_topic.append(now)
+        self.chunker.add_transcript_line(line)
+
+        # Each interval takes the chunker's pending lines and applies their topics before returning
+        if not self.chunker.pending:
+            self._record_topics(self._pending_topic)
+            self._pending_topic = []
+
+    def run_interval(self):
+        with self._lock:
+            lines = self.chunker.take_pending()
+            times, self._pending_topic = self._pending_topic, []
+        try:
+            self.chunker.process_lines(lines)
+        except Exception:
+            # The lines at the requeued positions went back to pending, and so do their finals
+            requeued = set(self.chunker.requeued)
+            with self._lock:
+                self._pending_topic[:0] = [t for i, t in enumerate(times) if i in requeued]
+            self._record_topics([t for i, t in enumerate(times) if i not in requeued])
+            raise
+        self._record_topics(times)
+
+    def _record_topics(self, times):
+        done = time.perf_counter()
+        self.topic_latencies.extend(done - t for t in times)
+
+    def close_chunker(self):
+        """Close the chunker, timing the finals its closing flush applies."""
+        if self.timer:
+            self.chunker.scheduler.close()
+        self.chunker.close()
+        if not self.chunker.pending:
+            done = time.perf_counter()
+            self.flushed_latencies.extend(done - t for t in self._pending_topic)
+            self._pending_topic = []
+
+    def on_clean(self, result):
+        done = time.perf_counter()
+        with self._lock:
+            upto = self.transcript_buffer.cleaned_upto
+            self.cleaned_latencies.extend(done - t for t in self.final_times[self._cleaned_upto:upto])
+            self._cleaned_upto = max(self._cleaned_upto, upto)
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, values):
+    print(
+        f"{name:<22} n={len(values):<4} "
+        f"p50={percentile(values, 50) * 1000:8.1f} ms  "
+        f"p95={percentile(values, 95) * 1000:8.1f} ms  "
+        f"p99={percentile(values, 99) * 1000:8.1f} ms"
+    )
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    llm_latency = LatencyModel(args.llm_latency, args.llm_jitter, args.distribution, rng, args.llm_error_rate)
+    asr_latency = LatencyModel(args.asr_latency, args.asr_jitter, args.distribution, rng)
+    ledger.reset()
+    llm_client.reset()
+
+    script = load_script(args.script) if args.script else DEFAULT_SCRIPT
+    script = script * args.repeat
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        sink = ReplaySink(timer=args.timer)
+        # Fakes are passed in, so nothing touches Vertex AI or needs credentials
+        transcript_buffer = TranscriptBuffer(
+            clean_interval_seconds=args.clean_interval, on_clean=sink.on_clean,
+            client=FakeInstructorClient(llm_latency), use_cache=args.cache,
+        )
+
+        topics_manager = TopicManager(model=FakeGenerativeModel(llm_latency), use_cache=args.cache)
+        # Polled from add_transcript_line, so each final's topic latency is known when it returns,
+        # unless --timer hands the scheduler to the sink
+        chunker = TranscriptBufferChunker(
+            topics_manager=topics_manager, fused=args.fused, stream=args.stream,
+            model=FakeGenerativeModel(llm_latency), clean_interval=args.chunk_interval, timer=False,
+            use_cache=args.cache,
+        )
+
+        sink.transcript_buffer = transcript_buffer
+        sink.chunker = chunker
+        sink.start()
+
+        start = time.perf_counter()
+        responses = scripted_responses(script, args.word_seconds / args.speed, asr_latency)
+        listen_print_loop(responses, sink)
+        transcript_buffer.close()
+        sink.close_chunker()
+        topics_manager.close()
+    elapsed = time.perf_counter() - start
+
+    print("=" * 80)
+    print(f"Replayed {len(sink.final_times)} finals in {elapsed:.1f} s "
+          f"(LLM {args.distribution} mean={args.llm_latency}s jitter={args.llm_jitter}, "
+          f"{'fused' if args.fused else 'multi-call'} chunker, {'timer' if args.timer else 'polled'} intervals)")
+    print("-" * 80)
+    report("final -> cleaned", sink.cleaned_latencies)
+    report("final -> topic", sink.topic_latencies)
+    if sink.flushed_latencies:
+        report("flushed at close", sink.flushed_latencies)
+    print(f"{'chunker intervals':<22} n={len(chunker.interval_latencies)}")
+    if sink._pending_topic:
+        print(f"{'unassigned finals':<22} n={len(sink._pending_topic)} (still pending after the closing flush)")
+    print(f"{'topics':<22} {len(topics_manager.topics)}")
+    for call_site, usage in sorted(ledger.stats()["call_sites"].items()):
+        print(
+            f"{call_site:<22} calls={usage['calls']:<4} in={usage['input_tokens']:<7} "
+            f"out={usage['output_tokens']:<6} tokens ({usage['estimated']} estimated)  prompt={usage['prompt_bytes'] / 1024:.1f} KiB"
+        )
+    for call_site, outcomes in sorted(llm_client.stats().items()):
+        print(f"{call_site:<22} " + " ".join(f"{name}={count}" for name, count in sorted(outcomes.items())))
+    print("=" * 80)
+    return sink
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay scripted ASR responses through the pipeline with a fake LLM")
+    parser.add_argument("--script", help="JSON list of {speaker, text} utterances or recorded {transcript, is_final} responses")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the script this many times")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--distribution", choices=["constant", "uniform", "normal", "lognormal"], default="lognormal")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Mean fake LLM latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of fake LLM calls that fail with a retryable error")
+    parser.add_argument("--asr-latency", type=float, default=0.2, help="Extra delay before each final, in seconds")
+    parser.add_argument("--asr-jitter", type=float, default=0.1)
+    parser.add_argument("--word-seconds", type=float, default=0.3, help="Speaking time per word at 1x speed")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up factor for the scripted speech")
+    parser.add_argument("--clean-interval", type=float, default=1.0)
+    parser.add_argument("--chunk-interval", type=float, default=2.0)
+    parser.add_argument("--timer", action="store_true", help="Fire chunker intervals from the scheduler's timer thread instead of polling")
+    parser.add_argument("--multi-call", dest="fused", action="store_false", help="Use the multi-call chunker path")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Disable streaming LLM responses")
+    parser.add_argument("--cache", action="store_true", help="Keep the shared LLM response cache enabled")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output while replaying")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -6,7 +6,6 @@ import vertexai
 
 from config import (
     RATE,
-    CHUNK,
     LANGUAGE_CODE,
     MIN_SPEAKER_COUNT,
     MAX_SPEAKER_COUNT,
@@ -14,43 +13,37 @@ from config import (
     PROJECT_ID,
     LOCATION,
     GEMINI_MODEL,
+    VAD_ENABLED,
 )
 from transcript_buffer import TranscriptBuffer
-from microphone_stream import MicrophoneStream
-
-
-def listen_print_loop(responses, transcript_buffer):
-    num_chars_printed = 0
-    for response in responses:
-        if not response.results:
-            continue
-
-        result = response.results[0]
-        if not result.alternatives:
-            continue
-
-        transcript = result.alternatives[0].transcript
-
-        speaker_tag = ""
-        if (
-            result.is_final
-            and hasattr(result.alternatives[0], "words")
-            and result.alternatives[0].words
-        ):
-            words_info = result.alternatives[0].words
-            if words_info and hasattr(words_info[0], "speaker_tag"):
-                speaker_tag = f"[Speaker {words_info[0].speaker_tag}] "
-
-        overwrite_chars = " " * (num_chars_printed - len(transcript))
+from llm_client import client as llm_client
+from llm_usage import ledger
+import metrics
+from audio_source import open_audio_source
+from voice_activity import VoiceActivityGate
+from streaming_session import RotatingStreamSession
+from word_timeline import WordTimeline
+from event_bus import EventBus, ConsoleRenderer, InterimEvent, FinalEvent, CleanedEvent, publish_responses
+
+
+def listen_print_loop(responses, transcript_buffer, bus=None, timeline=None):
+    """Publish Speech responses on the event bus; the console and transcript_buffer consume them
+    on their own subscriber threads, so neither can hold up reading responses."""
+    own_bus = bus is None
+    if own_bus:
+        bus = EventBus()
+    bus.subscribe("console", ConsoleRenderer().handle, (InterimEvent, FinalEvent, CleanedEvent))
+    bus.subscribe(
+        "transcript_buffer",
+        lambda event: transcript_buffer.add_transcript(event.text, event.speaker_tag),
+        FinalEvent,
+    )
 
-        if not result.is_final:
-            sys.stdout.write(transcript + overwrite_chars + "\r")
-            sys.stdout.flush()
-            num_chars_printed = len(transcript)
-        else:
-            print(speaker_tag + transcript + overwrite_chars)
-            transcript_buffer.add_transcript(transcript, speaker_tag)
-            num_chars_printed = 0
+    try:
+        publish_responses(responses, bus, timeline)
+    finally:
+        if own_bus:
+            bus.close()
 
 
 def main():
@@ -82,7 +75,14 @@ def main():
         interim_results=True,
     )
 
-    transcript_buffer = TranscriptBuffer(clean_interval_seconds=CLEAN_INTERVAL_SECONDS)
+    bus = EventBus()
+    timeline = WordTimeline()
+    transcript_buffer = TranscriptBuffer(
+        clean_interval_seconds=CLEAN_INTERVAL_SECONDS,
+        on_clean=lambda result: bus.publish(
+            CleanedEvent(lines=result.cleaned_transcript.splitlines(), topic_finished=result.topic_finished)
+        ),
+    )
 
     print("Listening with Speaker Diarization... Press Ctrl+C to stop.")
     print(f"Detecting {MIN_SPEAKER_COUNT}-{MAX_SPEAKER_COUNT} speakers")
@@ -90,16 +90,34 @@ def main():
     print(f"Using model: {GEMINI_MODEL}")
     print("=" * 60)
 
-    with MicrophoneStream(RATE, CHUNK) as stream:
-        audio_generator = stream.generator()
-        requests = (
-            speech.StreamingRecognizeRequest(audio_content=content)
-            for content in audio_generator
-        )
+    exporter = metrics.MetricsExporter(metrics.registry).start()
 
-        responses = client.streaming_recognize(streaming_config, requests)
-
-        listen_print_loop(responses, transcript_buffer)
+    with open_audio_source() as stream:
+        audio_generator = stream.generator()
+        vad = None
+        if VAD_ENABLED:
+            vad = VoiceActivityGate(RATE)
+            audio_generator = vad.gate(audio_generator)
+        # Rotates to a fresh stream before Google's per-stream duration limit
+        session = RotatingStreamSession(client, streaming_config, audio_generator, RATE)
+        responses = session.responses()
+
+        try:
+            listen_print_loop(responses, transcript_buffer, bus, timeline)
+        finally:
+            # Hand the buffer its last finals, let it publish its final clean, then drain the console
+            bus.unsubscribe("transcript_buffer")
+            transcript_buffer.close()
+            bus.close()
+            bus.print_stats()
+            ledger.print_stats()
+            llm_client.print_stats()
+            exporter.close()
+            metrics.registry.print_summary()
+            for speaker_tag, seconds in sorted(timeline.talk_time().items()):
+                print(f"Speaker {speaker_tag}: {seconds:.1f} s of speech")
+            if vad:
+                print(f"Suppressed {vad.suppressed_fraction:.0%} of audio as silence ({vad.keepalives} keepalives)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,278 @@
+import queue
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from google.cloud import speech
+
+from config import (
+    STREAM_ROTATE_SECONDS,
+    STREAM_MAX_SECONDS,
+    STREAM_OVERLAP_SECONDS,
+    STREAM_RESTART_BACKOFF_SECONDS,
+    STREAM_RESTART_MAX_BACKOFF_SECONDS,
+)
+
+# paInt16 mono
+BYTES_PER_SAMPLE = 2
+
+
+class _Stream:
+    def __init__(self, stream_id, audio_offset):
+        self.stream_id = stream_id
+        # Position of this stream's first byte on the session-wide audio timeline, in seconds
+        self.audio_offset = audio_offset
+        self.requests = queue.Queue()
+        self.started_at = time.monotonic()
+        self.first_response_at = None
+        # Session audio time of this stream's first final word and of its latest final word's end
+        self.first_final_start = None
+        self.last_final_end = None
+        # Set once the stream's reader has delivered its last response
+        self.done = False
+        self.gap_recorded = False
+        self.closed = False
+
+    def request_generator(self):
+        while True:
+            content = self.requests.get()
+            if content is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=content)
+
+
+class RotatingStreamSession:
+    """Runs streaming_recognize as a chain of overlapping streams for sessions of any length.
+
+    Google closes a streaming session after a fixed duration, so before the current stream
+    reaches STREAM_MAX_SECONDS the next one is opened, primed with the last
+    STREAM_OVERLAP_SECONDS of audio, and fed in parallel until the old one is closed.
+    Finals from both streams are mapped onto one audio timeline using their word time
+    offsets, and words already emitted by the older stream are dropped from the newer one.
+    Interim results from a stream are ignored once a newer stream is running.
+
+    rotation_gaps holds, per rotation, the audio time between the old stream's last final and
+    the new stream's first final (0 when they overlap). A newest stream that keeps dying before
+    its first response is reopened with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        client,
+        streaming_config,
+        audio_chunks,
+        rate,
+        rotate_seconds=STREAM_ROTATE_SECONDS,
+        max_seconds=STREAM_MAX_SECONDS,
+        overlap_seconds=STREAM_OVERLAP_SECONDS,
+        restart_backoff=STREAM_RESTART_BACKOFF_SECONDS,
+        restart_max_backoff=STREAM_RESTART_MAX_BACKOFF_SECONDS,
+    ):
+        self.client = client
+        self.streaming_config = streaming_config
+        self.audio_chunks = audio_chunks
+        self.bytes_per_second = rate * BYTES_PER_SAMPLE
+        self.rotate_seconds = rotate_seconds
+        self.max_seconds = max_seconds
+        self.overlap_bytes = int(overlap_seconds * self.bytes_per_second)
+        self.restart_backoff = restart_backoff
+        self.restart_max_backoff = restart_max_backoff
+
+        self._replay = deque()
+        self._replay_bytes = 0
+        self._audio_bytes_total = 0
+
+        self._streams = []
+        self._next_stream_id = 0
+        self._lock = threading.Lock()
+        self._responses = queue.Queue()
+        self._open_readers = 0
+        self._restart_requested = False
+        self._restart_at = 0.0
+        # Consecutive newest streams that ended without a single response
+        self._restart_failures = 0
+
+        self._last_final_end = 0.0
+        self.rotations = 0
+        self.rotation_gaps = []
+
+    def responses(self):
+        """Yield de-duplicated responses across every stream of the session."""
+        self._open_stream()
+        pump = threading.Thread(target=self._pump_audio, name="audio-pump", daemon=True)
+        pump.start()
+
+        pump_done = False
+        while True:
+            stream, response = self._responses.get()
+            if stream is None:
+                pump_done = True
+            elif response is None:
+                with self._lock:
+                    self._open_readers -= 1
+                    stream.done = True
+                    if not stream.closed:
+                        if stream is self._streams[-1]:
+                            # The newest stream died before rotation; open a replacement
+                            self._request_restart(stream)
+                        self._close_stream(stream)
+                    following = self._next_stream(stream)
+                    if following is not None:
+                        self._record_gap(following)
+            else:
+                response = self._process(stream, response)
+                if response is not None:
+                    yield response
+
+            with self._lock:
+                if pump_done and self._open_readers == 0:
+                    return
+
+    def _pump_audio(self):
+        try:
+            for content in self.audio_chunks:
+                with self._lock:
+                    self._rotate_if_due()
+                    self._remember(content)
+                    self._audio_bytes_total += len(content)
+                    for stream in self._streams:
+                        if not stream.closed:
+                            stream.requests.put(content)
+        finally:
+            with self._lock:
+                for stream in self._streams:
+                    self._close_stream(stream)
+            self._responses.put((None, None))
+
+    def _rotate_if_due(self):
+        now = time.monotonic()
+        current = self._streams[-1]
+
+        if self._restart_requested:
+            if now >= self._restart_at:
+                self._restart_requested = False
+                self._open_stream(replay=True)
+        elif now - current.started_at >= self.rotate_seconds:
+            self._open_stream(replay=True)
+
+        for stream in self._streams[:-1]:
+            if not stream.closed and now - stream.started_at >= self.max_seconds:
+                self._close_stream(stream)
+
+    def _request_restart(self, stream):
+        if stream.first_response_at is None:
+            self._restart_failures += 1
+        else:
+            self._restart_failures = 0
+        delay = 0.0
+        if self._restart_failures:
+            delay = min(self.restart_max_backoff, self.restart_backoff * 2 ** (self._restart_failures - 1))
+            print(f"\n[Speech stream {stream.stream_id} failed before responding; reopening in {delay:.1f} s]")
+        self._restart_at = time.monotonic() + delay
+        self._restart_requested = True
+
+    def _open_stream(self, replay=False):
+        replay_chunks = list(self._replay) if replay else []
+        replay_bytes = self._replay_bytes if replay else 0
+        offset = (self._audio_bytes_total - replay_bytes) / self.bytes_per_second
+
+        stream = _Stream(self._next_stream_id, offset)
+        self._next_stream_id += 1
+        for content in replay_chunks:
+            stream.requests.put(content)
+
+        if self._streams:
+            self.rotations += 1
+            print(f"\n[Rotating to speech stream {stream.stream_id}, replaying {replay_bytes / self.bytes_per_second:.1f} s]")
+        self._streams.append(stream)
+        self._open_readers += 1
+
+        reader = threading.Thread(target=self._read_stream, args=(stream,), name=f"speech-stream-{stream.stream_id}", daemon=True)
+        reader.start()
+
+    def _close_stream(self, stream):
+        if not stream.closed:
+            stream.closed = True
+            stream.requests.put(None)
+
+    def _read_stream(self, stream):
+        try:
+            for response in self.client.streaming_recognize(self.streaming_config, stream.request_generator()):
+                self._responses.put((stream, response))
+        except Exception as e:
+            print(f"\n[Speech stream {stream.stream_id} ended: {e}]")
+        finally:
+            self._responses.put((stream, None))
+
+    def _remember(self, content):
+        self._replay.append(content)
+        self._replay_bytes += len(content)
+        while self._replay and self._replay_bytes - len(self._replay[0]) >= self.overlap_bytes:
+            self._replay_bytes -= len(self._replay.popleft())
+
+    def _process(self, stream, response):
+        if stream.first_response_at is None:
+            stream.first_response_at = time.monotonic()
+
+        if not response.results:
+            return response
+
+        result = response.results[0]
+        newer_running = stream is not self._streams[-1] and self._streams[-1].first_response_at is not None
+        if not result.is_final:
+            return None if newer_running else response
+
+        if not result.alternatives:
+            return response
+        alternative = result.alternatives[0]
+        words = alternative.words
+        if not words:
+            return response
+
+        ends = [stream.audio_offset + word.end_time.total_seconds() for word in words]
+        stream.last_final_end = max(stream.last_final_end or 0.0, ends[-1])
+        if stream.first_final_start is None:
+            stream.first_final_start = stream.audio_offset + words[0].start_time.total_seconds()
+            with self._lock:
+                self._record_gap(stream)
+
+        # Drop words the previous stream already emitted during the overlap
+        skip = 0
+        while skip < len(ends) and ends[skip] <= self._last_final_end + 1e-3:
+            skip += 1
+        if skip == len(ends):
+            return None
+        if skip:
+            del alternative.words[:skip]
+            alternative.transcript = " ".join(word.word for word in alternative.words)
+        if stream.audio_offset:
+            # Word offsets are relative to their own stream; move them onto the session timeline
+            shift = timedelta(seconds=stream.audio_offset)
+            for word in alternative.words:
+                word.start_time = word.start_time + shift
+                word.end_time = word.end_time + shift
+        self._last_final_end = max(self._last_final_end, ends[-1])
+        return response
+
+    def _record_gap(self, stream):
+        # Once the previous stream has delivered its last final, the audio between that final and
+        # this stream's first one went untranscribed; overlapping finals make it 0
+        previous = self._previous_stream(stream)
+        if (
+            stream.gap_recorded or previous is None or not previous.done
+            or stream.first_final_start is None or previous.last_final_end is None
+        ):
+            return
+        stream.gap_recorded = True
+        gap = max(0.0, stream.first_final_start - previous.last_final_end)
+        self.rotation_gaps.append(gap)
+        print(f"\n[Stream rotation {stream.stream_id}: transcription gap {gap * 1000:.0f} ms of audio]")
+
+    def _previous_stream(self, stream):
+        index = self._streams.index(stream)
+        return self._streams[index - 1] if index > 0 else None
+
+    def _next_stream(self, stream):
+        index = self._streams.index(stream)
+        return self._streams[index + 1] if index + 1 < len(self._streams) else None
@@ -0,0 +1,305 @@
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+import jsonref
+from pydantic import ValidationError
+from vertexai.generative_models import GenerationConfig
+
+from config import STRUCTURED_MAX_ATTEMPTS
+from llm_cache import cache_key, cached_generate_text, get_llm_cache, model_name_of
+from llm_client import client as llm_client
+from llm_usage import ledger
+
+
+# Keys Pydantic emits that Vertex AI's response_schema does not accept
+UNSUPPORTED_SCHEMA_KEYS = {"title", "$defs", "default", "additionalProperties"}
+
+_CODE_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+# call site -> number of responses that could not be parsed into the expected schema
+parse_failures = Counter()
+_parse_failures_lock = threading.Lock()
+
+
+class StructuredOutputError(Exception):
+    """Raised when no attempt produced a response matching the schema."""
+
+
+@lru_cache(maxsize=None)
+def vertex_schema(model):
+    """Convert a Pydantic model into an inline schema for GenerationConfig.response_schema."""
+    schema = jsonref.replace_refs(model.model_json_schema(), proxies=False, lazy_load=False)
+    return _clean_schema(schema)
+
+
+def _clean_schema(node):
+    if isinstance(node, list):
+        return [_clean_schema(item) for item in node]
+    if not isinstance(node, dict):
+        return node
+
+    # Optional[X] comes through as anyOf [X, null]; Vertex expresses that as nullable
+    any_of = node.get("anyOf")
+    if any_of:
+        non_null = [option for option in any_of if option.get("type") != "null"]
+        if len(non_null) == 1 and len(non_null) < len(any_of):
+            cleaned = _clean_schema(non_null[0])
+            cleaned["nullable"] = True
+            return cleaned
+
+    return {key: _clean_schema(value) for key, value in node.items() if key not in UNSUPPORTED_SCHEMA_KEYS}
+
+
+def parse_structured(text, response_model):
+    """Parse model output into response_model.
+
+    Schema-constrained responses are plain JSON and validate on the first try; the slower
+    repair path strips code fences and surrounding prose, and wraps a bare array for
+    single-field models. Raises ValueError (ValidationError included) when nothing fits.
+    """
+    try:
+        return response_model.model_validate_json(text)
+    except ValidationError:
+        pass
+
+    data = json.loads(_extract_json(text))
+    fields = list(response_model.model_fields)
+    if isinstance(data, list) and len(fields) == 1:
+        data = {fields[0]: data}
+    return response_model.model_validate(data)
+
+
+def _extract_json(text):
+    text = text.strip()
+    fence = _CODE_FENCE.search(text)
+    if fence:
+        text = fence.group(1).strip()
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("No JSON found in response")
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    if end < start:
+        raise ValueError("Unterminated JSON in response")
+    return text[start:end + 1]
+
+
+def generate_structured(
+    model, prompt, response_model, call_site, max_attempts=STRUCTURED_MAX_ATTEMPTS, session=None, use_cache=True,
+    elidable=None,
+):
+    """Single structured-output path for Gemini calls.
+
+    Requests JSON constrained to response_model, parses it with parse_structured, and on a
+    parse failure retries up to max_attempts in total with the error appended to the prompt.
+    Failures are counted per call_site in parse_failures, and token usage is recorded per
+    call_site and session in llm_usage.ledger; use_cache=False bypasses the shared response cache.
+    Transport errors and PromptBudgetExceeded propagate.
+    """
+    return _generate_structured(model, prompt, prompt, response_model, call_site, max_attempts, session, use_cache, elidable)
+
+
+def _retry_prompt(prompt, error):
+    return (
+        f"{prompt}\n\nYour previous response could not be parsed: {error}\n"
+        "Respond with only JSON that matches the response schema."
+    )
+
+
+def _generate_structured(model, prompt, attempt_prompt, response_model, call_site, max_attempts, session, use_cache, elidable):
+    # attempt_prompt is the first prompt sent; retries append their parse error to `prompt`
+    generation_config = GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=vertex_schema(response_model),
+    )
+
+    last_error = None
+    for attempt in range(max_attempts):
+        try:
+            text = cached_generate_text(
+                model,
+                attempt_prompt,
+                generation_config=generation_config,
+                schema=response_model,
+                validate=lambda text: parse_structured(text, response_model),
+                call_site=call_site,
+                session=session,
+                use_cache=use_cache,
+                elidable=elidable,
+            )
+            return parse_structured(text, response_model)
+        except ValueError as e:
+            last_error = e
+            with _parse_failures_lock:
+                parse_failures[call_site] += 1
+            print(f"Could not parse {call_site} response (attempt {attempt + 1}/{max_attempts}): {e}")
+            attempt_prompt = _retry_prompt(prompt, e)
+
+    raise StructuredOutputError(f"{call_site}: no valid response after {max_attempts} attempts: {last_error}")
+
+
+class IncrementalArrayParser:
+    """Emits the elements of a streamed JSON array as soon as each one closes.
+
+    The target is the first array that is either the top-level value or a field of the
+    top-level object, e.g. ["a", "b"] or {"chunks": [["a"], ["b"]]}. feed() takes the next
+    text fragment and returns the elements completed by it, already decoded.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_depth = None
+        self._item_start = None
+
+    def feed(self, fragment):
+        self._text += fragment
+        text = self._text
+        items = []
+
+        i = self._pos
+        while i < len(text) and not self.done:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._at_item_level() and self._item_start is not None:
+                        items.append(self._emit(i + 1))
+            elif c == '"':
+                self._in_string = True
+                self._start_item(i)
+            elif c in "[{":
+                self._start_item(i)
+                self._depth += 1
+                if c == "[" and self._array_depth is None and self._depth <= 2:
+                    self._array_depth = self._depth
+            elif c in "]}":
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if self._depth < self._array_depth:
+                        # The target array itself closed; flush a trailing scalar element
+                        if self._item_start is not None:
+                            items.append(self._emit(i))
+                        self.done = True
+                    elif self._at_item_level() and self._item_start is not None:
+                        items.append(self._emit(i + 1))
+            elif c == ",":
+                if self._at_item_level() and self._item_start is not None:
+                    items.append(self._emit(i))
+            elif not c.isspace():
+                self._start_item(i)
+            i += 1
+
+        self._pos = i
+        return items
+
+    def _at_item_level(self):
+        return self._array_depth is not None and self._depth == self._array_depth
+
+    def _start_item(self, i):
+        if self._at_item_level() and self._item_start is None:
+            self._item_start = i
+
+    def _emit(self, end):
+        raw = self._text[self._item_start:end]
+        self._item_start = None
+        return json.loads(raw)
+
+
+def generate_structured_stream(
+    model, prompt, response_model, call_site, on_item, max_attempts=STRUCTURED_MAX_ATTEMPTS, session=None,
+    use_cache=True, elidable=None,
+):
+    """Streaming variant of generate_structured.
+
+    Uses generate_content(..., stream=True) and calls on_item for each element of the
+    response's array as soon as it is complete, so consumers see the first element at
+    first-token latency. The full response is still validated against response_model and
+    returned. If it does not parse, the request is retried without streaming, with the parse
+    error in the prompt as generate_structured does, using the rest of max_attempts; only
+    elements past the ones already emitted are passed to on_item, so each array position is
+    emitted once. A stream chunk without text (e.g. a blocked response) raises
+    StructuredOutputError without a retry.
+    """
+    generation_config = GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=vertex_schema(response_model),
+    )
+
+    sent_prompt = ledger.check(call_site, prompt, session, elidable)
+    cache = get_llm_cache() if use_cache else None
+    key = cache_key(model_name_of(model), sent_prompt, response_model)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        ledger.record(call_site, sent_prompt, session=session, cached=True)
+        for item in IncrementalArrayParser().feed(cached):
+            on_item(item)
+        return parse_structured(cached, response_model)
+
+    start = time.perf_counter()
+    parser = IncrementalArrayParser()
+    parts = []
+    first_item_at = None
+    # Usage metadata arrives on the last chunk of a stream
+    last_chunk = None
+
+    def open_stream():
+        # The request is only sent when the stream is first read, so the first chunk is part of the attempt
+        chunks = iter(model.generate_content(sent_prompt, generation_config=generation_config, stream=True))
+        first = next(chunks, None)
+        return chunks if first is None else itertools.chain([first], chunks)
+
+    emitted = 0
+    # A hedged stream would emit its items twice
+    for chunk in llm_client.call(call_site, open_stream, hedge=False):
+        last_chunk = chunk
+        try:
+            piece = chunk.text
+        except ValueError as e:
+            # Blocked or empty candidates; the same prompt would most likely be blocked again
+            raise StructuredOutputError(f"{call_site}: stream chunk has no text: {e}") from e
+        parts.append(piece)
+        for item in parser.feed(piece):
+            if first_item_at is None:
+                first_item_at = time.perf_counter()
+                print(f"First {call_site} item after {(first_item_at - start) * 1000:.0f} ms")
+            on_item(item)
+            emitted += 1
+
+    text = "".join(parts)
+    ledger.record(call_site, sent_prompt, text, last_chunk, time.perf_counter() - start, session)
+    try:
+        result = parse_structured(text, response_model)
+    except ValueError as e:
+        with _parse_failures_lock:
+            parse_failures[call_site] += 1
+        print(f"Could not parse streamed {call_site} response: {e}")
+        if max_attempts <= 1:
+            raise StructuredOutputError(f"{call_site}: no valid response after 1 attempt: {e}") from e
+        result = _generate_structured(
+            model, prompt, _retry_prompt(prompt, e), response_model, call_site, max_attempts - 1, session, use_cache,
+            elidable,
+        )
+        # The retried response is cached by its own prompt; emit only what the stream did not
+        items = IncrementalArrayParser().feed(result.model_dump_json())
+        for item in items[emitted:]:
+            on_item(item)
+        return result
+
+    if cache is not None:
+        cache.put(key, text)
+    return result
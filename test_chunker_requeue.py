@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Offline tests for how TranscriptBufferChunker requeues an interval whose chunks only partly applied
+"""
+
+import json
+
+from replay_harness import FakeGenerativeModel, LatencyModel
+from topic_manager import TopicClassification
+from transcript_buffer_chunker import TranscriptBufferChunker
+
+
+class FailingTopics:
+    """Stands in for TopicManager; apply_classification fails once `fail_on` chunks were applied."""
+
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.applied = []
+        self.index = []
+        self.cold_index = []
+
+    def shortlist_topics(self, lines):
+        return []
+
+    def shortlist_context(self, candidates):
+        return "No topics available"
+
+    def topic_context(self, lines):
+        return "No topics available"
+
+    def classify_chunk(self, chunk):
+        return TopicClassification(topic_key=None, updated_description="chunk")
+
+    def apply_classification(self, classification, content=None):
+        if len(self.applied) == self.fail_on:
+            raise RuntimeError("injected apply failure")
+        self.applied.append(content)
+        return f"topic-{len(self.applied)}"
+
+    def list_topics(self):
+        return []
+
+
+def fused_responder(prompt):
+    # Two interleaved topics: lines 1 and 3 in the first chunk, 2 and 4 in the second
+    return json.dumps({
+        "cleaned_lines": ["one", "two", "three", "four"],
+        "chunks": [
+            {"line_numbers": [1, 3], "topic_key": None, "updated_description": "odd"},
+            {"line_numbers": [2, 4], "topic_key": None, "updated_description": "even"},
+        ],
+    })
+
+
+def make_chunker(topics, responder):
+    model = FakeGenerativeModel(LatencyModel(0.0, distribution="constant"), responder=responder)
+    return TranscriptBufferChunker(topics_manager=topics, model=model, timer=False, stream=False, use_cache=False)
+
+
+def test_non_contiguous_partial_failure():
+    """Only the lines of the chunk that failed to apply go back to pending, in their original order."""
+    topics = FailingTopics(fail_on=1)
+    chunker = make_chunker(topics, fused_responder)
+    lines = ["raw 1", "raw 2", "raw 3", "raw 4"]
+
+    try:
+        chunker.process_lines(lines)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("the apply failure should propagate")
+
+    assert topics.applied == ["one\nthree"]
+    assert chunker.requeued == [1, 3]
+    assert chunker.pending == ["raw 2", "raw 4"]
+
+    # The retry applies the requeued lines once and nothing from the first chunk again
+    topics.fail_on = None
+    chunker.model.responder = lambda prompt: json.dumps({
+        "cleaned_lines": ["two", "four"],
+        "chunks": [{"line_numbers": [1, 2], "topic_key": None, "updated_description": "even"}],
+    })
+    chunker.process_pending()
+    assert topics.applied == ["one\nthree", "two\nfour"]
+    assert chunker.pending == []
+    assert chunker.requeued == []
+    chunker.close()
+
+
+def test_invalid_line_numbers_fall_back():
+    """A fused response that leaves a line out of every chunk is rejected before anything is applied."""
+    topics = FailingTopics(fail_on=None)
+
+    def responder(prompt):
+        if "The existing topics are:" in prompt:
+            return json.dumps({
+                "cleaned_lines": ["one", "two"],
+                "chunks": [{"line_numbers": [1], "topic_key": None, "updated_description": "one"}],
+            })
+        if "Here is the transcript to clean:" in prompt:
+            return json.dumps({"cleaned_lines": ["one", "two"]})
+        return json.dumps({"chunks": [[2], [1]]})
+
+    chunker = make_chunker(topics, responder)
+    chunker.process_lines(["raw 1", "raw 2"])
+    assert topics.applied == ["two", "one"]
+    chunker.close()
+
+
+if __name__ == "__main__":
+    for test in (test_non_contiguous_partial_failure, test_invalid_line_numbers_fall_back):
+        test()
+        print(f"✅ {test.__name__}")
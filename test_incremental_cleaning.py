@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Offline tests for TranscriptBuffer's incremental cleaning when the model does not return one line per line
+"""
+
+from transcript_buffer import TranscriptBuffer
+
+
+class MergingClient:
+    """Stands in for the Instructor client; merges every request of more than one line into one line."""
+
+    def __init__(self):
+        self.requests = []
+
+    def create_with_completion(self, response_model, messages):
+        lines = messages[-1]["content"].split("New lines to clean:\n", 1)[1].split("\n")
+        self.requests.append(lines)
+        if len(lines) == 1:
+            cleaned = [lines[0].upper()]
+        else:
+            cleaned = [" ".join(lines).upper()]
+        return response_model(cleaned_lines=cleaned, topic_finished=False), None
+
+
+def make_buffer(client):
+    return TranscriptBuffer(clean_interval_seconds=1000, incremental=True, context_lines=0, use_cache=False, client=client)
+
+
+def test_memo_hit_with_merged_lines():
+    """A memo hit in a batch the model merges is cleaned with the batch instead of going missing."""
+    client = MergingClient()
+    buffer = make_buffer(client)
+
+    buffer.add_transcript("hello", "A:")
+    buffer.flush()
+    assert buffer.get_cleaned_transcript() == "A:HELLO"
+
+    # "A:hello" is now memoized; the other two lines come back merged into one
+    buffer.add_transcript("first", "B:")
+    buffer.add_transcript("hello", "A:")
+    buffer.add_transcript("second", "B:")
+    result = buffer.flush()
+
+    assert client.requests[1] == ["B:first", "B:second"]
+    assert client.requests[2] == ["B:first", "A:hello", "B:second"]
+    assert result.cleaned_transcript == "B:FIRST A:HELLO B:SECOND"
+    assert buffer.get_cleaned_transcript() == "A:HELLO\nB:FIRST A:HELLO B:SECOND"
+    buffer.close()
+
+
+def test_repeated_lines_with_merged_lines():
+    """A line repeated in one batch is sent once, so merged output is re-requested for the whole batch."""
+    client = MergingClient()
+    buffer = make_buffer(client)
+
+    for text in ("yes", "no", "yes"):
+        buffer.add_transcript(text, "A:")
+    result = buffer.flush()
+
+    assert client.requests == [["A:yes", "A:no"], ["A:yes", "A:no", "A:yes"]]
+    assert result.cleaned_transcript == "A:YES A:NO A:YES"
+    buffer.close()
+
+
+if __name__ == "__main__":
+    for test in (test_memo_hit_with_merged_lines, test_repeated_lines_with_merged_lines):
+        test()
+        print(f"✅ {test.__name__}")
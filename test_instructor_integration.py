@@ -142,6 +142,8 @@ def test_transcript_buffer_integration():
         buffer.add_transcript("I was thinking around fifty thousand dollars.", "Speaker1")
         buffer.add_transcript("That sounds reasonable to me.", "Speaker2")
         buffer.add_transcript("Great! Let's finalize that then.", "Speaker1")
+        print(f"Cleaning jobs queued: {buffer.queue_depth()}")
+        buffer.flush()
         
         print("✅ Transcript pieces added successfully!")
         
@@ -150,7 +152,7 @@ def test_transcript_buffer_integration():
             result = buffer.last_cleaning_result
             print(f"✅ Cleaning result available: {type(result)}")
             print("\nCleaned transcript:")
-            print(result.cleaned_transcript)
+            print(buffer.get_cleaned_transcript() or result.cleaned_transcript)
             print(f"\nTopic finished: {result.topic_finished}")
             
             # Test convenience methods
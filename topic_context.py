@@ -0,0 +1,31 @@
+from llm_usage import estimate_tokens
+
+
+def recency(age, half_life):
+    """1.0 for a topic touched just now, halving every half_life topic updates since."""
+    if half_life <= 0:
+        return 0.0
+    return 0.5 ** (age / half_life)
+
+
+def build_topic_context(topics, budget):
+    """Join ranked (topic_key, summary) pairs into "key: summary" lines within a token budget.
+
+    Topics are taken best first; one that does not fit is skipped so a long summary does not
+    crowd out shorter, lower-ranked ones. The best topic is always kept, truncated if needed.
+    """
+    lines = []
+    used = 0
+    for key, summary in topics:
+        line = f"{key}: {summary}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            if lines:
+                continue
+            line = line[:max(budget - 1, 1) * 4]
+            cost = estimate_tokens(line) + 1
+        lines.append(line)
+        used += cost
+        if used >= budget:
+            break
+    return "\n".join(lines) if lines else "No topics available"
@@ -0,0 +1,162 @@
+import re
+import zlib
+
+import numpy as np
+
+from config import TOPIC_INDEX_DIM
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset(
+    """a an and are as at be but by do for from has have he her his i if in is it its
+    just like me my no not of on or our so that the their them then there they this to
+    um uh up was we were what when which who will with yeah you your speaker""".split()
+)
+
+
+class TopicIndex:
+    """Hashing-vectorizer index over topic summaries and content.
+
+    Each topic keeps a summary vector and an accumulated content vector; their
+    L2-normalized sum is the row searched by cosine similarity. Updates only touch
+    the affected row, so the index stays current without re-vectorizing everything.
+    """
+
+    def __init__(self, dim=TOPIC_INDEX_DIM, initial_capacity=64):
+        self.dim = dim
+        self._keys = []
+        self._rows = {}
+        self._summary = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._content = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def vectorize(self, text):
+        tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+        if not tokens:
+            return np.zeros(self.dim, dtype=np.float32)
+        buckets = [zlib.crc32(t.encode()) % self.dim for t in tokens]
+        return np.bincount(buckets, minlength=self.dim).astype(np.float32)
+
+    def add(self, key, summary, vector=None):
+        # Vectorize before touching any row, so bad input leaves the index unchanged
+        vector = self.vectorize(summary) if vector is None else vector
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            self._grow(row + 1)
+            self._keys.append(key)
+            self._rows[key] = row
+            self._content[row] = 0
+        self._summary[row] = vector
+        self._refresh(row)
+
+    def set_summary(self, key, summary, vector=None):
+        vector = self.vectorize(summary) if vector is None else vector
+        if key not in self._rows:
+            self.add(key, summary, vector)
+            return
+        row = self._rows[key]
+        self._summary[row] = vector
+        self._refresh(row)
+
+    def extend(self, key, content, vector=None):
+        vector = self.vectorize(content) if vector is None else vector
+        row = self._rows.get(key)
+        if row is None:
+            raise ValueError(f"Topic key '{key}' is not indexed")
+        self._content[row] += vector
+        self._refresh(row)
+
+    def remove(self, key):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self._keys) - 1
+        if row != last:
+            moved = self._keys[last]
+            self._keys[row] = moved
+            self._rows[moved] = row
+            for arr in (self._summary, self._content, self._matrix):
+                arr[row] = arr[last]
+        self._keys.pop()
+
+    def take(self, key):
+        """Remove a topic and return its (summary, content) vectors, e.g. to move it to another index."""
+        row = self._rows.get(key)
+        if row is None:
+            raise ValueError(f"Topic key '{key}' is not indexed")
+        vectors = self._summary[row].copy(), self._content[row].copy()
+        self.remove(key)
+        return vectors
+
+    def put(self, key, summary, content):
+        """Insert a topic from vectors returned by take(), without re-vectorizing its text."""
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            self._grow(row + 1)
+            self._keys.append(key)
+            self._rows[key] = row
+        self._summary[row] = summary
+        self._content[row] = content
+        self._refresh(row)
+
+    def state(self):
+        """Copies of the keys and raw summary/content vectors, e.g. for a snapshot."""
+        size = len(self._keys)
+        return list(self._keys), self._summary[:size].copy(), self._content[:size].copy()
+
+    def load_state(self, keys, summary, content):
+        """Replace the index with previously saved vectors, without re-vectorizing any text."""
+        size = len(keys)
+        self._keys = list(keys)
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._grow(size)
+        self._summary[:size] = summary
+        self._content[:size] = content
+        vec = self._summary[:size] + np.log1p(self._content[:size])
+        norms = np.linalg.norm(vec, axis=1, keepdims=True)
+        self._matrix[:size] = np.divide(vec, norms, out=np.zeros_like(vec), where=norms > 0)
+
+    def search(self, text, k=5):
+        """Return up to k (topic_key, cosine_score) pairs, best first."""
+        size = len(self._keys)
+        if size == 0 or k <= 0:
+            return []
+
+        query = self.vectorize(text)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = self._matrix[:size] @ (query / norm)
+
+        if k < size:
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(scores[top])[::-1]]
+        else:
+            top = np.argsort(scores)[::-1]
+        return [(self._keys[i], float(scores[i])) for i in top]
+
+    def _refresh(self, row):
+        # Damp long content stacks so they don't drown out the summary
+        vec = self._summary[row] + np.log1p(self._content[row])
+        norm = np.linalg.norm(vec)
+        self._matrix[row] = vec / norm if norm > 0 else 0
+
+    def _grow(self, needed):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        for name in ("_summary", "_content", "_matrix"):
+            old = getattr(self, name)
+            grown = np.zeros((new_capacity, self.dim), dtype=np.float32)
+            grown[:capacity] = old
+            setattr(self, name, grown)
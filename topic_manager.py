@@ -1,11 +1,74 @@
 
 
 from typing import Optional
-import json
+from collections import OrderedDict
+from itertools import islice
+import hashlib
+import re
+import threading
+from time import perf_counter
+import numpy as np
+from pydantic import BaseModel
 from vertexai.generative_models import GenerativeModel
 import vertexai
 
-from config import GEMINI_MODEL, PROJECT_ID, LOCATION
+from config import (
+    GEMINI_MODEL,
+    PROJECT_ID,
+    LOCATION,
+    TOPIC_SHORTLIST_SIZE,
+    TOPIC_MATCH_THRESHOLD,
+    TOPIC_MATCH_MARGIN,
+    TOPIC_LLM_RELABEL,
+    TOPIC_STORE_DIR,
+    TOPIC_CONTEXT_TOKENS,
+    TOPIC_CONTEXT_CANDIDATES,
+    TOPIC_RECENCY_WEIGHT,
+    TOPIC_RECENCY_HALF_LIFE,
+    TOPIC_COLD_AFTER,
+    TOPIC_HOT_MIN_SCORE,
+    TOPIC_STACK_MAX_ENTRIES,
+    TOPIC_STACK_KEEP,
+)
+from topic_index import TopicIndex, STOPWORDS
+from topic_context import build_topic_context, recency
+from background_worker import BackgroundWorker
+from topic_store import TopicStore
+from structured_output import generate_structured, StructuredOutputError
+from llm_usage import PromptBudgetExceeded
+import metrics
+
+
+def make_topic_key(description, existing=(), max_words=4, hash_chars=6):
+    """Deterministic, readable topic key: a slug of the description plus a short hash.
+
+    e.g. "Project budget of fifty thousand dollars" -> "project_budget_fifty_thousand_3f9a1c".
+    If the key is already taken (the same description added twice), a counter is appended.
+    """
+    description = (description or "").strip()
+    words = [w for w in re.findall(r"[a-z0-9]+", description.lower()) if w not in STOPWORDS]
+    slug = "_".join(words[:max_words])[:40].rstrip("_") or "topic"
+    digest = hashlib.blake2b(description.encode(), digest_size=8).hexdigest()[:hash_chars]
+
+    key = f"{slug}_{digest}"
+    suffix = 2
+    while key in existing:
+        key = f"{slug}_{digest}_{suffix}"
+        suffix += 1
+    return key
+
+
+class TopicClassificationResponse(BaseModel):
+    topic_key: Optional[str] = None
+    updated_description: str
+
+
+class TopicLabelResponse(BaseModel):
+    label: str
+
+
+class TopicDigestResponse(BaseModel):
+    digest: str
 
 
 class TopicClassification:
@@ -15,97 +78,348 @@ class TopicClassification:
 
 
 class TopicManager:
-    def __init__(self):
+    def __init__(
+        self,
+        relabel=TOPIC_LLM_RELABEL,
+        model=None,
+        store_dir=TOPIC_STORE_DIR,
+        compact_after=TOPIC_STACK_MAX_ENTRIES,
+        cold_after=TOPIC_COLD_AFTER,
+        session_id=None,
+        use_cache=True,
+    ):
         self.topics = {}
+        # Token usage is attributed to this session in llm_usage.ledger
+        self.session_id = session_id
+        # False bypasses the shared LLM response cache for this manager's calls
+        self.use_cache = use_cache
+        self.index = TopicIndex()
 
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        self.model = GenerativeModel(GEMINI_MODEL)
+        # Stale topics move to the cold index, which is only searched when nothing hot matches.
+        # _recent holds the hot keys, least recently updated first, with the clock of their last update
+        self.cold_index = TopicIndex()
+        self.cold_after = cold_after
+        self._recent = OrderedDict()
+        self._clock = 0
+        self._lock = threading.RLock()
 
-    def add_new_topic(self, summary):
+        # Sessions in one process can share a model instead of each building their own
+        if model is None:
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+            model = GenerativeModel(GEMINI_MODEL)
+        self.model = model
 
-        # generate a new topic key 
-        prompt = f"""Generate a new unique topic identifier for the following summary: {summary}
+        # Optional LLM labels are generated off the ingestion path
+        self.relabeler = BackgroundWorker(self._relabel_topic, name="topic-relabeler") if relabel else None
 
-Return only a JSON response with this exact format:
-{{"topic_key": "your_generated_topic_key_here"}}"""
-        
-        response = self.model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Parse JSON response
-        try:
-            # Extract JSON from response if it's wrapped in markdown code blocks
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                json_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                json_text = response_text[json_start:json_end].strip()
-            else:
-                json_text = response_text
-            
-            parsed_response = json.loads(json_text)
-            topic_key = parsed_response.get("topic_key")
-            
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Error parsing topic_key response: {e}")
-            print(f"Response text: {response_text}")
-            # Fallback to using the raw response as topic_key
-            topic_key = response_text.strip()
+        # Old content_stack entries are folded into a rolling digest off the ingestion path too
+        self.compact_after = compact_after
+        self._compacting = set()
+        self.compactor = BackgroundWorker(self._compact_topic, name="topic-compactor") if compact_after > 0 else None
+
+        # Mutations are logged so a restart picks up the topics instead of re-creating them
+        self.store = None
+        if store_dir:
+            self.store = TopicStore(store_dir, self._snapshot_state)
+            self._restore()
+
+    def _restore(self):
+        start = perf_counter()
+        snapshot, records = self.store.load()
+        if snapshot:
+            self.topics = snapshot["topics"]
+            self.index.load_state(snapshot["keys"], snapshot["summary_vectors"], snapshot["content_vectors"])
+            for key in sorted(self.topics, key=lambda key: self.topics[key].get("touched", 0)):
+                self._recent[key] = self.topics[key].get("touched", 0)
+            self._clock = max(self._recent.values(), default=0)
+            self._demote_stale()
+        for _, op, topic_key, value in records:
+            self._apply(op, topic_key, value)
+        if self.topics:
+            print(
+                f"Restored {len(self.topics)} topics from {self.store.directory} "
+                f"({len(records)} log records) in {(perf_counter() - start) * 1000:.0f} ms"
+            )
+
+    def _apply(self, op, topic_key, value):
+        # Everything that can fail on bad input (unknown op, missing topic, text that does not
+        # vectorize) happens before topics or the index change, so a mutation applies fully or not at all
+        if op in ("add", "update", "extend"):
+            vector = self.index.vectorize(value)
+        if op in ("update", "extend", "label", "compact") and topic_key not in self.topics:
+            raise ValueError(f"Topic key '{topic_key}' does not exist")
+
+        if op == "add":
+            self.topics[topic_key] = {"summary": value, "content_stack": []}
+            self.index.add(topic_key, value, vector)
+            self._touch(topic_key)
+        elif op == "update":
+            self._touch(topic_key)
+            self.topics[topic_key]["summary"] = value
+            self.index.set_summary(topic_key, value, vector)
+        elif op == "extend":
+            self._touch(topic_key)
+            self.topics[topic_key]["content_stack"].append(value)
+            self.index.extend(topic_key, value, vector)
+        elif op == "label":
+            self.topics[topic_key]["label"] = value
+        elif op == "compact":
+            # Entries are only ever appended, so the oldest `count` are the ones the digest covers
+            topic = self.topics[topic_key]
+            del topic["content_stack"][:value["count"]]
+            topic["digest"] = value["digest"]
+        else:
+            raise ValueError(f"Unknown topic mutation '{op}'")
+
+    def _mutate(self, op, topic_key, value):
+        # The relabeler and compactor mutate from their own threads; keep the log in apply order.
+        # Only a mutation that applied cleanly is logged, so memory and the store never diverge
+        with self._lock:
+            self._apply(op, topic_key, value)
+            if self.store:
+                self.store.append(op, topic_key, value)
+
+    def _touch(self, topic_key):
+        self._clock += 1
+        self.topics[topic_key]["touched"] = self._clock
+        if topic_key in self.cold_index:
+            self.index.put(topic_key, *self.cold_index.take(topic_key))
+        self._recent[topic_key] = self._clock
+        self._recent.move_to_end(topic_key)
+        self._demote_stale()
 
+    def _demote_stale(self):
+        if self.cold_after <= 0:
+            return
+        while self._recent:
+            topic_key, touched = next(iter(self._recent.items()))
+            if self._clock - touched <= self.cold_after:
+                break
+            del self._recent[topic_key]
+            self.cold_index.put(topic_key, *self.index.take(topic_key))
+
+    def _snapshot_state(self):
+        # Hot and cold topics are saved together; restore re-derives the tiers from "touched"
+        hot_keys, hot_summary, hot_content = self.index.state()
+        cold_keys, cold_summary, cold_content = self.cold_index.state()
+        topics = {
+            key: {**topic, "content_stack": list(topic["content_stack"])}
+            for key, topic in self.topics.items()
+        }
+        return {
+            "keys": hot_keys + cold_keys,
+            "topics": topics,
+            "summary_vectors": np.concatenate([hot_summary, cold_summary]),
+            "content_vectors": np.concatenate([hot_content, cold_content]),
+        }
+
+    def add_new_topic(self, summary):
+        topic_key = make_topic_key(summary, self.topics)
         print(f"\n generated topic_key: {topic_key}\n")
 
-        self.topics[topic_key] = {"summary": summary, "content_stack": []}
+        self._mutate("add", topic_key, summary)
 
         print(f"\n self.topics: {self.topics}\n")
 
+        if self.relabeler:
+            self.relabeler.submit(topic_key)
+        return topic_key
+
+    def get_topic_label(self, topic_key):
+        """Human-friendly label from the optional LLM relabel, falling back to the key."""
+        if topic_key not in self.topics:
+            raise ValueError(f"Topic key '{topic_key}' does not exist")
+        return self.topics[topic_key].get("label") or topic_key
+
+    def close(self):
+        if self.relabeler:
+            self.relabeler.close()
+        if self.compactor:
+            self.compactor.close()
+        if self.store:
+            self.store.close()
+
+    def _relabel_topic(self, topic_key):
+        summary = self.topics[topic_key]["summary"]
+        prompt = f"""Generate a short, human-readable label for the following topic summary: {summary}
+
+Return the label in the label field."""
+
+        try:
+            label = generate_structured(
+                self.model, prompt, TopicLabelResponse, call_site="relabel_topic",
+                session=self.session_id, use_cache=self.use_cache,
+            ).label
+        except (StructuredOutputError, PromptBudgetExceeded) as e:
+            print(f"Error generating topic label: {e}")
+            return None
+
+        # The key stays stable; only the display label changes
+        if label and topic_key in self.topics:
+            self._mutate("label", topic_key, label)
+        return label
+
+    def _compact_topic(self, topic_key):
+        try:
+            topic = self.topics[topic_key]
+            old = topic["content_stack"][:len(topic["content_stack"]) - TOPIC_STACK_KEEP]
+            if not old:
+                return None
+            previous = topic.get("digest") or "(none yet)"
+            entries = "\n".join(f"- {entry}" for entry in old)
+            prompt = f"""You maintain a rolling digest of one conversation topic: {topic["summary"]}
+
+The digest so far:
+{previous}
+
+Older conversation content to fold into it:
+{entries}
+
+Write an updated digest that covers both, in at most 120 words. Keep decisions, numbers, names
+and action items; drop filler. Return it in the digest field."""
+
+            try:
+                digest = generate_structured(
+                    self.model, prompt, TopicDigestResponse, call_site="compact_topic",
+                    session=self.session_id, use_cache=self.use_cache,
+                ).digest
+            except (StructuredOutputError, PromptBudgetExceeded) as e:
+                print(f"Error compacting topic {topic_key}: {e}")
+                return None
+
+            self._mutate("compact", topic_key, {"count": len(old), "digest": digest})
+            return digest
+        finally:
+            self._compacting.discard(topic_key)
+
     def list_topics(self):
         return {key: topic["summary"] for key, topic in self.topics.items()}
 
-    def list_topics_string(self):
-        if not self.topics:
-            return "No topics available"
-
-        topics_list = []
-        for key, topic in self.topics.items():
-            topics_list.append(f"{key}: {topic['summary']}")
-        return "\n".join(topics_list)
+    def list_topics_string(self, budget=TOPIC_CONTEXT_TOKENS):
+        """The most recently updated topics, within a token budget."""
+        return self.shortlist_context([], budget)
 
     def update_topic(self, topic_key, summary):
-        self.topics[topic_key]["summary"] = summary
+        self._mutate("update", topic_key, summary)
 
     def extend_topic(self, topic_key, content):
         if topic_key not in self.topics:
             raise ValueError(f"Topic key '{topic_key}' does not exist")
-        self.topics[topic_key]["content_stack"].append(content)
+        self._mutate("extend", topic_key, content)
+
+        if self.compactor and len(self.topics[topic_key]["content_stack"]) > self.compact_after:
+            with self._lock:
+                if topic_key in self._compacting:
+                    return
+                self._compacting.add(topic_key)
+            self.compactor.submit(topic_key)
 
     def get_topic_content(self, topic_key):
         if topic_key not in self.topics:
             raise ValueError(f"Topic key '{topic_key}' does not exist")
         return self.topics[topic_key]["content_stack"]
 
+    def get_topic_digest(self, topic_key):
+        """Rolling summary of the content entries compacted out of the topic's content_stack."""
+        if topic_key not in self.topics:
+            raise ValueError(f"Topic key '{topic_key}' does not exist")
+        return self.topics[topic_key].get("digest", "")
+
     def get_topic_summary(self, topic_key):
         if topic_key not in self.topics:
             raise ValueError(f"Topic key '{topic_key}' does not exist")
         return self.topics[topic_key]["summary"]
 
+    def shortlist_topics(self, chunk, k=TOPIC_SHORTLIST_SIZE):
+        """Top-k (topic_key, score) candidates for a chunk from the local index."""
+        return self.search_topics(self._chunk_text(chunk), k)
+
+    def search_topics(self, text, k):
+        """Search the hot topics, falling back to the cold tier when none of them match."""
+        candidates = self.index.search(text, k)
+        if len(self.cold_index) and (not candidates or candidates[0][1] < TOPIC_HOT_MIN_SCORE):
+            candidates = sorted(candidates + self.cold_index.search(text, k), key=lambda c: c[1], reverse=True)[:k]
+        return candidates
+
+    def _chunk_text(self, chunk):
+        if isinstance(chunk, str):
+            return chunk
+        # chunk_buffer returns lists of lines (or lists of those)
+        return "\n".join(self._chunk_text(part) for part in chunk)
+
+    def topic_context(self, chunk, budget=TOPIC_CONTEXT_TOKENS):
+        """Prompt context for the topics most relevant to a chunk, within a token budget."""
+        return self.shortlist_context(self.search_topics(self._chunk_text(chunk), TOPIC_CONTEXT_CANDIDATES), budget)
+
+    def shortlist_context(self, candidates, budget=TOPIC_CONTEXT_TOKENS):
+        """Prompt context for the shortlisted and most recently updated topics, within a token budget.
+
+        Topics are ranked by index score plus a recency bonus, so a topic that was just discussed
+        stays in the prompt even when the chunk shares few words with its summary.
+        """
+        with self._lock:
+            scores = {key: score for key, score in candidates if score > 0}
+            for key in islice(reversed(self._recent), TOPIC_CONTEXT_CANDIDATES):
+                scores.setdefault(key, 0.0)
+            ranked = sorted(
+                ((key, score + TOPIC_RECENCY_WEIGHT * self._recency(key)) for key, score in scores.items()),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+            topics = [(key, self.topics[key]["summary"]) for key, _ in ranked]
+        return build_topic_context(topics, budget)
+
+    def _recency(self, topic_key):
+        return recency(self._clock - self.topics[topic_key].get("touched", 0), TOPIC_RECENCY_HALF_LIFE)
+
+    def apply_classification(self, classification, content=None):
+        """Create or update the topic a classification points at and return its key."""
+        topic_key = classification.topic_key
+        if not topic_key or topic_key not in self.topics:
+            # A failed classification carries no description; describe the topic by its content
+            summary = classification.updated_description or (content or "")[:200].strip() or "Untitled topic"
+            topic_key = self.add_new_topic(summary)
+        elif classification.updated_description and classification.updated_description != self.topics[topic_key]["summary"]:
+            # A local match hands back the current summary; rewriting it would only grow the log
+            self.update_topic(topic_key, classification.updated_description)
+
+        if content:
+            self.extend_topic(topic_key, content)
+        return topic_key
+
+    def _is_confident_match(self, candidates):
+        if not candidates or candidates[0][1] < TOPIC_MATCH_THRESHOLD:
+            return False
+        return len(candidates) == 1 or candidates[0][1] - candidates[1][1] >= TOPIC_MATCH_MARGIN
+
     def classify_chunk(self, chunk: str) -> TopicClassification:
+        with metrics.span("classify"):
+            return self._classify_chunk(chunk)
+
+    def _classify_chunk(self, chunk):
+        candidates = []
         try:
-            topics_context = self.list_topics_string()
+            chunk_text = self._chunk_text(chunk)
+            candidates = self.search_topics(chunk_text, TOPIC_SHORTLIST_SIZE)
+
+            if self._is_confident_match(candidates):
+                topic_key = candidates[0][0]
+                print(f"Local topic match: {topic_key} (score {candidates[0][1]:.2f}), skipping Gemini")
+                metrics.inc("classify_local_matches")
+                return TopicClassification(
+                    topic_key=topic_key, updated_description=self.topics[topic_key]["summary"]
+                )
+
+            # Only the shortlist goes into the prompt, so its size stays flat as topics grow
+            topics_context = self.shortlist_context(candidates)
 
             prompt = f"""Given the following existing topics:
 {topics_context}
 
 Analyze this chunk of conversation and determine which topic it belongs to:
-"{chunk}"
+"{chunk_text}"
 
-Return a JSON response with the following structure:
-{{
-    "topic_key": "the_key_if_matches_existing_topic_or_null_if_new_topic",
-    "updated_description": "description_of_topic_based_on_chunk"
-}}
+Set topic_key to the existing topic key the chunk belongs to, and updated_description to a description of the topic based on the chunk.
 
 If the chunk matches an existing topic, return the existing topic_key and an updated_description.
 If the chunk doesn't fit any existing topic, return null for topic_key and generate a description for the new topic given the chunk.
@@ -113,34 +427,21 @@ If the chunk doesn't fit any existing topic, return null for topic_key and gener
 Do not try to merge topics into one topic_key. 
 """
 
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Try to parse JSON response
-            try:
-                # Extract JSON from response if it's wrapped in markdown code blocks
-                if "```json" in response_text:
-                    json_start = response_text.find("```json") + 7
-                    json_end = response_text.find("```", json_start)
-                    json_text = response_text[json_start:json_end].strip()
-                elif "```" in response_text:
-                    json_start = response_text.find("```") + 3
-                    json_end = response_text.find("```", json_start)
-                    json_text = response_text[json_start:json_end].strip()
-                else:
-                    json_text = response_text
-                
-                parsed_response = json.loads(json_text)
-                topic_key = parsed_response.get("topic_key")
-                updated_description = parsed_response.get("updated_description")
-                
-                return TopicClassification(topic_key=topic_key, updated_description=updated_description)
-                
-            except json.JSONDecodeError as json_error:
-                print(f"JSON parsing error: {json_error}")
-                print(f"Response text: {response_text}")
-                return TopicClassification(topic_key=None, updated_description=None)
+            result = generate_structured(
+                self.model, prompt, TopicClassificationResponse, call_site="classify_chunk",
+                session=self.session_id, use_cache=self.use_cache, elidable=topics_context,
+            )
+            return TopicClassification(
+                topic_key=result.topic_key, updated_description=result.updated_description
+            )
 
         except Exception as e:
             print(f"Error classifying chunk: {e}")
+            # Prefer a strong local candidate over a None topic, which could spawn a duplicate; a
+            # weak one may share only a common word and would fold in an unrelated chunk
+            if candidates and candidates[0][1] >= TOPIC_MATCH_THRESHOLD:
+                topic_key = candidates[0][0]
+                return TopicClassification(
+                    topic_key=topic_key, updated_description=self.topics[topic_key]["summary"]
+                )
             return TopicClassification(topic_key=None, updated_description=None)
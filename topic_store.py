@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+from config import TOPIC_SNAPSHOT_EVERY, TOPIC_STORE_FSYNC
+from background_worker import BackgroundWorker
+
+_SEGMENT = re.compile(r"log-(\d+)\.jsonl$")
+_SNAPSHOT = re.compile(r"snapshot-(\d+)$")
+
+
+class TopicStore:
+    """Durable TopicManager state: an append-only mutation log plus periodic snapshots.
+
+    Every mutation is one JSON line [seq, op, topic_key, value] in the current log segment.
+    Every snapshot_every records the log rolls to a new segment and a snapshot of the topics
+    (JSON) and their index vectors (npz) is written on a background thread from a copy taken
+    at that point; older segments and snapshots are then deleted. Restart loads the newest
+    snapshot and replays only the records after its sequence number, so a crash between
+    writing a snapshot and deleting old segments never applies a record twice.
+    """
+
+    def __init__(self, directory, state_fn, snapshot_every=TOPIC_SNAPSHOT_EVERY, fsync=TOPIC_STORE_FSYNC):
+        self.directory = directory
+        self.state_fn = state_fn
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self.seq = 0
+        self.snapshot_seq = 0
+        self._since_snapshot = 0
+        self._segment = None
+        self._lock = threading.Lock()
+        self._writer = BackgroundWorker(self._write_snapshot, name="topic-snapshot-writer")
+
+    def load(self):
+        """Return (snapshot, records): the newest snapshot (or None) and the log records after it."""
+        snapshot = None
+        snapshots = self._listed(_SNAPSHOT)
+        if snapshots:
+            self.snapshot_seq, name = snapshots[-1]
+            path = os.path.join(self.directory, name)
+            with open(os.path.join(path, "topics.json")) as f:
+                snapshot = json.load(f)
+            with np.load(os.path.join(path, "index.npz")) as arrays:
+                snapshot["summary_vectors"] = arrays["summary"]
+                snapshot["content_vectors"] = arrays["content"]
+
+        self.seq = self.snapshot_seq
+        records = []
+        for _, name in self._listed(_SEGMENT):
+            records.extend(self._read_segment(os.path.join(self.directory, name)))
+
+        self._since_snapshot = len(records)
+        self._open_segment()
+        return snapshot, records
+
+    def _read_segment(self, path):
+        records = []
+        good = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated record")
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final write from a crash; cut it off so later appends stay readable
+                    with open(path, "r+b") as out:
+                        out.truncate(good)
+                    break
+                good += len(line)
+                if record[0] > self.seq:
+                    records.append(record)
+                    self.seq = record[0]
+        return records
+
+    def append(self, op, topic_key, value=None):
+        with self._lock:
+            self.seq += 1
+            line = json.dumps([self.seq, op, topic_key, value]) + "\n"
+            self._segment.write(line)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+
+            self._since_snapshot += 1
+            if self._since_snapshot >= self.snapshot_every:
+                self._since_snapshot = 0
+                # Records from here on go to a new segment; the snapshot covers everything before
+                self._open_segment()
+                self._writer.submit(self.seq, self.state_fn())
+
+    def snapshot(self):
+        """Snapshot now and wait for it to be written."""
+        with self._lock:
+            self._since_snapshot = 0
+            self._open_segment()
+            self._writer.submit(self.seq, self.state_fn())
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+        with self._lock:
+            if self._segment:
+                self._segment.close()
+                self._segment = None
+
+    def _open_segment(self):
+        if self._segment:
+            self._segment.close()
+        path = os.path.join(self.directory, f"log-{self.seq + 1:012d}.jsonl")
+        self._segment = open(path, "a")
+
+    def _write_snapshot(self, seq, state):
+        final = os.path.join(self.directory, f"snapshot-{seq:012d}")
+        if os.path.exists(final):
+            return
+        tmp = final + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        with open(os.path.join(tmp, "topics.json"), "w") as f:
+            json.dump({"seq": seq, "keys": state["keys"], "topics": state["topics"]}, f)
+        np.savez(os.path.join(tmp, "index.npz"), summary=state["summary_vectors"], content=state["content_vectors"])
+        os.replace(tmp, final)
+        self.snapshot_seq = seq
+
+        # A new segment was started at seq + 1, so segments starting at or before seq hold only
+        # records the snapshot already covers
+        for first_seq, name in self._listed(_SEGMENT):
+            if first_seq <= seq:
+                os.remove(os.path.join(self.directory, name))
+        for snapshot_seq, name in self._listed(_SNAPSHOT):
+            if snapshot_seq < seq:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _listed(self, pattern):
+        found = []
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                found.append((int(match.group(1)), name))
+        return sorted(found)
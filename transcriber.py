@@ -1,6 +1,5 @@
 import vertexai
 from google.cloud import speech
-import sys
 from config import (
     PROJECT_ID,
     LOCATION,
@@ -9,11 +8,25 @@ from config import (
     RATE,
 )
 from topic_manager import TopicManager
+from llm_client import client as llm_client
+from llm_usage import ledger
+import metrics
 from transcript_buffer_chunker import TranscriptBufferChunker
-from microphone_stream import MicrophoneStream
+from audio_source import open_audio_source
+from voice_activity import VoiceActivityGate
+from streaming_session import RotatingStreamSession
+from word_timeline import WordTimeline
+from event_bus import (
+    EventBus,
+    ConsoleRenderer,
+    InterimEvent,
+    FinalEvent,
+    CleanedEvent,
+    TopicAssignedEvent,
+    publish_responses,
+)
 from config import (
     RATE,
-    CHUNK,
     LANGUAGE_CODE,
     MIN_SPEAKER_COUNT,
     MAX_SPEAKER_COUNT,
@@ -21,48 +34,31 @@ from config import (
     PROJECT_ID,
     LOCATION,
     GEMINI_MODEL,
+    VAD_ENABLED,
 )
 
 class Transcriber:
 
        
 
-    def listen_print_loop(self, responses, transcript_buffer):
-        num_chars_printed = 0
-        for response in responses:
-            if not response.results:
-                continue
-
-            result = response.results[0]
-            if not result.alternatives:
-                continue
-
-            transcript = result.alternatives[0].transcript
-
-            speaker_tag = ""
-            if (
-                result.is_final
-                and hasattr(result.alternatives[0], "words")
-                and result.alternatives[0].words
-            ):
-                words_info = result.alternatives[0].words
-                if words_info and hasattr(words_info[0], "speaker_tag"):
-                    speaker_tag = f"[Speaker {words_info[0].speaker_tag}] "
-
-            overwrite_chars = " " * (num_chars_printed - len(transcript))
-
-            if not result.is_final:
-                sys.stdout.write(transcript + overwrite_chars + "\r")
-                sys.stdout.flush()
-                num_chars_printed = len(transcript)
-            else:
-                print(speaker_tag + transcript + overwrite_chars)
-                transcript_buffer.add_transcript_line(transcript)
-                num_chars_printed = 0
+    def listen_print_loop(self, responses, transcript_buffer, bus):
+        bus.subscribe(
+            "console",
+            ConsoleRenderer().handle,
+            (InterimEvent, FinalEvent, CleanedEvent, TopicAssignedEvent),
+        )
+        bus.subscribe(
+            "chunker",
+            # Labelled like the engine's lines, so turns split by the timeline keep their speaker
+            lambda event: transcript_buffer.add_transcript_line(f"{event.speaker_tag}{event.text}"),
+            FinalEvent,
+        )
+        publish_responses(responses, bus, self.timeline)
 
 
     def __init__(self):
         self.topics_manager = TopicManager()
+        self.timeline = WordTimeline()
         vertexai.init(project=PROJECT_ID, location=LOCATION)
 
         client = speech.SpeechClient()
@@ -86,7 +82,12 @@ class Transcriber:
             interim_results=True,
         )
 
-        transcript_buffer = TranscriptBufferChunker(topics_manager=self.topics_manager)
+        bus = EventBus()
+        transcript_buffer = TranscriptBufferChunker(
+            topics_manager=self.topics_manager,
+            on_cleaned_line=lambda line: bus.publish(CleanedEvent(lines=[line])),
+            on_topic_assigned=lambda topic_key, lines: bus.publish(TopicAssignedEvent(topic_key=topic_key, lines=lines)),
+        )
 
         print("Listening with Speaker Diarization... Press Ctrl+C to stop.")
         print(f"Detecting {MIN_SPEAKER_COUNT}-{MAX_SPEAKER_COUNT} speakers")
@@ -94,16 +95,33 @@ class Transcriber:
         print(f"Using model: {GEMINI_MODEL}")
         print("=" * 60)
 
-        with MicrophoneStream(RATE, CHUNK) as stream:
-            audio_generator = stream.generator()
-            requests = (
-                speech.StreamingRecognizeRequest(audio_content=content)
-                for content in audio_generator
-            )
-
-            responses = client.streaming_recognize(streaming_config, requests)
+        exporter = metrics.MetricsExporter(metrics.registry).start()
 
-            self.listen_print_loop(responses, transcript_buffer)
+        with open_audio_source() as stream:
+            audio_generator = stream.generator()
+            vad = None
+            if VAD_ENABLED:
+                vad = VoiceActivityGate(RATE)
+                audio_generator = vad.gate(audio_generator)
+            # Rotates to a fresh stream before Google's per-stream duration limit
+            session = RotatingStreamSession(client, streaming_config, audio_generator, RATE)
+            responses = session.responses()
+
+            try:
+                self.listen_print_loop(responses, transcript_buffer, bus)
+            finally:
+                # Hand the chunker its last finals, let it publish its final chunk, then drain the console
+                bus.unsubscribe("chunker")
+                transcript_buffer.close()
+                self.topics_manager.close()
+                bus.close()
+                bus.print_stats()
+                ledger.print_stats()
+                llm_client.print_stats()
+                exporter.close()
+                metrics.registry.print_summary()
+                if vad:
+                    print(f"Suppressed {vad.suppressed_fraction:.0%} of audio as silence ({vad.keepalives} keepalives)")
 
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 import time
 import hashlib
+from concurrent.futures import wait
+from itertools import islice
+from typing import List
 import vertexai
 from pydantic import BaseModel
 import instructor
@@ -7,11 +10,19 @@ import google.generativeai as genai
 
 from config import (
     CLEAN_INTERVAL_SECONDS,
+    CLEAN_INCREMENTAL,
+    CLEAN_CONTEXT_LINES,
     GEMINI_MODEL,
     GEMINI_SYSTEM_PROMPT,
+    GEMINI_INCREMENTAL_PROMPT,
     PROJECT_ID,
     LOCATION,
 )
+from background_worker import BackgroundWorker
+from line_store import LineStore
+from llm_cache import cached_instructor_create
+from interval_scheduler import IntervalScheduler
+import metrics
 
 
 class TranscriptCleaningResponse(BaseModel):
@@ -19,59 +30,194 @@ class TranscriptCleaningResponse(BaseModel):
     topic_finished: bool
 
 
+class IncrementalCleaningResponse(BaseModel):
+    cleaned_lines: List[str]
+    topic_finished: bool
+
+
 class TranscriptBuffer:
-    def __init__(self, clean_interval_seconds=CLEAN_INTERVAL_SECONDS):
-        self.buffer = []
+    def __init__(
+        self,
+        clean_interval_seconds=CLEAN_INTERVAL_SECONDS,
+        on_clean=None,
+        incremental=CLEAN_INCREMENTAL,
+        context_lines=CLEAN_CONTEXT_LINES,
+        session_id=None,
+        use_cache=True,
+        client=None,
+    ):
+        # Bounded in memory; older lines spill to disk
+        self.buffer = LineStore(name="transcript")
+        # Token usage is attributed to this session in llm_usage.ledger
+        self.session_id = session_id
+        # False bypasses the shared LLM response cache for this buffer's calls
+        self.use_cache = use_cache
         self.clean_interval = clean_interval_seconds
-        self.last_clean_time = time.time()
-        self.last_hash = None
         self.last_cleaning_result = None
+        self.last_future = None
+
+        self.incremental = incremental
+        self.context_lines = context_lines
+        # Dirty tracking: buffer lines [0, cleaned_upto) are reflected in cleaned_lines
+        self.cleaned_upto = 0
+        self.cleaned_lines = LineStore(name="cleaned")
+        # line hash -> cleaned line, so repeated lines never go back to Gemini
+        self.line_memo = {}
         
-        # Initialize Vertex AI and Instructor client
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        self.client = instructor.from_gemini(model, mode=instructor.Mode.GEMINI_JSON)
+        # Initialize Vertex AI and Instructor client, unless one is passed in (e.g. a fake offline)
+        if client is None:
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+            model = genai.GenerativeModel(GEMINI_MODEL)
+            client = instructor.from_gemini(model, mode=instructor.Mode.GEMINI_JSON)
+        self.client = client
 
+        # Gemini calls run on a background thread so the ASR loop never waits on them. One clean
+        # runs at a time; cleans requested meanwhile merge into a single follow-up covering
+        # every line up to the newest request
+        self.worker = BackgroundWorker(self._run_clean, on_result=on_clean, name="transcript-cleaner", coalesce=True)
+        # Cleans fire on a timer (interval, idle pause, volume), not only when a line arrives
+        self.scheduler = IntervalScheduler(clean_interval_seconds, name="clean").start(self._scheduled_clean)
+        self._closed = False
 
     def add_transcript(self, text, speaker_tag=""):
-        self.buffer.append(
-            {"speaker": speaker_tag, "text": text, "timestamp": time.time()}
-        )
+        self.buffer.append(speaker_tag, text, time.time())
+        metrics.set_gauge("transcript_lines", len(self.buffer))
+        self.scheduler.note()
 
-        if time.time() - self.last_clean_time >= self.clean_interval:
-            self._run_clean()
+    def _scheduled_clean(self):
+        self.last_future = self.worker.submit(len(self.buffer))
+        metrics.set_gauge("clean_queue_depth", self.worker.queue_depth())
+        # Waiting lets the scheduler adapt to the clean's latency, and keeps scheduled cleans from
+        # queueing up behind each other
+        wait([self.last_future])
+        result = None if self.last_future.exception() else self.last_future.result()
+        if result is not None and result.topic_finished:
+            # Lines that arrived during this clean belong to the next topic; clean them now
+            self.scheduler.signal()
 
 
-    def _run_clean(self):
-        if not self.buffer:
-            return
+    def _run_clean(self, line_count=None):
+        if line_count is None:
+            line_count = len(self.buffer)
 
-        raw_transcript = self.get_full_transcript()
-        current_hash = hashlib.sha256(raw_transcript.encode()).hexdigest()
+        if line_count <= self.cleaned_upto:
+            print("\n[Skipping Gemini call - buffer unchanged]\n")
+            return self.last_cleaning_result
 
-        if current_hash != self.last_hash:
-            print("\n" + "=" * 60)
-            print("CLEANING TRANSCRIPT with Gemini (buffer changed)...")
-            print("-" * 60)
+        print("\n" + "=" * 60)
+        print(f"CLEANING TRANSCRIPT with Gemini (buffer changed, {self.queue_depth()} queued)...")
+        print("-" * 60)
 
-            cleaning_result = self.clean_transcript(raw_transcript)
-            self.last_cleaning_result = cleaning_result
+        with metrics.span("clean"):
+            if self.incremental:
+                entries = self.buffer[self.cleaned_upto:line_count]
+                cleaning_result = self._clean_incremental(entries)
+                # Advance by what the slice returned, never past a line that was not read
+                cleaned_upto = self.cleaned_upto + len(entries)
+            else:
+                # Full re-cleans are limited to the in-memory window so their cost stays bounded
+                first = max(0, line_count - self.buffer.window)
+                entries = self.buffer[first:line_count]
+                cleaning_result = self.clean_transcript(self._format_lines(entries))
+                cleaned_upto = first + len(entries)
 
-            print(cleaning_result.cleaned_transcript)
-            print(f"\nTopic finished: {cleaning_result.topic_finished}")
-            print("=" * 60 + "\n")
+        self.last_cleaning_result = cleaning_result
+        self.cleaned_upto = cleaned_upto
 
-            self.last_hash = current_hash
+        print(cleaning_result.cleaned_transcript)
+        print(f"\nTopic finished: {cleaning_result.topic_finished}")
+        print("=" * 60 + "\n")
+
+        return self.last_cleaning_result
+
+    def _clean_incremental(self, entries):
+        new_lines = [self._format_line(entry) for entry in entries]
+        keys = [self._line_hash(line) for line in new_lines]
+
+        pending = {}
+        for key, line in zip(keys, new_lines):
+            if key not in self.line_memo:
+                pending[key] = line
+
+        topic_finished = self.is_topic_finished()
+        if pending:
+            context = [line.text for line in self.cleaned_lines.tail(self.context_lines)] if self.context_lines > 0 else []
+            try:
+                response = self.clean_lines(list(pending.values()), context)
+                topic_finished = response.topic_finished
+            except Exception as e:
+                print(f"Error calling Gemini with Instructor: {e}")
+                # Fallback to the raw lines, without memoizing them as cleaned
+                response = None
+
+            if response is None:
+                cleaned = [self.line_memo.get(key, line) for key, line in zip(keys, new_lines)]
+            elif len(response.cleaned_lines) == len(pending):
+                self.line_memo.update(zip(pending.keys(), response.cleaned_lines))
+                cleaned = [self.line_memo[key] for key in keys]
+                self._trim_line_memo()
+            elif len(pending) == len(new_lines):
+                # The model merged or split lines, so there is no per-line alignment to memoize
+                cleaned = list(response.cleaned_lines)
+            else:
+                # Unaligned output covers only the lines that were sent, so memo hits and repeated
+                # lines have no place in it; clean the whole batch again without the memo instead
+                print(f"Got {len(response.cleaned_lines)} cleaned lines for {len(pending)}, re-cleaning all {len(new_lines)}")
+                try:
+                    response = self.clean_lines(new_lines, context)
+                    topic_finished = response.topic_finished
+                    cleaned = list(response.cleaned_lines)
+                except Exception as e:
+                    print(f"Error calling Gemini with Instructor: {e}")
+                    cleaned = [self.line_memo.get(key, line) for key, line in zip(keys, new_lines)]
         else:
-            print("\n[Skipping Gemini call - buffer unchanged]\n")
+            cleaned = [self.line_memo[key] for key in keys]
+
+        now = time.time()
+        for line in cleaned:
+            self.cleaned_lines.append("", line, now)
+        # Only the newly cleaned lines; get_cleaned_transcript() joins the whole session
+        return TranscriptCleaningResponse(
+            cleaned_transcript="\n".join(cleaned),
+            topic_finished=topic_finished,
+        )
+
+    def _trim_line_memo(self):
+        # Bounded like the line window; dicts keep insertion order, so the oldest go first
+        excess = len(self.line_memo) - self.buffer.window
+        for key in list(islice(self.line_memo, max(excess, 0))):
+            del self.line_memo[key]
 
-        self.last_clean_time = time.time()
+    def clean_lines(self, lines, context):
+        """Clean only `lines`, using already-cleaned `context` lines for continuity."""
+        context_text = "\n".join(context) if context else "(none)"
+        new_text = "\n".join(lines)
+        return cached_instructor_create(
+            self.client,
+            response_model=IncrementalCleaningResponse,
+            call_site="clean_lines",
+            session=self.session_id,
+            use_cache=self.use_cache,
+            # Over budget, only the context is cut; the new lines are always sent whole
+            elidable=context_text,
+            messages=[
+                {"role": "system", "content": GEMINI_INCREMENTAL_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Context (already cleaned):\n{context_text}\n\nNew lines to clean:\n{new_text}",
+                },
+            ],
+        )
 
     def clean_transcript(self, transcript):
         try:
             # Use Instructor to get structured output
-            response = self.client.create(
+            response = cached_instructor_create(
+                self.client,
                 response_model=TranscriptCleaningResponse,
+                call_site="clean_transcript",
+                session=self.session_id,
+                use_cache=self.use_cache,
                 messages=[
                     {"role": "system", "content": GEMINI_SYSTEM_PROMPT},
                     {"role": "user", "content": transcript},
@@ -88,15 +234,24 @@ class TranscriptBuffer:
             )
 
     def get_full_transcript(self):
-        transcript_lines = []
-        for entry in self.buffer:
-            speaker = entry["speaker"].strip()
-            text = entry["text"].strip()
-            if speaker:
-                transcript_lines.append(f"{speaker}{text}")
-            else:
-                transcript_lines.append(text)
-        return "\n".join(transcript_lines)
+        return self._format_lines(self.buffer)
+
+    def get_cleaned_transcript(self):
+        """Every line cleaned so far in incremental mode, including lines spilled to disk."""
+        return "\n".join(line.text for line in self.cleaned_lines)
+
+    def _format_lines(self, lines):
+        return "\n".join(self._format_line(entry) for entry in lines)
+
+    def _format_line(self, entry):
+        speaker = entry.speaker.strip()
+        text = entry.text.strip()
+        if speaker:
+            return f"{speaker}{text}"
+        return text
+
+    def _line_hash(self, line):
+        return hashlib.blake2b(line.encode(), digest_size=16).hexdigest()
 
     def is_topic_finished(self):
         """Check if the current topic has finished based on the last cleaning result."""
@@ -105,3 +260,24 @@ class TranscriptBuffer:
     def get_last_cleaning_result(self):
         """Get the last cleaning result, which includes both cleaned transcript and topic_finished status."""
         return self.last_cleaning_result
+
+    def queue_depth(self):
+        """Number of cleaning jobs waiting for the background worker."""
+        return self.worker.queue_depth()
+
+    def flush(self):
+        """Clean whatever is in the buffer now and wait for the worker to catch up."""
+        self.last_future = self.worker.submit(len(self.buffer))
+        self.worker.flush()
+        return self.last_cleaning_result
+
+    def close(self):
+        # Stops the timer after a final scheduled clean of anything still pending; later calls do nothing
+        if self._closed:
+            return
+        self._closed = True
+        self.scheduler.close()
+        self.flush()
+        self.worker.close()
+        self.buffer.close()
+        self.cleaned_lines.close()
@@ -1,66 +1,338 @@
 import vertexai
 from vertexai.generative_models import GenerativeModel, Tool, GenerationConfig
-from typing import List
+from typing import List, Optional
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from time import time
+from time import perf_counter
 
 from config import (
     GEMINI_MODEL,
     PROJECT_ID,
     LOCATION,
     GEMINI_SYSTEM_PROMPT,
+    CHUNKER_FUSED,
+    CLASSIFY_MAX_WORKERS,
+    LLM_STREAMING,
+    CHUNK_INTERVAL_SECONDS,
 )
 
 from pydantic import BaseModel
+from structured_output import generate_structured, generate_structured_stream
+from topic_manager import TopicClassification
+from interval_scheduler import IntervalScheduler
+import metrics
+
+class CleanedLinesResponse(BaseModel):
+    cleaned_lines: List[str]
+
+class ChunkingResponse(BaseModel):
+    chunks: List[List[int]]
+
+class ChunkTopic(BaseModel):
+    line_numbers: List[int]
+    topic_key: Optional[str] = None
+    updated_description: str
 
 class ResponseSchema(BaseModel):
-    chunks: List[List[str]]
+    cleaned_lines: List[str]
+    chunks: List[ChunkTopic]
 
 class TranscriptBufferChunker:
 
-    def __init__(self, topics_manager):
+    def __init__(self, topics_manager, fused=CHUNKER_FUSED, stream=LLM_STREAMING, on_cleaned_line=None, on_chunk=None, model=None, classify_pool=None, on_topic_assigned=None, session_id=None, clean_interval=CHUNK_INTERVAL_SECONDS, timer=True, use_cache=True):
 
 
-        # lines of transcript
+        # lines of transcript being processed by the current interval
         self.buffer = []
+        # lines that arrived since the last interval started
+        self.pending = []
+        # positions, in the last failed interval's lines, of the lines put back into pending
+        self.requeued = []
+        # positions of the current interval's lines whose chunks were applied to the topics
+        self._applied = set()
+        self._lock = threading.Lock()
         self.topics_manager = topics_manager
+        # Token usage is attributed to this session in llm_usage.ledger
+        self.session_id = session_id
+        # False bypasses the shared LLM response cache for this chunker's calls
+        self.use_cache = use_cache
+
+        if model is None:
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+            model = GenerativeModel(GEMINI_MODEL)
+            print(f"Using model: {GEMINI_MODEL}")
+        self.model = model
+
+        # With timer=True intervals fire on the scheduler's own thread (interval, idle pause,
+        # volume); otherwise the owner polls process_if_due(), which add_transcript_line also calls
+        self.timer = timer
+        self.scheduler = IntervalScheduler(clean_interval, name="chunk")
+        if timer:
+            self.scheduler.start(self.process_pending)
+
+        # One structured call for clean + chunk + classify; the multi-call path is the fallback
+        self.fused = fused
+        self.interval_latencies = deque(maxlen=100)
+
+        # Streaming mode emits cleaned lines and chunk groups as soon as each one closes
+        self.stream = stream
+        self.on_cleaned_line = on_cleaned_line
+        self.on_chunk = on_chunk
+        # Called with (topic_key, chunk_lines) once a chunk's topic has been applied
+        self.on_topic_assigned = on_topic_assigned
+
+        # Chunks are classified concurrently, bounded by the pool size; a pool passed in is
+        # shared with other chunkers and is not shut down by close()
+        self._owns_classify_pool = classify_pool is None
+        self.classify_pool = classify_pool or ThreadPoolExecutor(
+            max_workers=CLASSIFY_MAX_WORKERS, thread_name_prefix="classify"
+        )
 
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        self.model = GenerativeModel(GEMINI_MODEL)
-        print(f"Using model: {GEMINI_MODEL}")
+    
+    def add_transcript_line(self, line):
+        self.add_lines([line])
+
+        if not self.timer:
+            self.process_if_due()
+
+    def add_lines(self, lines):
+        """Queue lines for the next interval without processing anything."""
+        with self._lock:
+            self.pending.extend(lines)
+            metrics.set_gauge("chunker_buffer_lines", len(self.pending))
+        self.scheduler.note(len(lines))
+
+    def take_pending(self):
+        """Remove and return every pending line; lines arriving later go to the next interval."""
+        with self._lock:
+            lines, self.pending = self.pending, []
+        metrics.set_gauge("chunker_buffer_lines", 0)
+        return lines
+
+    def process_if_due(self):
+        """Run an interval now if the scheduler says one is due; returns whether it ran."""
+        reason = self.scheduler.due_reason()
+        if not reason:
+            return False
+        self.scheduler.run_started(reason)
+        try:
+            self.process_pending()
+        finally:
+            self.scheduler.run_finished()
+        return True
 
-        self.last_clean_time = time()
+    def process_pending(self):
+        self.process_lines(self.take_pending())
 
-        self.clean_interval = 10 # seconds
+    def process_lines(self, lines):
+        """Run one interval over lines taken with take_pending().
 
-    
-    def add_transcript_line(self, line):
-        self.buffer.append(line)
+        Cleaned lines correspond one to one with `lines`, and chunks name the positions of the
+        lines they cover. On failure the lines whose chunks were not applied go back to the
+        front of pending, their positions are left in self.requeued, and the error propagates.
+        """
+        self.requeued = []
+        if not lines:
+            return
+        self.buffer = lines
+        self._applied = set()
+        metrics.set_gauge("chunker_batch_lines", len(lines))
+
+        start = perf_counter()
+        mode = "fused"
+        try:
+            if self.fused:
+                # Only a failed or invalid fused call falls back; once its chunks are being
+                # applied, an error propagates instead of re-running the whole interval
+                try:
+                    result, groups = self._request_fused()
+                except Exception as e:
+                    print(f"Fused pipeline failed ({e}), falling back to multi-call path")
+                    mode = "multi-call fallback"
+                    self.buffer = lines
+                    self._process_multi_call()
+                else:
+                    self._apply_fused(result, groups)
+            else:
+                mode = "multi-call"
+                self._process_multi_call()
+        except Exception:
+            # Retry only what was not applied, from the raw lines, so no chunk is applied twice
+            self.requeued = [i for i in range(len(lines)) if i not in self._applied]
+            remaining = [lines[i] for i in self.requeued]
+            with self._lock:
+                self.pending[:0] = remaining
+            self.scheduler.note(len(remaining))
+            self.clear_buffer()
+            raise
+
+        latency = perf_counter() - start
+        self.interval_latencies.append(latency)
+        metrics.observe("chunk_interval", latency, mode=mode)
+        metrics.set_gauge("topics", len(self.topics_manager.index), tier="hot")
+        metrics.set_gauge("topics", len(self.topics_manager.cold_index), tier="cold")
+        print(f"Interval processed in {latency * 1000:.0f} ms ({mode})")
+
+        print("topics_manager.list_topics()", self.topics_manager.list_topics())
 
-        if time() - self.last_clean_time >= self.clean_interval:
-            print("Chunking buffer")
-            chunks = self.chunk_buffer(self.topics_manager.list_topics())
+        self.clear_buffer()
 
-            print("Final chunks output:")
-            for i, chunk in enumerate(chunks):
-                print(f"Chunk {i+1}: {chunk}")
+    def _line_groups(self, groups, strict):
+        """Turn chunks' 1-based line numbers into groups of 0-based positions in self.buffer.
 
-            res = self.topics_manager.classify_chunk(chunks)
+        Every line must be in exactly one group. strict raises ValueError otherwise; if not
+        strict, out-of-range and repeated numbers are dropped and uncovered lines form one more group.
+        """
+        seen = set()
+        result = []
+        for numbers in groups:
+            group = []
+            for number in numbers:
+                index = number - 1
+                if not 0 <= index < len(self.buffer) or index in seen:
+                    if strict:
+                        raise ValueError(f"line number {number} is out of range or in two chunks")
+                    continue
+                seen.add(index)
+                group.append(index)
+            if group:
+                result.append(group)
+            elif strict:
+                raise ValueError("chunk covers no lines")
+        missing = [i for i in range(len(self.buffer)) if i not in seen]
+        if missing:
+            if strict:
+                raise ValueError(f"{len(missing)} lines are in no chunk")
+            result.append(missing)
+        return result
+
+    def _numbered_lines(self):
+        return "\n".join(f"{i}: {line}" for i, line in enumerate(self.buffer, 1))
+
+    def flush(self):
+        """Process any pending lines now, whether or not an interval is due."""
+        if self.pending:
+            self.scheduler.run_started("flush")
+            try:
+                self.process_pending()
+            finally:
+                self.scheduler.run_finished()
+
+    def _process_multi_call(self):
+        print("Chunking buffer")
+        groups = self._chunk_groups(self.topics_manager.topic_context(self.buffer))
+        chunks = [[self.buffer[i] for i in group] for group in groups]
+
+        print("Final chunks output:")
+        for i, chunk in enumerate(chunks):
+            print(f"Chunk {i+1}: {chunk}")
+
+        # Classify each chunk on its own, concurrently, then apply the results in chunk order
+        # so topic state evolves deterministically regardless of which call finished first
+        results = list(self.classify_pool.map(self.topics_manager.classify_chunk, chunks))
+        for group, chunk, res in zip(groups, chunks, results):
             print("res", res.topic_key, res.updated_description)
-            if not res.topic_key:
-                self.topics_manager.add_new_topic(res.updated_description)
-            else:
-                self.topics_manager.update_topic(res.topic_key, res.updated_description)
+            topic_key = self.topics_manager.apply_classification(res, content=self._chunk_content(chunk))
+            self._applied.update(group)
+            self._emit_topic_assigned(topic_key, chunk)
+
+    def _chunk_content(self, chunk):
+        if isinstance(chunk, str):
+            return chunk
+        return "\n".join(str(line) for line in chunk)
+
+    def close(self):
+        # Either way, lines still pending get a final interval before the pool goes away
+        if self.timer:
+            self.scheduler.close()
+        else:
+            self.flush()
+        if self._owns_classify_pool:
+            self.classify_pool.shutdown(wait=True)
+
+    def _request_fused(self):
+        """One fused clean + chunk + classify call over self.buffer, validated before anything is applied.
+
+        Returns the response and its chunks' line positions.
+        """
+        candidates = self.topics_manager.shortlist_topics(self.buffer)
+        topics_context = self.topics_manager.shortlist_context(candidates)
 
-            print("topics_manager.list_topics()", self.topics_manager.list_topics())
-            
-            self.last_clean_time = time()
-            self.clear_buffer()
+        prompt = f"""
+        You are a transcript cleaning and topic analysis assistant. You are given lines of a
+        conversation transcript and a list of existing topics.
+
+        1. Clean every line by removing filler words (um, uh, like, you know, etc.), fixing grammar
+           and punctuation, and maintaining speaker labels, while keeping the original meaning intact.
+           Put the cleaned lines, in order, in cleaned_lines: exactly one entry per numbered line,
+           without its number, and an empty string for a line with nothing left after cleaning.
+        2. Group the lines into chunks, one chunk per conversation topic. Put the numbers of each
+           chunk's lines in chunks[].line_numbers; every line number goes in exactly one chunk.
+        3. For each chunk, set topic_key to the matching existing topic key, or null if it is a new
+           topic, and set updated_description to a description of the topic given the chunk.
+           Do not try to merge topics into one topic_key.
+
+        The existing topics are:
+        {topics_context}
+
+        The lines of text are:
+        {self._numbered_lines()}
+        """
+
+        with metrics.span("fused_pipeline"):
+            result = generate_structured(
+                self.model, prompt, ResponseSchema, call_site="fused_pipeline", session=self.session_id,
+                use_cache=self.use_cache, elidable=topics_context,
+            )
+
+        if len(result.cleaned_lines) != len(self.buffer):
+            raise ValueError(f"fused response has {len(result.cleaned_lines)} cleaned lines for {len(self.buffer)} lines")
+        if not result.chunks:
+            raise ValueError("fused response has no chunks")
+        groups = self._line_groups([chunk.line_numbers for chunk in result.chunks], strict=True)
+        return result, groups
+
+    def _apply_fused(self, result, groups):
+        print("Cleaned lines:", result.cleaned_lines)
+        self.buffer = result.cleaned_lines
+        for line in self.buffer:
+            if line:
+                self._emit_cleaned_line(line)
+
+        for i, (chunk, group) in enumerate(zip(result.chunks, groups)):
+            lines = [self.buffer[j] for j in group]
+            print(f"Chunk {i+1} ({chunk.topic_key}): {lines}")
+            classification = TopicClassification(
+                topic_key=chunk.topic_key, updated_description=chunk.updated_description
+            )
+            topic_key = self.topics_manager.apply_classification(
+                classification, content=self._chunk_content(lines)
+            )
+            self._applied.update(group)
+            self._emit_topic_assigned(topic_key, lines)
 
 
     
     def clear_buffer(self):
         self.buffer = []
+
+    def _emit_cleaned_line(self, line):
+        print(f"  cleaned: {line}")
+        if self.on_cleaned_line:
+            self.on_cleaned_line(line)
+
+    def _emit_chunk(self, numbers):
+        chunk = [self.buffer[n - 1] for n in numbers if isinstance(n, int) and 0 < n <= len(self.buffer)]
+        print(f"  chunk: {chunk}")
+        if self.on_chunk:
+            self.on_chunk(chunk)
+
+    def _emit_topic_assigned(self, topic_key, chunk):
+        if self.on_topic_assigned:
+            lines = [chunk] if isinstance(chunk, str) else [str(line) for line in chunk]
+            self.on_topic_assigned(topic_key, lines)
     
 
     def _clean_buffer(self):
@@ -74,9 +346,8 @@ class TranscriptBufferChunker:
         - Keeping the original meaning intact
         - Making it more readable while staying faithful to the content
         
-        IMPORTANT: Return ONLY a JSON array of strings, where each string is a cleaned line of the transcript.
-        Do not include any other text, explanations, or formatting.
-        Example format: ["Speaker1: Cleaned line 1", "Speaker2: Cleaned line 2", "Speaker1: Cleaned line 3"]
+        Return the cleaned lines, in order, in the cleaned_lines field: exactly one string per
+        input line, and an empty string for a line with nothing left after cleaning.
         """
 
         print("inside cleaning buffer")
@@ -84,39 +355,37 @@ class TranscriptBufferChunker:
         # Create the full prompt
         full_prompt = f"{prompt}\n\nHere is the transcript to clean:\n{"\n".join(self.buffer)}"
         
-        # Use Vertex AI model directly
-        response = self.model.generate_content(full_prompt)
-        
-        # Parse the response as JSON to get a list of lines
         try:
-            import json
-            response_text = response.candidates[0].content.parts[0].text.strip()
-            # Try to extract JSON from the response
-            if response_text.startswith('[') and response_text.endswith(']'):
-                cleaned_lines = json.loads(response_text)
-            else:
-                # If not JSON, try to find JSON in the response
-                start_idx = response_text.find('[')
-                end_idx = response_text.rfind(']') + 1
-                if start_idx != -1 and end_idx != 0:
-                    json_text = response_text[start_idx:end_idx]
-                    cleaned_lines = json.loads(json_text)
+            with metrics.span("chunker_clean"):
+                if self.stream:
+                    result = generate_structured_stream(
+                        self.model, full_prompt, CleanedLinesResponse,
+                        call_site="clean_buffer", on_item=self._emit_cleaned_line, session=self.session_id, use_cache=self.use_cache,
+                    )
                 else:
-                    # Fallback: split by lines and clean each
-                    cleaned_lines = [line.strip() for line in response_text.split('\n') if line.strip()]
-            
-            print("Cleaned lines:", cleaned_lines)
-            self.buffer = cleaned_lines
+                    result = generate_structured(self.model, full_prompt, CleanedLinesResponse, call_site="clean_buffer", session=self.session_id, use_cache=self.use_cache)
+            print("Cleaned lines:", result.cleaned_lines)
+            # Chunks refer to lines by position, so cleaning must not merge or drop any
+            if len(result.cleaned_lines) != len(self.buffer):
+                raise ValueError(f"{len(result.cleaned_lines)} cleaned lines for {len(self.buffer)} lines")
+            self.buffer = result.cleaned_lines
+            if not self.stream:
+                # Streaming already emitted each line as it arrived
+                for line in self.buffer:
+                    if line:
+                        self._emit_cleaned_line(line)
             
         except Exception as e:
-            print(f"Error parsing cleaned response: {e}")
-            print("Raw response:", response.candidates[0].content.parts[0].text)
+            print(f"Error cleaning buffer: {e}")
             # Fallback: use original buffer
-            self.buffer = [line.strip() for line in self.buffer if line.strip()]
+            self.buffer = [line.strip() for line in self.buffer]
 
     def chunk_buffer(self, topics):
+        """Clean the buffer and group its lines by topic; returns the chunks' lines."""
+        return [[self.buffer[i] for i in group] for group in self._chunk_groups(topics)]
 
-        # use the topics to chunk the buffer
+    def _chunk_groups(self, topics):
+        """Clean the buffer and group it by topic; returns each chunk's positions in self.buffer."""
 
         print("Cleaning buffer")
         self._clean_buffer()
@@ -132,48 +401,33 @@ class TranscriptBufferChunker:
         If topics is empty, split based on your judgement of the separation of topics.
 
         The lines of text are:
-        {"\n".join(self.buffer)}
+        {self._numbered_lines()}
         
-        IMPORTANT: Return ONLY a JSON array of arrays, where each inner array contains lines that belong to the same topic.
-        Do not include any other text, explanations, or formatting.
-        Example format: [["Speaker1: Line about topic 1", "Speaker2: Another line about topic 1"], ["Speaker1: Line about topic 2", "Speaker2: Another line about topic 2"]]
+        Return the groups in the chunks field: an array of arrays, where each inner array contains
+        the numbers of the lines that belong to the same topic. Every line number goes in exactly one group.
         
         If a line of text does not belong to any of the topics, add it to a new group.
         """
 
         print("Chunking buffer")
         
-        # Use Vertex AI model directly
-        response = self.model.generate_content(prompt)
-        
-        # Parse the response as JSON to get a list of lists
         try:
-            import json
-            response_text = response.candidates[0].content.parts[0].text.strip()
-            # Try to extract JSON from the response
-            if response_text.startswith('[') and response_text.endswith(']'):
-                chunks = json.loads(response_text)
-            else:
-                # If not JSON, try to find JSON in the response
-                start_idx = response_text.find('[')
-                end_idx = response_text.rfind(']') + 1
-                if start_idx != -1 and end_idx != 0:
-                    json_text = response_text[start_idx:end_idx]
-                    chunks = json.loads(json_text)
+            with metrics.span("chunk"):
+                if self.stream:
+                    result = generate_structured_stream(
+                        self.model, prompt, ChunkingResponse,
+                        call_site="chunk_buffer", on_item=self._emit_chunk, session=self.session_id, use_cache=self.use_cache,
+                        elidable=str(topics),
+                    )
                 else:
-                    # Fallback: create a single chunk with all lines
-                    chunks = [self.buffer]
-            
-            print("Chunks:", chunks)
-            return chunks
+                    result = generate_structured(
+                        self.model, prompt, ChunkingResponse, call_site="chunk_buffer", session=self.session_id,
+                        use_cache=self.use_cache, elidable=str(topics),
+                    )
+            print("Chunks:", result.chunks)
+            return self._line_groups(result.chunks, strict=False)
             
         except Exception as e:
-            print(f"Error parsing chunked response: {e}")
-            print("Raw response:", response.candidates[0].content.parts[0].text)
+            print(f"Error chunking buffer: {e}")
             # Fallback: create a single chunk with all lines
-            return [self.buffer]
-
-        
-
-
-
+            return [list(range(len(self.buffer)))]
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Runs many independent transcription sessions (one per meeting) in a single asyncio process.
+
+    python transcription_engine.py room1.wav room2.wav room3.wav
+"""
+
+import asyncio
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import vertexai
+from google.cloud import speech
+from vertexai.generative_models import GenerativeModel
+
+from audio_source import FileAudioSource
+from config import (
+    RATE,
+    CHUNK,
+    AUDIO_SPEED,
+    LANGUAGE_CODE,
+    MIN_SPEAKER_COUNT,
+    MAX_SPEAKER_COUNT,
+    PROJECT_ID,
+    LOCATION,
+    GEMINI_MODEL,
+    VAD_ENABLED,
+    STREAM_ROTATE_SECONDS,
+    ENGINE_MAX_SESSIONS,
+    ENGINE_MAX_LLM_JOBS,
+    ENGINE_SESSION_MAX_PENDING,
+    TOPIC_STORE_DIR,
+)
+import metrics
+from topic_manager import TopicManager
+from transcript_buffer_chunker import TranscriptBufferChunker
+from voice_activity import VoiceActivityGate
+from word_timeline import WordTimeline
+
+
+def build_streaming_config():
+    diarization_config = speech.SpeakerDiarizationConfig(
+        enable_speaker_diarization=True,
+        min_speaker_count=MIN_SPEAKER_COUNT,
+        max_speaker_count=MAX_SPEAKER_COUNT,
+    )
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=RATE,
+        language_code=LANGUAGE_CODE,
+        diarization_config=diarization_config,
+        enable_word_time_offsets=True,
+    )
+    return speech.StreamingRecognitionConfig(config=config, interim_results=True)
+
+
+class TranscriptionSession:
+    """One meeting: its own audio source, Speech streams, transcript buffer and topic state.
+
+    Finals are handed to the session's chunker through a bounded queue, so a session whose
+    LLM work falls behind stops reading audio instead of growing without limit. Blocking
+    work (audio reads, chunker intervals) runs on the engine's shared thread pools.
+    """
+
+    def __init__(self, session_id, source, engine):
+        self.session_id = session_id
+        self.source = source
+        self.engine = engine
+
+        store_dir = os.path.join(TOPIC_STORE_DIR, re.sub(r"[^\w.-]", "_", str(session_id))) if TOPIC_STORE_DIR else ""
+        self.topics_manager = TopicManager(
+            model=engine.model, store_dir=store_dir, session_id=session_id, use_cache=engine.use_cache
+        )
+        self.chunker = TranscriptBufferChunker(
+            topics_manager=self.topics_manager,
+            model=engine.model,
+            classify_pool=engine.classify_pool,
+            session_id=session_id,
+            use_cache=engine.use_cache,
+            # The pipeline task polls the scheduler so intervals still go through llm_jobs
+            timer=False,
+            **({} if engine.chunk_interval is None else {"clean_interval": engine.chunk_interval}),
+        )
+        self.vad = VoiceActivityGate(RATE) if engine.vad else None
+        self.timeline = WordTimeline()
+
+        self.streams = 0
+        self.finals = 0
+        self.topic_latencies = []
+        self.error = None
+        self._pending = asyncio.Queue(maxsize=ENGINE_SESSION_MAX_PENDING)
+        self._awaiting_topic = []
+        self._audio_done = False
+
+    async def run(self):
+        pipeline = asyncio.create_task(self._run_pipeline())
+        try:
+            with self.source:
+                await self._recognize()
+        except Exception as e:
+            # One failing meeting must not take the others down
+            self.error = e
+            print(f"Session {self.session_id} failed: {e}")
+        finally:
+            await self._pending.put(None)
+            await pipeline
+            await asyncio.get_running_loop().run_in_executor(self.engine.llm_pool, self._close)
+        return self
+
+    def _close(self):
+        self.chunker.close()
+        self.topics_manager.close()
+
+    async def _recognize(self):
+        audio = self._audio_chunks()
+        while not self._audio_done:
+            # Each stream stops taking audio at STREAM_ROTATE_SECONDS and the next one picks up
+            self.streams += 1
+            responses = await self.engine.speech_client.streaming_recognize(requests=self._requests(audio))
+            async for response in responses:
+                await self._handle_response(response)
+
+    async def _requests(self, audio):
+        yield speech.StreamingRecognizeRequest(streaming_config=self.engine.streaming_config)
+        deadline = time.monotonic() + STREAM_ROTATE_SECONDS
+        async for content in audio:
+            yield speech.StreamingRecognizeRequest(audio_content=content)
+            if time.monotonic() >= deadline:
+                return
+        self._audio_done = True
+
+    async def _audio_chunks(self):
+        loop = asyncio.get_running_loop()
+        chunks = self.source.generator()
+        if self.vad:
+            chunks = self.vad.gate(chunks)
+        while True:
+            content = await loop.run_in_executor(self.engine.audio_pool, next, chunks, None)
+            if content is None:
+                return
+            yield content
+
+    async def _handle_response(self, response):
+        if not response.results:
+            return
+        result = response.results[0]
+        if not result.is_final or not result.alternatives:
+            return
+
+        alternative = result.alternatives[0]
+        final_at = time.perf_counter()
+        self.finals += 1
+        if not alternative.words:
+            await self._pending.put((final_at, alternative.transcript))
+            return
+
+        turns = self.timeline.add_words(alternative.words)
+        if len(turns) == 1:
+            await self._pending.put((final_at, f"[Speaker {turns[0].speaker_tag}] {alternative.transcript}"))
+            return
+        for turn in turns:
+            await self._pending.put((final_at, f"[Speaker {turn.speaker_tag}] {turn.text}"))
+
+    async def _run_pipeline(self):
+        # Single flight: at most one chunker interval runs per session. Finals that arrive while
+        # it runs keep being taken off the queue and are merged into exactly one follow-up
+        # interval, so a fast talker stretches intervals instead of stacking up LLM calls
+        getter = None
+        job = None
+        closing = False
+        flushed = False
+        while True:
+            if getter is None and not closing:
+                getter = asyncio.ensure_future(self._pending.get())
+            waiting = {task for task in (getter, job) if task is not None}
+            if not waiting:
+                break
+            timeout = None if job is not None else self.chunker.scheduler.wait_time()
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if job in done:
+                job = None
+            if getter in done:
+                item = getter.result()
+                getter = None
+                if item is None:
+                    closing = True
+                else:
+                    final_at, line = item
+                    metrics.set_gauge("session_pending_finals", self._pending.qsize(), session=self.session_id)
+                    self._awaiting_topic.append(final_at)
+                    self.chunker.add_lines([line])
+
+            if job is None:
+                if closing:
+                    # One last interval for whatever is left; a failed one is not retried
+                    reason = "flush" if self.chunker.pending and not flushed else None
+                    flushed = flushed or reason is not None
+                else:
+                    reason = self.chunker.scheduler.due_reason()
+                if reason:
+                    job = asyncio.create_task(self._run_interval(reason))
+
+    async def _run_interval(self, reason):
+        # Lines are taken here, on the event loop, so the finals they came from are known exactly
+        self.chunker.scheduler.run_started(reason)
+        lines = self.chunker.take_pending()
+        finals, self._awaiting_topic = self._awaiting_topic, []
+        loop = asyncio.get_running_loop()
+        try:
+            waiting = time.perf_counter()
+            async with self.engine.llm_jobs:
+                metrics.observe("llm_job_wait", time.perf_counter() - waiting)
+                await loop.run_in_executor(self.engine.llm_pool, self.chunker.process_lines, lines)
+        except Exception as e:
+            print(f"Session {self.session_id} could not process {len(lines)} lines: {e}")
+            # process_lines put the unapplied lines back in pending; one final per line, so the
+            # finals at the requeued positions wait for the retry and the rest got their topics
+            requeued = set(self.chunker.requeued)
+            self._awaiting_topic[:0] = [t for i, t in enumerate(finals) if i in requeued]
+            self._record_assigned([t for i, t in enumerate(finals) if i not in requeued])
+        else:
+            self._record_assigned(finals)
+        finally:
+            self.chunker.scheduler.run_finished()
+
+    def _record_assigned(self, finals):
+        done = time.perf_counter()
+        self.topic_latencies.extend(done - t for t in finals)
+        for t in finals:
+            metrics.observe("final_to_topic", done - t)
+
+    @property
+    def unassigned_finals(self):
+        return len(self._awaiting_topic)
+
+
+class TranscriptionEngine:
+    """Shared clients and concurrency limits for many TranscriptionSessions.
+
+    The Speech client, Gemini model and thread pools are shared by every session. At most
+    max_sessions sessions run at once (later ones wait for a slot) and at most max_llm_jobs
+    chunker calls run at once across all sessions.
+    """
+
+    def __init__(
+        self,
+        max_sessions=ENGINE_MAX_SESSIONS,
+        max_llm_jobs=ENGINE_MAX_LLM_JOBS,
+        speech_client=None,
+        model=None,
+        vad=VAD_ENABLED,
+        chunk_interval=None,
+        use_cache=True,
+    ):
+        if model is None:
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+            model = GenerativeModel(GEMINI_MODEL)
+        self.model = model
+        self.speech_client = speech_client
+        self.streaming_config = build_streaming_config()
+        self.vad = vad
+        self.chunk_interval = chunk_interval
+        # False keeps every session's LLM calls out of the shared response cache
+        self.use_cache = use_cache
+
+        self.session_slots = asyncio.Semaphore(max_sessions)
+        self.llm_jobs = asyncio.Semaphore(max_llm_jobs)
+        self.llm_pool = ThreadPoolExecutor(max_workers=max_llm_jobs, thread_name_prefix="session-llm")
+        self.classify_pool = ThreadPoolExecutor(max_workers=max_llm_jobs, thread_name_prefix="classify")
+        # Audio reads block (microphone waits, paced file playback), so each running session gets a thread
+        self.audio_pool = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix="session-audio")
+
+    async def run_session(self, session_id, source):
+        async with self.session_slots:
+            if self.speech_client is None:
+                # The gRPC channel binds to the running event loop, so create it lazily
+                self.speech_client = speech.SpeechAsyncClient()
+            session = TranscriptionSession(session_id, source, self)
+            return await session.run()
+
+    async def run(self, sources):
+        """Run one session per {session_id: AudioSource} entry and return the finished sessions."""
+        return await asyncio.gather(*(self.run_session(session_id, source) for session_id, source in sources.items()))
+
+    def close(self):
+        self.llm_pool.shutdown(wait=True)
+        self.classify_pool.shutdown(wait=True)
+        self.audio_pool.shutdown(wait=True)
+
+
+async def main(paths):
+    engine = TranscriptionEngine()
+    exporter = metrics.MetricsExporter(metrics.registry).start()
+    sources = {path: FileAudioSource(path, RATE, CHUNK, speed=AUDIO_SPEED) for path in paths}
+    try:
+        sessions = await engine.run(sources)
+    finally:
+        engine.close()
+        exporter.close()
+
+    metrics.registry.print_summary()
+
+    print("=" * 60)
+    for session in sessions:
+        status = f"failed: {session.error}" if session.error else "ok"
+        print(f"{session.session_id}: {session.finals} finals, {len(session.topics_manager.topics)} topics ({status})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python transcription_engine.py AUDIO_FILE [AUDIO_FILE ...]")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1:]))
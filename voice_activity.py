@@ -0,0 +1,137 @@
+from collections import deque
+
+import numpy as np
+
+from config import (
+    VAD_FRAME_MS,
+    VAD_RMS_THRESHOLD,
+    VAD_ZCR_MAX,
+    VAD_HANGOVER_MS,
+    VAD_PREROLL_MS,
+    VAD_KEEPALIVE_SECONDS,
+)
+
+# paInt16 mono
+BYTES_PER_SAMPLE = 2
+
+
+class VoiceActivityGate:
+    """Energy-based voice activity gate for paInt16 audio chunks.
+
+    Each chunk is split into short frames and RMS energy and zero-crossing rate are computed
+    for all frames at once with NumPy. A frame counts as speech when it is loud enough and
+    not noise-like (very high ZCR). Audio keeps flowing for a hangover period after speech
+    and a pre-roll of the audio before speech onset is sent with it, so word edges survive.
+    Long silences are dropped except for a short silent keepalive frame every few seconds,
+    which keeps the streaming session from timing out.
+    """
+
+    def __init__(
+        self,
+        rate,
+        frame_ms=VAD_FRAME_MS,
+        rms_threshold=VAD_RMS_THRESHOLD,
+        zcr_max=VAD_ZCR_MAX,
+        hangover_ms=VAD_HANGOVER_MS,
+        preroll_ms=VAD_PREROLL_MS,
+        keepalive_seconds=VAD_KEEPALIVE_SECONDS,
+    ):
+        self.frame_len = int(rate * frame_ms / 1000)
+        self.frame_seconds = frame_ms / 1000
+        self.rms_threshold = rms_threshold
+        self.zcr_max = zcr_max
+        self.hangover_frames = int(hangover_ms / frame_ms)
+        self.preroll_frames = int(preroll_ms / frame_ms)
+        self.keepalive_frames = int(keepalive_seconds / self.frame_seconds)
+
+        self._remainder = b""
+        self._preroll = deque(maxlen=max(self.preroll_frames, 1))
+        self._frames_since_speech = self.hangover_frames + 1
+        self._frames_since_send = 0
+
+        self.total_frames = 0
+        self.suppressed_frames = 0
+        self.keepalives = 0
+
+    @property
+    def suppressed_fraction(self):
+        return self.suppressed_frames / self.total_frames if self.total_frames else 0.0
+
+    def gate(self, chunks):
+        """Wrap an audio chunk generator, yielding only the audio worth sending."""
+        for chunk in chunks:
+            data = self.process(chunk)
+            if data:
+                yield data
+
+    def process(self, chunk):
+        samples = np.frombuffer(self._remainder + chunk, dtype=np.int16)
+        n_frames = len(samples) // self.frame_len
+        used = n_frames * self.frame_len
+        self._remainder = samples[used:].tobytes()
+        if n_frames == 0:
+            return b""
+
+        frames = samples[:used].reshape(n_frames, self.frame_len)
+        speech = self.speech_frames(frames)
+        active = self._active_frames(speech)
+
+        self.total_frames += n_frames
+        sent = int(active.sum())
+        self.suppressed_frames += n_frames - sent
+
+        parts = []
+        if sent:
+            # Audio just before onset that an earlier chunk held back
+            first_active = int(np.argmax(active))
+            needed = self.preroll_frames - first_active
+            if speech.any() and needed > 0 and self._preroll:
+                held = list(self._preroll)[-needed:]
+                parts.extend(held)
+                self.suppressed_frames -= len(held)
+            parts.append(frames[active].tobytes())
+
+            last_active = n_frames - 1 - int(np.argmax(active[::-1]))
+            tail = frames[last_active + 1:]
+            self._preroll.clear()
+            self._frames_since_send = len(tail)
+        else:
+            tail = frames
+            self._frames_since_send += n_frames
+        self._preroll.extend(frame.tobytes() for frame in tail[-self._preroll.maxlen:])
+
+        if speech.any():
+            self._frames_since_speech = n_frames - 1 - int(np.flatnonzero(speech)[-1])
+        else:
+            self._frames_since_speech += n_frames
+
+        if not parts and self.keepalive_frames and self._frames_since_send >= self.keepalive_frames:
+            self._frames_since_send = 0
+            self.keepalives += 1
+            return bytes(self.frame_len * BYTES_PER_SAMPLE)
+
+        return b"".join(parts)
+
+    def speech_frames(self, frames):
+        """Boolean speech decision per frame from RMS energy and zero-crossing rate."""
+        x = frames.astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        return (rms >= self.rms_threshold) & (zcr <= self.zcr_max)
+
+    def _active_frames(self, speech):
+        n = len(speech)
+        idx = np.arange(n)
+
+        # Hangover: frames within hangover_frames after the latest speech, carried across chunks
+        last_speech = np.where(speech, idx, -self._frames_since_speech - 1)
+        last_speech = np.maximum.accumulate(last_speech)
+        active = (idx - last_speech) <= self.hangover_frames
+
+        # Pre-roll within this chunk: frames within preroll_frames before the next speech frame
+        if self.preroll_frames and speech.any():
+            next_speech = np.where(speech, idx, n + self.preroll_frames + 1)
+            next_speech = np.minimum.accumulate(next_speech[::-1])[::-1]
+            active |= (next_speech - idx) <= self.preroll_frames
+        return active
@@ -0,0 +1,116 @@
+from array import array
+from typing import NamedTuple
+
+import numpy as np
+
+
+class SpeakerTurn(NamedTuple):
+    speaker_tag: int
+    text: str
+    start: float
+    end: float
+
+
+class WordTimeline:
+    """Every recognized word with its speaker tag and time offsets, stored column-wise.
+
+    Words are interned into a string table and the columns are typed arrays (4 + 2 + 4 + 4
+    bytes per word), so a long meeting costs a small fraction of per-word dicts or protobuf
+    messages. Offsets are kept in milliseconds. Words must be added in time order, which is
+    what lets time-range queries binary search the end column.
+    """
+
+    def __init__(self):
+        self._strings = []
+        self._string_ids = {}
+
+        self.word_ids = array("I")
+        self.speakers = array("H")
+        self.start_ms = array("I")
+        self.end_ms = array("I")
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def intern(self, word):
+        string_id = self._string_ids.get(word)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_ids[word] = string_id
+            self._strings.append(word)
+        return string_id
+
+    def add_words(self, words):
+        """Append Speech word infos and return the speaker turns they form."""
+        first = len(self)
+        for word in words:
+            self.word_ids.append(self.intern(word.word))
+            self.speakers.append(getattr(word, "speaker_tag", 0))
+            self.start_ms.append(_to_ms(getattr(word, "start_time", None)))
+            self.end_ms.append(_to_ms(getattr(word, "end_time", None)))
+        return self.turns(first, len(self))
+
+    def turns(self, first=0, last=None):
+        """Split words [first, last) into runs of the same speaker."""
+        last = len(self) if last is None else last
+        if first >= last:
+            return []
+
+        speakers = np.frombuffer(self.speakers, dtype=np.uint16)[first:last]
+        # Index (within the slice) where each new speaker run starts
+        starts = (np.flatnonzero(speakers[1:] != speakers[:-1]) + 1).tolist()
+        bounds = [0] + starts + [last - first]
+        del speakers
+
+        return [
+            SpeakerTurn(
+                speaker_tag=self.speakers[first + a],
+                text=self.text(first + a, first + b),
+                start=self.start_ms[first + a] / 1000,
+                end=self.end_ms[first + b - 1] / 1000,
+            )
+            for a, b in zip(bounds, bounds[1:])
+        ]
+
+    def text(self, first, last):
+        return " ".join(self._strings[self.word_ids[i]] for i in range(first, last))
+
+    def index_range(self, start, end):
+        """Indices [first, last) of the words that overlap [start, end) seconds."""
+        ends = np.frombuffer(self.end_ms, dtype=np.uint32)
+        starts = np.frombuffer(self.start_ms, dtype=np.uint32)
+        first = int(np.searchsorted(ends, int(start * 1000), side="right"))
+        last = int(np.searchsorted(starts, int(end * 1000), side="left"))
+        # The arrays cannot grow while NumPy views export their buffers
+        del ends, starts
+        return first, max(first, last)
+
+    def words_between(self, start, end):
+        """Speaker turns covering the words between start and end seconds."""
+        return self.turns(*self.index_range(start, end))
+
+    def speaker_indices(self, speaker_tag):
+        speakers = np.frombuffer(self.speakers, dtype=np.uint16)
+        indices = np.flatnonzero(speakers == speaker_tag)
+        del speakers
+        return indices
+
+    def speaker_text(self, speaker_tag):
+        return " ".join(self._strings[self.word_ids[i]] for i in self.speaker_indices(speaker_tag).tolist())
+
+    def talk_time(self):
+        """Seconds of speech per speaker tag, from word durations."""
+        speakers = np.frombuffer(self.speakers, dtype=np.uint16)
+        durations = np.frombuffer(self.end_ms, dtype=np.uint32).astype(np.int64) - np.frombuffer(self.start_ms, dtype=np.uint32)
+        totals = np.bincount(speakers, weights=durations) if len(speakers) else np.zeros(0)
+        del speakers
+        return {tag: total / 1000 for tag, total in enumerate(totals.tolist()) if total > 0}
+
+    def nbytes(self):
+        columns = sum(column.itemsize * len(column) for column in (self.word_ids, self.speakers, self.start_ms, self.end_ms))
+        strings = sum(len(s) for s in self._strings)
+        return columns + strings
+
+
+def _to_ms(offset):
+    return int(round(offset.total_seconds() * 1000)) if offset is not None else 0